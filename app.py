@@ -12,6 +12,7 @@ eks_admin_rolename = (
     "Admin"  # Set this to the Admin role in your AWS account, this is typically 'Admin'
 )
 trusted_registries = "111111111111.dkr.ecr.us-east-1.amazonaws.com,busybox"
+allowlist_bucket = None  # Set this to the S3 bucket of s3:// trusted registry allowlists, if any
 ##########################################################################################################
 
 
@@ -25,6 +26,7 @@ config_stack = lambdaStack(
     eks_lambda_role=eks_stack.lambda_role,
     eks_cluster=eks_stack.cluster.cluster_name,
     trusted_registries=trusted_registries,
+    allowlist_bucket=allowlist_bucket,
 )
 
 app.synth()
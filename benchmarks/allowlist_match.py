@@ -0,0 +1,115 @@
+"""Compares the compiled registry allowlist matcher with a linear scan
+
+Builds allowlists of ECR registries with exact hosts, region wildcards,
+repository prefixes and pinned digests, and matches a stream of image
+references against them, half of which are allowed. The linear scan
+fnmatches every entry against each image, as matching a list of patterns
+would without compiling them, so it is timed on a sample of the images and
+its time per image extrapolated.
+
+Run from the repository root:
+
+    python benchmarks/allowlist_match.py --patterns 10000 --images 100000
+"""
+import random
+import fnmatch
+import argparse
+
+import harness
+import eksconfigauthutils.allowlistutils as allowlistutils
+import eksconfigauthutils.imageutils as imageutils
+
+REGIONS = ["us-east-1", "us-west-2", "eu-west-1", "ap-southeast-2"]
+
+"""images timed with the linear scan"""
+LINEAR_SAMPLE = 200
+
+
+def account(index):
+    return f"{100000000000 + index}"
+
+
+def make_entry(index):
+    registry = f"{account(index)}.dkr.ecr"
+    kind = index % 4
+    if kind == 0:
+        return f"{registry}.{REGIONS[index % len(REGIONS)]}.amazonaws.com"
+    if kind == 1:
+        return f"{registry}.*.amazonaws.com/team-{index}-*"
+    if kind == 2:
+        return f"{registry}.{REGIONS[index % len(REGIONS)]}.amazonaws.com/app-{index}"
+    return f"{registry}.{REGIONS[index % len(REGIONS)]}.amazonaws.com/app-{index}@sha256:{index:064x}"
+
+
+def make_image(index, patterns, generator):
+    """Returns an image allowed by entry index, or one of an unknown account for odd indexes"""
+    entry = index % patterns
+    region = REGIONS[entry % len(REGIONS)]
+    if index % 2:
+        return f"{account(patterns + entry)}.dkr.ecr.{region}.amazonaws.com/app:{index}"
+    registry = f"{account(entry)}.dkr.ecr.{region}.amazonaws.com"
+    kind = entry % 4
+    if kind == 0:
+        return f"{registry}/service-{generator.randrange(100)}:v1"
+    if kind == 1:
+        return f"{registry}/team-{entry}-api/server:v2"
+    if kind == 2:
+        return f"{registry}/app-{entry}:v3"
+    return f"{registry}/app-{entry}@sha256:{entry:064x}"
+
+
+def linear_match(entries, image):
+    """Matches the way a list of glob patterns is matched without compiling it"""
+    reference = imageutils.parse_image(image)
+    name = f"{reference.registry}/{reference.repository}"
+    for entry in entries:
+        pattern, _, digest = entry.partition("@")
+        if digest:
+            if reference.digest == digest and fnmatch.fnmatchcase(name, pattern):
+                return True
+        elif fnmatch.fnmatchcase(name, pattern) or fnmatch.fnmatchcase(name, f"{pattern}/*"):
+            return True
+    return False
+
+
+def match_all(matcher, images):
+    return sum(matcher.matches_reference(image) for image in images)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patterns", default="1000,10000")
+    parser.add_argument("--images", type=int, default=100000)
+    arguments = parser.parse_args()
+    rows = []
+    for patterns in harness.parse_sizes(arguments.patterns):
+        generator = random.Random(patterns)
+        entries = [make_entry(index) for index in range(patterns)]
+        images = [make_image(index, patterns, generator) for index in range(arguments.images)]
+        build_seconds, matcher = harness.timed(allowlistutils.RegistryMatcher, entries)
+        seconds, allowed = harness.timed(match_all, matcher, images)
+        assert allowed == len(images) // 2
+        rows.append(
+            (patterns, len(images), "compiled", build_seconds, seconds, seconds / len(images) * 1e6)
+        )
+        sample = images[:LINEAR_SAMPLE]
+        seconds, _ = harness.timed(lambda: [linear_match(entries, image) for image in sample])
+        per_image = seconds / len(sample)
+        rows.append(
+            (patterns, len(images), "linear", 0.0, per_image * len(images), per_image * 1e6)
+        )
+    harness.print_table(
+        [
+            ("patterns", 9, ""),
+            ("images", 8, ""),
+            ("matcher", 9, ""),
+            ("build s", 8, ".3f"),
+            ("match s", 9, ".2f"),
+            ("us/image", 9, ".1f"),
+        ],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Compares the end-to-end wall time of a rule run with the threads and asyncio runtimes
+
+Runs the shared evaluation path of the privilege escalation rule over a
+fleet of clusters: resolving the clusters, describing each one and signing
+its token, listing its pods in pages, evaluating them and finally sending
+the findings to SQS and putting the evaluations to Config. EKS, the token
+signing, the Kubernetes API, SQS and Config are local stand-ins that wait
+--latency milliseconds per call, so the runtimes are compared on how they
+overlap the calls rather than on the network. Every run starts from a cold
+container, without cached credentials or cluster metadata.
+
+Run from the repository root:
+
+    python benchmarks/fleet_runtime.py --clusters 20 --pods 2000 --latency 50
+"""
+import os
+import time
+import argparse
+from datetime import datetime, timedelta
+
+import harness
+import eksconfigauthutils.asyncutils as asyncutils
+import eksconfigauthutils.authutils as authutils
+import eksconfigauthutils.checkengine as checkengine
+import eksconfigauthutils.checks
+import eksconfigauthutils.clientutils as clientutils
+import eksconfigauthutils.clusterutils as clusterutils
+import eksconfigauthutils.evalutils as evalutils
+import eksconfigauthutils.snapshotutils as snapshotutils
+import eksconfigauthutils.sqsutils as sqsutils
+import eksconfigauthutils.stateutils as stateutils
+from eksconfigauthutils.localclients import LocalSQSClient
+
+RUNTIMES = [clusterutils.THREADS, clusterutils.ASYNCIO]
+
+
+class StandIns:
+    """EKS, token signing, Kubernetes, SQS and Config calls that each take latency seconds"""
+
+    def __init__(self, latency, pods):
+        self.latency = latency
+        self.pods = pods
+        self.sqs = LocalSQSClient()
+
+    def describe_cluster(self, name):
+        time.sleep(self.latency)
+        return {
+            "cluster": {
+                "name": name,
+                "arn": f"arn:aws:eks:us-east-1:111111111111:cluster/{name}",
+                "endpoint": f"https://{name}.eks.local",
+                "certificateAuthority": {},
+            }
+        }
+
+    def generate_token(self, cluster_name):
+        time.sleep(self.latency)
+        return f"token-{cluster_name}", datetime.utcnow() + timedelta(minutes=14)
+
+    def kind_list_fn(self, cluster_name, kind, metadata_only=False):
+        authutils.get_cached_cluster(cluster_name)
+
+        def list_fn(limit=None, watch=False, _continue=None, **kwargs):
+            time.sleep(self.latency)
+            start = int(_continue or 0)
+            end = start + (limit or len(self.pods))
+            return {
+                "metadata": {
+                    "resourceVersion": "100",
+                    "continue": str(end) if end < len(self.pods) else None,
+                },
+                "items": self.pods[start:end],
+            }
+
+        return list_fn
+
+    def send_message_batch(self, QueueUrl, Entries):
+        time.sleep(self.latency)
+        return self.sqs.send_message_batch(QueueUrl, Entries)
+
+    def put_evaluations(self, Evaluations, ResultToken, TestMode):
+        time.sleep(self.latency)
+        return {"FailedEvaluations": []}
+
+
+def install(stand_ins):
+    clientutils._clients["eks"] = stand_ins
+    authutils.generate_token = stand_ins.generate_token
+    checkengine.kind_list_fn = stand_ins.kind_list_fn
+    os.environ["RESOURCE_VERSION_MEMO"] = "false"
+    snapshotutils._store = None
+
+
+def run_rule(runtime, clusters, stand_ins):
+    """Runs the rule over clusters from a cold container, returns the findings sent"""
+    os.environ["EVALUATION_RUNTIME"] = runtime
+    authutils._clusters.clear()
+    clusterutils._metadata.clear()
+    stateutils._store = stateutils.MemoryStateStore()
+    in_scope = clusterutils.resolve_clusters(",".join(clusters))
+    evaluations = clusterutils.evaluate_clusters(
+        lambda cluster_name: checkengine.run_check(cluster_name, "privEscalation"), in_scope
+    )
+    findings_producer = sqsutils.FindingsProducer("fleet-queue", sqs=stand_ins)
+    config_evaluations = evalutils.EvaluationAccumulator("token", client=stand_ins)
+    for cluster_name, evaluation in evaluations:
+        findings_producer.add(
+            {"compliance_status": evaluation["compliance_type"], "event_details": evaluation["annotation"]},
+            evaluation["clusterarn"],
+        )
+        config_evaluations.add(
+            evaluation["clusterarn"], evaluation["compliance_type"], "check security hub", "now"
+        )
+    sent_keys, failed_evaluations = asyncutils.flush_writes(findings_producer, config_evaluations)
+    assert not failed_evaluations
+    return len(sent_keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clusters", type=int, default=20)
+    parser.add_argument("--pods", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=50, help="milliseconds per call")
+    parser.add_argument("--workers", type=int, default=clusterutils.DEFAULT_MAX_WORKERS)
+    arguments = parser.parse_args()
+    os.environ["MAX_CLUSTER_WORKERS"] = str(arguments.workers)
+    stand_ins = StandIns(
+        arguments.latency / 1000, [harness.make_pod(index) for index in range(arguments.pods)]
+    )
+    install(stand_ins)
+    clusters = [f"cluster-{index}" for index in range(arguments.clusters)]
+    rows = []
+    for runtime in RUNTIMES:
+        seconds, sent = harness.timed(run_rule, runtime, clusters, stand_ins)
+        assert sent == len(clusters)
+        rows.append((runtime, len(clusters), arguments.pods, seconds, seconds / len(clusters)))
+    harness.print_table(
+        [
+            ("runtime", 8, ""),
+            ("clusters", 8, ""),
+            ("pods", 6, ""),
+            ("wall s", 7, ".2f"),
+            ("s/cluster", 9, ".3f"),
+        ],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
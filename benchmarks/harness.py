@@ -0,0 +1,198 @@
+"""Shared helpers of the benchmarks: synthetic pod lists, timing and result tables
+
+The synthetic pods look like the pods of a Deployment on EKS, with the
+metadata, spec and status fields the API server returns. encode_protobuf
+encodes them with the field numbers of k8s.io/api, including fields the
+checks don't read, so the protobuf sizes are close to a real response.
+"""
+import os
+import sys
+import gc
+import json
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(__file__), "..", "resources", "kubernetes_layer", "python")
+)
+
+import eksconfigauthutils.protoutils as protoutils
+from eksconfigauthutils.protoutils import STRING, BOOL, INT, MESSAGE, MAP
+
+DEFAULT_SIZES = "1000,10000,50000"
+
+"""fields of a full pod, as a superset of the schemas protoutils decodes"""
+TIME = {1: ("seconds", INT, False, None)}
+CONTAINER_PORT = {3: ("containerPort", INT, False, None), 4: ("protocol", STRING, False, None)}
+ENV_VAR = {1: ("name", STRING, False, None), 2: ("value", STRING, False, None)}
+RESOURCES = {1: ("limits", MAP, False, None), 2: ("requests", MAP, False, None)}
+VOLUME_MOUNT = {
+    1: ("name", STRING, False, None),
+    2: ("readOnly", BOOL, False, None),
+    3: ("mountPath", STRING, False, None),
+}
+CONTAINER = {
+    **protoutils.CONTAINER,
+    6: ("ports", MESSAGE, True, CONTAINER_PORT),
+    7: ("env", MESSAGE, True, ENV_VAR),
+    8: ("resources", MESSAGE, False, RESOURCES),
+    9: ("volumeMounts", MESSAGE, True, VOLUME_MOUNT),
+}
+OWNER_REFERENCE = {**protoutils.OWNER_REFERENCE, 7: ("blockOwnerDeletion", BOOL, False, None)}
+OBJECT_META = {
+    **protoutils.OBJECT_META,
+    8: ("creationTimestamp", MESSAGE, False, TIME),
+    13: ("ownerReferences", MESSAGE, True, OWNER_REFERENCE),
+}
+VOLUME = {1: ("name", STRING, False, None)}
+POD_SPEC = {
+    **protoutils.POD_SPEC,
+    1: ("volumes", MESSAGE, True, VOLUME),
+    2: ("containers", MESSAGE, True, CONTAINER),
+}
+CONDITION = {
+    1: ("type", STRING, False, None),
+    2: ("status", STRING, False, None),
+    4: ("lastTransitionTime", MESSAGE, False, TIME),
+}
+CONTAINER_STATUS = {
+    1: ("name", STRING, False, None),
+    4: ("ready", BOOL, False, None),
+    5: ("restartCount", INT, False, None),
+    6: ("image", STRING, False, None),
+    7: ("imageID", STRING, False, None),
+}
+POD_STATUS = {
+    **protoutils.POD_STATUS,
+    2: ("conditions", MESSAGE, True, CONDITION),
+    6: ("podIP", STRING, False, None),
+    7: ("startTime", MESSAGE, False, TIME),
+    8: ("containerStatuses", MESSAGE, True, CONTAINER_STATUS),
+}
+FULL_POD_LIST = protoutils.list_schema(
+    {
+    1: ("metadata", MESSAGE, False, OBJECT_META),
+    2: ("spec", MESSAGE, False, POD_SPEC),
+    3: ("status", MESSAGE, False, POD_STATUS),
+    }
+)
+
+
+def make_pod(index):
+    name = f"web-{index // 3}-{index % 3}"
+    return {
+        "metadata": {
+            "name": name,
+            "namespace": f"team-{index % 20}",
+            "uid": f"00000000-0000-0000-0000-{index:012d}",
+            "resourceVersion": str(100000 + index),
+            "creationTimestamp": "2022-06-01T10:00:00Z",
+            "labels": {"app": f"web-{index // 3}", "pod-template-hash": "5d8f7c9b6"},
+            "annotations": {"kubernetes.io/psp": "eks.privileged"},
+            "ownerReferences": [
+                {
+                    "apiVersion": "apps/v1",
+                    "kind": "ReplicaSet",
+                    "name": f"web-{index // 3}-5d8f7c9b6",
+                    "uid": f"11111111-0000-0000-0000-{index // 3:012d}",
+                    "controller": True,
+                    "blockOwnerDeletion": True,
+                }
+            ],
+        },
+        "spec": {
+            "containers": [
+                {
+                    "name": "app",
+                    "image": "602401143452.dkr.ecr.us-east-1.amazonaws.com/app:1.2.3",
+                    "ports": [{"containerPort": 8080, "protocol": "TCP"}],
+                    "env": [{"name": f"VAR_{i}", "value": str(i)} for i in range(5)],
+                    "resources": {
+                        "limits": {"cpu": "500m", "memory": "256Mi"},
+                        "requests": {"cpu": "250m", "memory": "128Mi"},
+                    },
+                    "volumeMounts": [
+                        {
+                            "name": "kube-api-access",
+                            "mountPath": "/var/run/secrets/kubernetes.io/serviceaccount",
+                            "readOnly": True,
+                        }
+                    ],
+                    "securityContext": {"allowPrivilegeEscalation": index % 50 == 0},
+                },
+                {
+                    "name": "sidecar",
+                    "image": "docker.io/envoyproxy/envoy:v1.22.0",
+                    "securityContext": {"allowPrivilegeEscalation": False},
+                },
+            ],
+            "nodeName": f"ip-10-0-{index % 250}-1.ec2.internal",
+            "serviceAccountName": "default",
+            "volumes": [{"name": "kube-api-access", "projected": {"sources": []}}],
+        },
+        "status": {
+            "phase": "Running",
+            "podIP": "10.0.1.1",
+            "startTime": "2022-06-01T10:00:05Z",
+            "conditions": [
+                {"type": t, "status": "True", "lastTransitionTime": "2022-06-01T10:00:05Z"}
+                for t in ["Initialized", "Ready", "ContainersReady", "PodScheduled"]
+            ],
+            "containerStatuses": [
+                {
+                    "name": "app",
+                    "ready": True,
+                    "restartCount": 0,
+                    "image": "602401143452.dkr.ecr.us-east-1.amazonaws.com/app:1.2.3",
+                    "imageID": "docker-pullable://602401143452.dkr.ecr.us-east-1.amazonaws.com/app@sha256:abc",
+                    "state": {"running": {"startedAt": "2022-06-01T10:00:06Z"}},
+                }
+            ],
+        },
+    }
+
+
+def make_pod_list(size):
+    return {
+        "kind": "PodList",
+        "apiVersion": "v1",
+        "metadata": {"resourceVersion": "200000"},
+        "items": [make_pod(i) for i in range(size)],
+    }
+
+
+def encode_json(pod_list):
+    return json.dumps(pod_list).encode()
+
+
+def to_protobuf_values(value):
+    """Replaces the timestamps of a pod by seconds, as protobuf encodes them"""
+    if isinstance(value, dict):
+        return {key: to_protobuf_values(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_protobuf_values(item) for item in value]
+    if isinstance(value, str) and value.endswith("Z") and value[:4].isdigit():
+        return {"seconds": 1654077600}
+    return value
+
+
+def encode_protobuf(pod_list):
+    return protoutils.encode_list(to_protobuf_values(pod_list), FULL_POD_LIST)
+
+
+def timed(fn, *args):
+    """Returns the seconds taken by fn and its result"""
+    gc.collect()
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def parse_sizes(sizes):
+    return [int(size) for size in sizes.split(",")]
+
+
+def print_table(columns, rows):
+    """Prints rows of values under columns of (title, width, format)"""
+    print(" ".join(f"{title:>{width}}" for title, width, _ in columns))
+    for row in rows:
+        print(" ".join(f"{value:>{width}{spec}}" for value, (_, width, spec) in zip(row, columns)))
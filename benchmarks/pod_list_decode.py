@@ -0,0 +1,86 @@
+"""Compares decoding a pod list into V1Pod models with the raw JSON path
+
+Builds synthetic PodList responses and times decoding them the way the
+generated client does (ApiClient.deserialize into V1PodList) against
+json.loads and orjson.loads into dicts, each followed by the privilege
+escalation check over the decoded pods.
+
+Run from the repository root:
+
+    python benchmarks/pod_list_decode.py --sizes 1000,10000,50000
+"""
+import json
+import argparse
+from types import SimpleNamespace
+
+import harness
+import kubernetes
+import eksconfigauthutils.checks as checks
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def check_dicts(pods):
+    check = checks.PrivEscalationCheck("bench")
+    for pod in pods:
+        check.visit("pods", pod)
+    return check.result()
+
+
+def check_models(pods):
+    """the privilege escalation check as it read V1Pod models before the raw JSON path"""
+    noncompliantpods = []
+    for pod in pods:
+        for i in pod.spec.containers:
+            if str(i.security_context) == "None":
+                break
+            if i.security_context.__dict__["_allow_privilege_escalation"] == True:
+                noncompliantpods.append(i.name)
+    return noncompliantpods
+
+
+def decode_models(raw):
+    api_client = kubernetes.client.ApiClient()
+    return api_client.deserialize(SimpleNamespace(data=raw), "V1PodList").items
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=harness.DEFAULT_SIZES)
+    arguments = parser.parse_args()
+    decoders = [("V1Pod models", decode_models), ("json.loads", json.loads)]
+    if orjson is not None:
+        decoders.append(("orjson.loads", orjson.loads))
+    rows = []
+    for size in harness.parse_sizes(arguments.sizes):
+        raw = harness.encode_json(harness.make_pod_list(size))
+        baseline = None
+        for name, decode in decoders:
+            decode_seconds, decoded = harness.timed(decode, raw)
+            if isinstance(decoded, list):
+                check_seconds, _ = harness.timed(check_models, decoded)
+            else:
+                check_seconds, _ = harness.timed(check_dicts, decoded["items"])
+            total = decode_seconds + check_seconds
+            baseline = baseline or total
+            rows.append(
+                (size, len(raw) / 1048576, name, decode_seconds, check_seconds, baseline / total)
+            )
+    harness.print_table(
+        [
+            ("pods", 8, ""),
+            ("MiB", 7, ".1f"),
+            ("decoder", 14, ""),
+            ("decode s", 9, ".3f"),
+            ("check s", 8, ".3f"),
+            ("speedup", 8, ".1f"),
+        ],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
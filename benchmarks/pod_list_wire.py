@@ -0,0 +1,61 @@
+"""Compares the JSON and protobuf wire formats of pod lists
+
+Builds synthetic PodList responses, encodes them as JSON and as the
+Kubernetes protobuf format, and compares the bytes on the wire and the time
+to decode them into the dicts the checks read: json.loads and orjson.loads
+for JSON, protoutils.decode_list with the pod schema for protobuf.
+
+Run from the repository root:
+
+    python benchmarks/pod_list_wire.py --sizes 1000,10000,50000
+"""
+import json
+import argparse
+
+import harness
+import eksconfigauthutils.protoutils as protoutils
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default=harness.DEFAULT_SIZES)
+    arguments = parser.parse_args()
+    rows = []
+    for size in harness.parse_sizes(arguments.sizes):
+        pod_list = harness.make_pod_list(size)
+        raw_json = harness.encode_json(pod_list)
+        raw_protobuf = harness.encode_protobuf(pod_list)
+        decoders = [("json", "json.loads", json.loads, raw_json)]
+        if orjson is not None:
+            decoders.append(("json", "orjson.loads", orjson.loads, raw_json))
+        decoders.append(
+            (
+                "protobuf",
+                "protoutils",
+                lambda raw: protoutils.decode_list(raw, protoutils.POD_LIST),
+                raw_protobuf,
+            )
+        )
+        for wire_format, name, decode, raw in decoders:
+            seconds, decoded = harness.timed(decode, raw)
+            assert len(decoded["items"]) == size
+            rows.append((size, wire_format, len(raw) / 1048576, name, seconds))
+    harness.print_table(
+        [
+            ("pods", 8, ""),
+            ("format", 9, ""),
+            ("MiB", 7, ".1f"),
+            ("decoder", 13, ""),
+            ("decode s", 9, ".3f"),
+        ],
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -7,6 +7,8 @@ from aws_cdk import (
     aws_eks as eks,
     aws_sqs as sqs,
     aws_kms as kms,
+    aws_dynamodb as dynamodb,
+    aws_s3 as s3,
     triggers as triggers,
     Duration,
     Stack,
@@ -14,6 +16,7 @@ from aws_cdk import (
 from aws_cdk.aws_lambda_event_sources import SqsEventSource
 from lambda_configs import lambdas as lambdas
 import os
+import json
 import aws_cdk as cdk
 
 
@@ -25,6 +28,7 @@ class lambdaStack(Stack):
         eks_lambda_role: str,
         eks_cluster: eks.Cluster,
         trusted_registries: str,
+        allowlist_bucket: str = None,
         **kwargs
     ) -> None:
         super().__init__(scope, id, **kwargs)
@@ -97,6 +101,100 @@ class lambdaStack(Stack):
             )
         )
 
+        ################## Cluster snapshot bucket ############################################################
+        """Snapshots of cluster objects shared by the rule lambdas of a cycle, only read while they are minutes old"""
+        snapshot_bucket = s3.Bucket(
+            self,
+            "snapshot-bucket",
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            enforce_ssl=True,
+            lifecycle_rules=[s3.LifecycleRule(expiration=Duration.days(1))],
+        )
+        """Policy is created in this stack as the rule lambda role belongs to the EKS stack"""
+        snapshot_bucket_policy = _iam.Policy(
+            self,
+            "snapshot-bucket-policy",
+            statements=[
+                _iam.PolicyStatement(
+                    effect=_iam.Effect.ALLOW,
+                    actions=["s3:GetObject", "s3:PutObject", "s3:DeleteObject"],
+                    resources=[snapshot_bucket.arn_for_objects("*")],
+                ),
+                _iam.PolicyStatement(
+                    effect=_iam.Effect.ALLOW,
+                    actions=["s3:ListBucket"],
+                    resources=[snapshot_bucket.bucket_arn],
+                ),
+            ],
+            roles=[eks_lambda_role],
+        )
+
+        """trusted registry allowlists referenced from the rule parameters are kept under an eks-config-rules prefix"""
+        allowlist_statements = [
+            _iam.PolicyStatement(
+                effect=_iam.Effect.ALLOW,
+                actions=["ssm:GetParameter"],
+                resources=[
+                    f"arn:{cdk.Aws.PARTITION}:ssm:{cdk.Aws.REGION}:{cdk.Aws.ACCOUNT_ID}:parameter/eks-config-rules/*"
+                ],
+            )
+        ]
+        """s3:// allowlists can only be read from the allowlist bucket named at deployment"""
+        if allowlist_bucket:
+            allowlist_statements.append(
+                _iam.PolicyStatement(
+                    effect=_iam.Effect.ALLOW,
+                    actions=["s3:GetObject"],
+                    resources=[
+                        s3.Bucket.from_bucket_name(
+                            self, "allowlist-bucket", allowlist_bucket
+                        ).arn_for_objects("eks-config-rules/*")
+                    ],
+                )
+            )
+        allowlist_policy = _iam.Policy(
+            self,
+            "allowlist-policy",
+            statements=allowlist_statements,
+            roles=[eks_lambda_role],
+        )
+
+        ################## kubernetes Lambda Layer ############################################################
+
+        # Here define a Lambda Layer
+        kubernetes_lambda_layer = lambda_.LayerVersion(
+            self,
+            "Boto3LambdaLayer",
+            code=lambda_.Code.from_asset("resources/kubernetes_layer/"),
+            compatible_runtimes=[lambda_.Runtime.PYTHON_3_9],
+        )
+
+        ################## Findings bucket ############################################################
+        """Holds findings too large to be sent through the queue, the queue message points to the object"""
+        findings_bucket = s3.Bucket(
+            self,
+            "findings-bucket",
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            enforce_ssl=True,
+            lifecycle_rules=[s3.LifecycleRule(expiration=Duration.days(14))],
+        )
+        findings_bucket.grant_read(lambda_role)
+        """Policy is created in this stack as the rule lambda role belongs to the EKS stack"""
+        findings_bucket_policy = _iam.Policy(
+            self,
+            "findings-bucket-policy",
+            statements=[
+                _iam.PolicyStatement(
+                    effect=_iam.Effect.ALLOW,
+                    actions=["s3:PutObject"],
+                    resources=[findings_bucket.arn_for_objects("*")],
+                )
+            ],
+            roles=[eks_lambda_role],
+        )
+
         """Lambda that puts security hub findings"""
         sqs_lambda = lambda_.Function(
             self,
@@ -108,6 +206,7 @@ class lambdaStack(Stack):
             handler="index.lambda_handler",
             role=lambda_role,
             timeout=Duration.seconds(300),
+            layers=[kubernetes_lambda_layer],
             environment={
                 "NAME": "sqs_sec-hub_lambda",
                 "sqs_queue": sqs_queue.queue_arn,
@@ -117,20 +216,41 @@ class lambdaStack(Stack):
 
         sqs_event_source = sqs_lambda.add_event_source(
             SqsEventSource(
-                sqs_queue, batch_size=10, max_batching_window=Duration.minutes(5)
+                sqs_queue,
+                batch_size=10,
+                max_batching_window=Duration.minutes(5),
+                report_batch_item_failures=True,
             )
         )
 
 
 
-        ################## kubernetes Lambda Layer ############################################################
-
-        # Here define a Lambda Layer
-        kubernetes_lambda_layer = lambda_.LayerVersion(
+        ################## Compliance state table ############################################################
+        """Last reported compliance state per config rule and cluster"""
+        state_table = dynamodb.Table(
             self,
-            "Boto3LambdaLayer",
-            code=lambda_.Code.from_asset("resources/kubernetes_layer/"),
-            compatible_runtimes=[lambda_.Runtime.PYTHON_3_9],
+            "compliance-state-table",
+            partition_key=dynamodb.Attribute(
+                name="rule_name", type=dynamodb.AttributeType.STRING
+            ),
+            sort_key=dynamodb.Attribute(
+                name="resource_id", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            point_in_time_recovery=True,
+        )
+        """Policy is created in this stack as the rule lambda role belongs to the EKS stack"""
+        state_table_policy = _iam.Policy(
+            self,
+            "compliance-state-policy",
+            statements=[
+                _iam.PolicyStatement(
+                    effect=_iam.Effect.ALLOW,
+                    actions=["dynamodb:GetItem", "dynamodb:PutItem"],
+                    resources=[state_table.table_arn],
+                )
+            ],
+            roles=[eks_lambda_role],
         )
 
         ################## Lambdas and config rules ############################################################
@@ -155,8 +275,16 @@ class lambdaStack(Stack):
                 layers=[kubernetes_lambda_layer],
                 environment={
                     "NAME": lambdas["functions"][function]["name"],
+                    "RULE_DESCRIPTION": lambdas["functions"][function]["description"],
                     "sqs_queue": sqs_queue.queue_arn,
                     "sqs_queue_url": sqs_queue.queue_url,
+                    "STATE_TABLE": state_table.table_name,
+                    "FINDINGS_BUCKET": findings_bucket.bucket_name,
+                    "SNAPSHOT_BUCKET": snapshot_bucket.bucket_name,
+                    "EXEMPTIONS": json.dumps(
+                        lambdas["functions"][function].get("exemptions", {})
+                    ),
+                    **lambdas["functions"][function].get("environment", {}),
                 },
             )
 
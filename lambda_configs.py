@@ -1,30 +1,47 @@
-"""Dictionary that defines the lambdas being created"""
+"""Dictionary that defines the lambdas being created
+
+exemptions are passed to the rule lambda as the EXEMPTIONS variable, see
+eksconfigauthutils/selectorutils.py for the fields. No objects are exempt
+unless a rule sets them, e.g. uncomment the kube-system exemption of a
+rule to skip the add-ons EKS manages there.
+"""
 lambdas = {
     "functions": {
         "privEscalation": {
             "name": "privEscalation",
             "description": "Config rule that checks for pods that have privilege escalation enabled",
             "code": "resources/priv-escalation",
+            "environment": {"PAGE_SIZE": "500", "LIST_CONSISTENCY": "cached"},
+            # "exemptions": {"namespaces": ["kube-system"]},
         },
         "logCheck": {
             "name": "logCheck",
             "description": "Config rule that checks that in scope EKS clusters have logging enabled",
             "code": "resources/logging-check",
+            "environment": {"CLUSTER_METADATA_TTL": "0"},
         },
         "netPolCheck": {
             "name": "netPolCheck",
             "description": "Config rule that checks that in scope clusters have a network policy configured in each namespace",
             "code": "resources/network-policy",
+            "environment": {"NETWORK_POLICY_MODE": "namespace"},
         },
         "namespaceCheck": {
             "name": "namespaceCheck",
             "description": "Config rule that checks that in scope EKS clusters for pods running in the default namespace",
             "code": "resources/namespace-check",
+            "environment": {
+                "PAGE_SIZE": "500",
+                "LIST_CONSISTENCY": "cached",
+                "EVALUATION_MODE": "verdict",
+            },
         },
         "trustedRegCheck": {
             "name": "trustedRegCheck",
             "description": "Config rule that checks that in scope EKS clusters for containers that are running images from untrusted registries",
             "code": "resources/trusted-registry",
+            "environment": {"PAGE_SIZE": "500", "LIST_CONSISTENCY": "cached"},
+            # "exemptions": {"namespaces": ["kube-system"]},
         },
     }
 }
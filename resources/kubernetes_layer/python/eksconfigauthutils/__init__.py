@@ -0,0 +1 @@
+"""Shared helpers for the EKS config rule lambdas, shipped in the kubernetes lambda layer"""
@@ -0,0 +1,282 @@
+"""Compiles trusted registry allowlists into a matcher of image references
+
+An allowlist entry is one of:
+
+    quay.io                                          every image of a registry
+    111111111111.dkr.ecr.*.amazonaws.com/team-*      a host and path prefix
+    busybox                                          a Docker Hub repository
+    busybox:1.36, quay.io/app@sha256:...             a pinned tag or digest
+
+* and other glob characters match within one host label or path
+component. The entries are compiled into a trie over the labels of the
+registry host, in reverse, and the components of the repository path, so
+an image is matched in time proportional to its length whatever the number
+of exact entries. The wildcard components of a trie node are indexed by
+their literal prefix, so a component is only tried against the wildcards
+it shares a prefix with, e.g. team-a against team-* but not app-*. The
+wildcards with the same prefix, and those starting with a glob character,
+are still tried one by one. Matchers are kept by the warm lambda container.
+
+The allowlist is given inline or referenced as s3://bucket/key,
+ssm:/parameter/name or file:///path, see load_entries.
+"""
+import os
+import re
+import fnmatch
+import logging
+import threading
+from botocore.exceptions import BotoCoreError, ClientError
+import eksconfigauthutils.clientutils as clientutils
+import eksconfigauthutils.imageutils as imageutils
+
+"""token between the registry host and the repository path"""
+SEPARATOR = "/"
+
+S3_PREFIX = "s3://"
+SSM_PREFIX = "ssm:"
+FILE_PREFIX = "file://"
+
+"""entries and compiled matcher of each rule"""
+_matchers = {}
+_matchers_lock = threading.Lock()
+
+
+class AllowlistError(Exception):
+    pass
+
+"""version and entries of each referenced allowlist loaded by the warm container"""
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def parse_entries(value):
+    """Returns the entries of an allowlist given as a string or a list of strings
+
+    Entries are separated by commas or new lines, text after a # is a
+    comment.
+    """
+    if isinstance(value, str):
+        value = [value]
+    entries = []
+    for text in value:
+        for line in text.splitlines():
+            for entry in line.split("#", 1)[0].split(","):
+                if entry.strip():
+                    entries.append(entry.strip())
+    return entries
+
+
+def is_host(name):
+    """Tells whether an entry without a path names a registry, e.g. quay.io or localhost:5000"""
+    host, _, port = name.partition(":")
+    return ("." in host or host == "localhost") and (not port or port.isdigit())
+
+
+def host_tokens(host):
+    return list(reversed(host.split(".")))
+
+
+"""glob characters of fnmatch, a token holding one is a wildcard"""
+PATTERN_CHARACTERS = re.compile(r"[*?\[]")
+
+
+def is_pattern(token):
+    return PATTERN_CHARACTERS.search(token) is not None
+
+
+def literal_prefix(token):
+    """Returns the part of a wildcard token before its first glob character"""
+    return PATTERN_CHARACTERS.split(token, 1)[0]
+
+
+class Node:
+    """A trie node, wildcards are kept by token and indexed by their literal prefix"""
+
+    __slots__ = [
+        "children",
+        "wildcards",
+        "prefixes",
+        "prefix_lengths",
+        "accept_all",
+        "tags",
+        "digests",
+    ]
+
+    def __init__(self):
+        self.children = {}
+        self.wildcards = {}
+        self.prefixes = {}
+        self.prefix_lengths = set()
+        self.accept_all = False
+        self.tags = set()
+        self.digests = set()
+
+    def child(self, token):
+        if not is_pattern(token):
+            return self.children.setdefault(token, Node())
+        if token not in self.wildcards:
+            wildcard = (re.compile(fnmatch.translate(token)), Node())
+            self.wildcards[token] = wildcard
+            prefix = literal_prefix(token)
+            self.prefixes.setdefault(prefix, []).append(wildcard)
+            self.prefix_lengths.add(len(prefix))
+        return self.wildcards[token][1]
+
+    def matching_wildcards(self, token):
+        """Yields the nodes of the wildcards matching token, trying only those sharing its prefix"""
+        for length in self.prefix_lengths:
+            if length > len(token):
+                continue
+            for regex, wildcard in self.prefixes.get(token[:length], ()):
+                if regex.match(token):
+                    yield wildcard
+
+
+class RegistryMatcher:
+    """Matches image references against the entries of an allowlist"""
+
+    def __init__(self, entries):
+        self.root = Node()
+        self.size = 0
+        for entry in entries:
+            self.add(entry)
+
+    def add(self, entry):
+        name = entry.split("@", 1)[0]
+        if "/" not in name and is_host(name):
+            tokens = host_tokens(name) + [SEPARATOR]
+            tag = digest = None
+        else:
+            pattern = imageutils.split_reference(entry)
+            tokens = host_tokens(pattern.registry) + [SEPARATOR] + pattern.repository.split("/")
+            tag, digest = pattern.tag, pattern.digest
+        node = self.root
+        for token in tokens:
+            node = node.child(token)
+        if digest:
+            node.digests.add(digest)
+        elif tag:
+            node.tags.add(tag)
+        else:
+            node.accept_all = True
+        self.size += 1
+
+    def matches(self, image):
+        """Tells whether a parsed ImageReference is allowed"""
+        tokens = host_tokens(image.registry) + [SEPARATOR] + image.repository.split("/")
+        nodes = [self.root]
+        for token in tokens:
+            reached = []
+            for node in nodes:
+                if node.accept_all:
+                    return True
+                child = node.children.get(token)
+                if child is not None:
+                    reached.append(child)
+                if node.prefixes:
+                    reached.extend(node.matching_wildcards(token))
+            if not reached:
+                return False
+            nodes = reached
+        for node in nodes:
+            if node.accept_all:
+                return True
+            if image.digest is not None and image.digest in node.digests:
+                return True
+            if image.tag is not None and image.tag in node.tags:
+                return True
+        return False
+
+    def matches_reference(self, reference):
+        return self.matches(imageutils.parse_image(reference))
+
+
+def get_matcher(rule, entries):
+    """Returns the compiled matcher of the entries of a rule, compiled once per warm container
+
+    Each rule keeps a single matcher, replaced when its entries change, so
+    matchers of earlier allowlist versions are not kept.
+    """
+    key = tuple(entries)
+    with _matchers_lock:
+        cached_key, matcher = _matchers.get(rule, (None, None))
+        if cached_key != key:
+            matcher = RegistryMatcher(entries)
+            _matchers[rule] = (key, matcher)
+        return matcher
+
+
+def fetch_s3(reference, version):
+    """Returns the ETag and text of an S3 object, the text is None while the ETag is version"""
+    bucket, _, key = reference[len(S3_PREFIX) :].partition("/")
+    conditions = {"IfNoneMatch": version} if version else {}
+    try:
+        response = clientutils.get_client("s3").get_object(Bucket=bucket, Key=key, **conditions)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ["304", "NotModified"]:
+            return version, None
+        raise
+    return response["ETag"], response["Body"].read().decode()
+
+
+def fetch_ssm(reference, version):
+    """Returns the version and value of an SSM parameter, the value is None while the version is unchanged
+
+    Allowlists are not secret and are kept in String or StringList
+    parameters, which are read without decryption.
+    """
+    parameter = clientutils.get_client("ssm").get_parameter(
+        Name=reference[len(SSM_PREFIX) :]
+    )["Parameter"]
+    if str(parameter["Version"]) == version:
+        return version, None
+    return str(parameter["Version"]), parameter["Value"]
+
+
+def fetch_file(reference, version):
+    """Returns the modification time and text of a local file, used for tests and local runs"""
+    path = reference[len(FILE_PREFIX) :]
+    modified = str(os.stat(path).st_mtime_ns)
+    if modified == version:
+        return version, None
+    with open(path) as f:
+        return modified, f.read()
+
+
+FETCHERS = {S3_PREFIX: fetch_s3, SSM_PREFIX: fetch_ssm, FILE_PREFIX: fetch_file}
+
+
+def load_entries(value):
+    """Returns the entries of an allowlist given inline or referenced by value
+
+    A referenced allowlist is fetched again only when its ETag, parameter
+    version or modification time changed since the warm container loaded
+    it. When it can't be fetched the entries loaded before are used, an
+    allowlist that was never loaded raises AllowlistError.
+    """
+    fetch = next(
+        (fetch for prefix, fetch in FETCHERS.items() if value.strip().startswith(prefix)), None
+    )
+    if fetch is None:
+        return parse_entries(value)
+    reference = value.strip()
+    with _sources_lock:
+        version, entries = _sources.get(reference, (None, None))
+    try:
+        fetched_version, text = fetch(reference, version)
+    except (ClientError, BotoCoreError, OSError) as e:
+        if entries is None:
+            raise AllowlistError(f"allowlist {reference} could not be loaded: {e}") from e
+        logging.error(f"issue reloading allowlist {reference}, using version {version}")
+        logging.error(str(e))
+        return entries
+    if text is None:
+        logging.info(f"allowlist {reference} unchanged at version {version}")
+        return entries
+    entries = parse_entries(text)
+    logging.info(
+        f"loaded allowlist {reference} version {fetched_version} with {len(entries)} entries"
+    )
+    with _sources_lock:
+        _sources[reference] = (fetched_version, entries)
+    return entries
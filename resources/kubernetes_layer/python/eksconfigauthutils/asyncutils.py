@@ -0,0 +1,181 @@
+"""Runs the shared evaluation path of the rule lambdas on an asyncio event loop
+
+With EVALUATION_RUNTIME set to asyncio, clusterutils.evaluate_clusters hands
+the clusters of a run to evaluate_clusters here. The DescribeCluster call and
+the token of every cluster without cached credentials are started together
+when the run starts, rather than one after the other by authutils within
+the evaluation of each cluster, and each cluster is evaluated as soon as
+its credentials are ready, MAX_CLUSTER_WORKERS clusters at a time.
+flush_writes sends the findings of a run to SQS while its evaluations are
+put to Config, each batch on its own call.
+
+The layer doesn't ship asyncio clients for Kubernetes or AWS, so the
+blocking calls run on the threads of the Runtime executor, and each target
+(EKS, STS, SQS, Config and the cluster evaluations) is bounded by its own
+semaphore. The limits of the AWS targets can be set as a JSON object in
+ASYNC_CONCURRENCY, e.g. {"eks": 5}.
+"""
+import os
+import json
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import eksconfigauthutils.authutils as authutils
+import eksconfigauthutils.clusterutils as clusterutils
+
+EKS = "eks"
+STS = "sts"
+SQS = "sqs"
+CONFIG = "config"
+"""the cluster evaluations, bounded by MAX_CLUSTER_WORKERS"""
+CLUSTERS = "clusters"
+
+"""concurrent calls per target, kept below the API rate limits of each service"""
+DEFAULT_CONCURRENCY = {EKS: 10, STS: 10, SQS: 4, CONFIG: 2}
+
+
+def get_concurrency():
+    """Returns the concurrent calls per target, overridden through ASYNC_CONCURRENCY"""
+    try:
+        concurrency = {
+            target: max(int(limit), 1)
+            for target, limit in json.loads(os.environ.get("ASYNC_CONCURRENCY") or "{}").items()
+        }
+    except (ValueError, TypeError, AttributeError):
+        logging.error("ASYNC_CONCURRENCY is not a JSON object of numbers, using the defaults")
+        concurrency = {}
+    return {**DEFAULT_CONCURRENCY, **concurrency, CLUSTERS: clusterutils.get_max_workers()}
+
+
+class Runtime:
+    """The semaphore of each target and the executor the blocking calls run on
+
+    Semaphores are created on first use, inside the event loop of the run.
+    """
+
+    def __init__(self, concurrency=None):
+        self.concurrency = concurrency or get_concurrency()
+        self.semaphores = {}
+        self.executor = ThreadPoolExecutor(
+            max_workers=sum(self.concurrency.values()), thread_name_prefix="async"
+        )
+
+    def semaphore(self, target):
+        if target not in self.semaphores:
+            self.semaphores[target] = asyncio.Semaphore(self.concurrency.get(target, 1))
+        return self.semaphores[target]
+
+    async def call(self, target, fn, *args):
+        """Runs fn(*args) on the executor once target has a free slot"""
+        async with self.semaphore(target):
+            return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def shutdown(self):
+        """Stops the executor without waiting for evaluations that timed out"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+async def prepare_cluster(runtime, cluster_name):
+    """Describes the cluster and signs its token concurrently, caching both for authutils
+
+    Errors are only logged, the evaluation of the cluster then describes it
+    again and reports the error.
+    """
+    cluster, signed = await asyncio.gather(
+        runtime.call(EKS, clusterutils.describe_cluster, cluster_name),
+        runtime.call(STS, authutils.generate_token, cluster_name),
+        return_exceptions=True,
+    )
+    for result in [cluster, signed]:
+        if isinstance(result, Exception):
+            logging.error(f"issue preparing credentials for cluster {cluster_name}")
+            logging.error(str(result))
+            return
+    authutils.store_credentials(cluster_name, cluster["endpoint"], cluster["ca_data"], *signed)
+
+
+async def evaluate_cluster(runtime, evaluate_fn, cluster_name, *args):
+    if not authutils.credentials_cached(cluster_name):
+        await prepare_cluster(runtime, cluster_name)
+    return await runtime.call(CLUSTERS, evaluate_fn, cluster_name, *args)
+
+
+async def evaluate_all(runtime, evaluate_fn, clusters, timeout, *args):
+    tasks = [
+        asyncio.ensure_future(evaluate_cluster(runtime, evaluate_fn, cluster_name, *args))
+        for cluster_name in clusters
+    ]
+    done, not_done = await asyncio.wait(tasks, timeout=timeout)
+    for task in not_done:
+        task.cancel()
+    return tasks, not_done
+
+
+def evaluate_clusters(evaluate_fn, clusters, context=None, *args):
+    """Evaluates every cluster on an event loop, as clusterutils.evaluate_clusters does in threads
+
+    Returns a list of (cluster_name, evaluation) in the order of clusters,
+    with clusters that fail or don't finish before the lambda times out
+    reported as NOT_APPLICABLE.
+    """
+    if len(clusters) == 0:
+        return []
+    runtime = Runtime()
+    try:
+        tasks, not_done = asyncio.run(
+            evaluate_all(
+                runtime, evaluate_fn, clusters, clusterutils.get_timeout(context), *args
+            )
+        )
+    finally:
+        runtime.shutdown()
+    return clusterutils.collect_results(clusters, tasks, not_done)
+
+
+def flush_writes(findings_producer, config_evaluations):
+    """Sends the findings and puts the evaluations of a run
+
+    Returns the keys of the findings sent and the evaluations Config
+    rejected, findings_producer is None for rules that send no findings.
+    With the asyncio runtime every SQS batch and Config chunk is
+    a call of its own, bounded by the SQS and Config semaphores, and the
+    findings are sent while the evaluations are put. Otherwise the batches
+    are written one after the other, the findings first.
+    """
+    if clusterutils.get_runtime() != clusterutils.ASYNCIO:
+        sent_keys = findings_producer.flush() if findings_producer else set()
+        return sent_keys, config_evaluations.flush()
+    runtime = Runtime()
+
+    async def send_findings():
+        if findings_producer is None:
+            return set()
+        """claim checks are stored in S3 while the messages are encoded, off the event loop"""
+        pending, entries = await runtime.call(SQS, findings_producer.take_entries)
+        sent = await asyncio.gather(
+            *[
+                runtime.call(SQS, findings_producer.send_batch, batch)
+                for batch in findings_producer.batches(entries)
+            ]
+        )
+        sent_keys = set().union(*sent)
+        logging.info(f"sent {len(sent_keys)} of {pending} findings to sqs")
+        return sent_keys
+
+    async def put_evaluations():
+        chunks = config_evaluations.take_chunks()
+        failed = await asyncio.gather(
+            *[runtime.call(CONFIG, config_evaluations.put_batch, chunk) for chunk in chunks]
+        )
+        failed_evaluations = [evaluation for chunk in failed for evaluation in chunk]
+        config_evaluations.report(chunks, failed_evaluations)
+        return failed_evaluations
+
+    async def flush_all():
+        return await asyncio.gather(send_findings(), put_evaluations())
+
+    try:
+        sent_keys, failed_evaluations = asyncio.run(flush_all())
+    finally:
+        runtime.shutdown()
+    return sent_keys, failed_evaluations
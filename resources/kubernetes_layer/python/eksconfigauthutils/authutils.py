@@ -0,0 +1,190 @@
+"""Authenticates the config rule lambdas against the Kubernetes API of EKS clusters
+
+Tokens, endpoints, certificate authorities and API clients are cached per
+cluster for the life of the lambda container, so warm invocations don't
+sign a new token, describe the cluster or build a new ApiClient each time.
+"""
+import os
+import base64
+import logging
+import tempfile
+import threading
+from datetime import datetime, timedelta
+import kubernetes
+from botocore import session
+from awscli.customizations.eks.get_token import (
+    STSClientFactory,
+    TokenGenerator,
+    TOKEN_EXPIRATION_MINS,
+)
+import eksconfigauthutils.clusterutils as clusterutils
+
+"""tokens are replaced this many seconds before they expire"""
+TOKEN_REFRESH_MARGIN_SECONDS = 120
+
+_clusters = {}
+"""guards _clusters and _cluster_locks, never held during a network call"""
+_lock = threading.Lock()
+"""one lock per cluster, held while the credentials of that cluster are prepared"""
+_cluster_locks = {}
+
+
+def cluster_lock(cluster_name):
+    with _lock:
+        return _cluster_locks.setdefault(cluster_name, threading.Lock())
+
+
+def fresh_cluster(cluster_name):
+    """Returns the cache entry of the cluster when its token is not close to expiry, without locking"""
+    cached_cluster = _clusters.get(cluster_name)
+    if cached_cluster is not None and not token_expiring(cached_cluster):
+        return cached_cluster
+    return None
+
+
+def generate_token(cluster_name):
+    """Signs a new bearer token for the cluster, returns the token and its expiry"""
+    work_session = session.get_session()
+    client_factory = STSClientFactory(work_session)
+    sts_client = client_factory.get_sts_client(role_arn=None)
+    token = TokenGenerator(sts_client).get_token(cluster_name)
+    expiration = datetime.utcnow() + timedelta(minutes=TOKEN_EXPIRATION_MINS)
+    return token, expiration
+
+
+def token_expiring(cached_cluster):
+    refresh_at = cached_cluster["expiration"] - timedelta(
+        seconds=TOKEN_REFRESH_MARGIN_SECONDS
+    )
+    return datetime.utcnow() >= refresh_at
+
+
+def write_ca_file(cluster_name, ca_data):
+    """Writes the base64 encoded cluster CA to a file the kubernetes client can use"""
+    ca_file = os.path.join(tempfile.gettempdir(), f"{cluster_name}-ca.crt")
+    with open(ca_file, "wb") as f:
+        f.write(base64.b64decode(ca_data))
+    return ca_file
+
+
+def describe_endpoint(cluster_name):
+    cluster = clusterutils.describe_cluster(cluster_name)
+    return cluster["endpoint"], cluster["ca_data"]
+
+
+def new_cluster(cluster_name, endpoint, ca_data, token, expiration):
+    return {
+        "endpoint": endpoint,
+        "ca_file": write_ca_file(cluster_name, ca_data) if ca_data else None,
+        "token": token,
+        "expiration": expiration,
+        "api_client": None,
+    }
+
+
+def get_cached_cluster(cluster_name):
+    """Returns the cache entry of the cluster, refreshing its token when close to expiry
+
+    Fresh entries are returned without taking a lock, so the token refresh
+    hook of the API clients costs nothing on each request. Otherwise the
+    cluster is described and its token signed under the lock of that
+    cluster only, and other clusters are prepared at the same time.
+    """
+    cached_cluster = fresh_cluster(cluster_name)
+    if cached_cluster is not None:
+        return cached_cluster
+    with cluster_lock(cluster_name):
+        cached_cluster = _clusters.get(cluster_name)
+        if cached_cluster is None:
+            logging.info(f"no cached credentials for cluster {cluster_name}")
+            endpoint, ca_data = describe_endpoint(cluster_name)
+            token, expiration = generate_token(cluster_name)
+            cached_cluster = new_cluster(cluster_name, endpoint, ca_data, token, expiration)
+            with _lock:
+                _clusters[cluster_name] = cached_cluster
+        elif token_expiring(cached_cluster):
+            logging.info(f"refreshing token for cluster {cluster_name}")
+            cached_cluster["token"], cached_cluster["expiration"] = generate_token(
+                cluster_name
+            )
+        return cached_cluster
+
+
+def credentials_cached(cluster_name):
+    """Tells whether the cluster has cached credentials that are not close to expiry"""
+    return fresh_cluster(cluster_name) is not None
+
+
+def store_credentials(cluster_name, endpoint, ca_data, token, expiration):
+    """Caches credentials prepared outside of get_cached_cluster, e.g. concurrently by asyncutils
+
+    Credentials cached in the meantime are kept unless their token is
+    close to expiry, in which case only the token is replaced.
+    """
+    with cluster_lock(cluster_name):
+        cached_cluster = _clusters.get(cluster_name)
+        if cached_cluster is None:
+            cached_cluster = new_cluster(cluster_name, endpoint, ca_data, token, expiration)
+            with _lock:
+                _clusters[cluster_name] = cached_cluster
+        elif token_expiring(cached_cluster):
+            cached_cluster["token"], cached_cluster["expiration"] = token, expiration
+
+
+def invalidate(cluster_name):
+    """Drops everything cached for the cluster, e.g. after an authentication failure"""
+    with _lock:
+        _clusters.pop(cluster_name, None)
+
+
+def get_k8s_cluster_token(cluster_name):
+    """obtains session token for k8s cluster"""
+    return get_cached_cluster(cluster_name)["token"]
+
+
+def get_k8s_cluster_endpoint(cluster_name):
+    """obtains cluster endpoint"""
+    return get_cached_cluster(cluster_name)["endpoint"]
+
+
+def get_api_client(cluster_name):
+    """Returns the ApiClient shared by every API of the cluster
+
+    The client refreshes its bearer token before each request once the token
+    is within TOKEN_REFRESH_MARGIN_SECONDS of expiring, so long scans that
+    page through large clusters never send an expired token.
+    """
+    cached_cluster = get_cached_cluster(cluster_name)
+    with cluster_lock(cluster_name):
+        if cached_cluster["api_client"] is None:
+            configuration = kubernetes.client.Configuration()
+            configuration.api_key["authorization"] = cached_cluster["token"]
+            configuration.api_key_prefix["authorization"] = "Bearer"
+            configuration.host = cached_cluster["endpoint"]
+            if cached_cluster["ca_file"]:
+                configuration.ssl_ca_cert = cached_cluster["ca_file"]
+            else:
+                configuration.verify_ssl = False
+
+            def refresh_api_key(configuration):
+                configuration.api_key["authorization"] = get_k8s_cluster_token(
+                    cluster_name
+                )
+
+            configuration.refresh_api_key_hook = refresh_api_key
+            cached_cluster["api_client"] = kubernetes.client.api_client.ApiClient(
+                configuration
+            )
+        return cached_cluster["api_client"]
+
+
+def initialize_k8s_api(cluster_name, token=None, endpoint=None):
+    """initializes the k8s core api, token and endpoint are taken from the cache"""
+    client = get_api_client(cluster_name)
+    return kubernetes.client.api.core_v1_api.CoreV1Api(client)
+
+
+def initialize_k8s_net_api(cluster_name, token=None, endpoint=None):
+    """initializes the k8s networking api on the same client as the core api"""
+    client = get_api_client(cluster_name)
+    return kubernetes.client.api.networking_v1_api.NetworkingV1Api(client)
@@ -0,0 +1,631 @@
+"""Runs several checks against a cluster while listing each resource kind once
+
+A check declares the resource kinds it reads. run_checks lists every kind
+needed by the requested checks a single time and hands each object to all the
+checks reading that kind, so adding a check costs CPU rather than another list
+call against the API server. Checks are registered with the register
+decorator under the rule name used in lambda_configs. When a snapshot store
+is configured the listed objects are also shared with the other rule lambdas
+through snapshotutils. Field and label selectors of the checks and the
+exemptions of the rule are sent with the list calls, see selectorutils.
+
+EVALUATION_MODE selects how far a rule evaluates. In report mode every
+offending object is enumerated, in verdict mode a check stops at the first
+violation and no further pages are listed once all checks have a verdict.
+With EVALUATION_UNIT set to workload, checks of pod templates evaluate one
+pod per workload, see workload_of.
+"""
+import os
+import logging
+import threading
+from abc import ABC, abstractmethod
+from botocore.exceptions import ClientError
+import eksconfigauthutils.authutils as auth
+import eksconfigauthutils.clusterutils as clusterutils
+import eksconfigauthutils.listutils as listutils
+import eksconfigauthutils.protoutils as protoutils
+import eksconfigauthutils.selectorutils as selectorutils
+import eksconfigauthutils.snapshotutils as snapshotutils
+import eksconfigauthutils.stateutils as stateutils
+
+PODS = "pods"
+NAMESPACES = "namespaces"
+NETWORK_POLICIES = "networkpolicies"
+
+"""kinds are traversed in this order, so checks see policies before namespaces and pods"""
+KIND_ORDER = [NETWORK_POLICIES, NAMESPACES, PODS]
+
+VERDICT = "verdict"
+REPORT = "report"
+
+"""marks an evaluation whose verdict changed with the check name, see record_verdict"""
+CHANGED_VERDICT = "changed_verdict"
+
+"""pods are evaluated one by one, or once per workload"""
+POD = "pod"
+WORKLOAD = "workload"
+
+"""offenders named in a report annotation, the others are counted"""
+DEFAULT_REPORT_LIMIT = 25
+
+CHECKS = {}
+
+memo_stats = {"hits": 0, "misses": 0}
+_memo_lock = threading.Lock()
+
+
+def get_mode():
+    mode = os.environ.get("EVALUATION_MODE", REPORT).lower()
+    if mode not in [VERDICT, REPORT]:
+        logging.error(f"EVALUATION_MODE {mode} is not supported, using {REPORT}")
+        return REPORT
+    return mode
+
+
+def get_unit():
+    unit = os.environ.get("EVALUATION_UNIT", POD).lower()
+    if unit not in [POD, WORKLOAD]:
+        logging.error(f"EVALUATION_UNIT {unit} is not supported, using {POD}")
+        return POD
+    return unit
+
+
+def get_report_limit():
+    try:
+        return int(os.environ.get("REPORT_LIMIT", DEFAULT_REPORT_LIMIT))
+    except ValueError:
+        logging.error(
+            f"REPORT_LIMIT is not a number, using the default of {DEFAULT_REPORT_LIMIT}"
+        )
+        return DEFAULT_REPORT_LIMIT
+
+
+class Check(ABC):
+    """Base class of the checks run by the engine
+
+    visit is called for every object of the kinds listed in kinds, as a dict
+    using the API field names, result returns the compliance_type and
+    annotation once all objects were visited. A metadata_only check is given
+    {"metadata": {...}} dicts, so its kinds can be listed without the spec and
+    status of each object.
+
+    selectors holds the Selector of the objects the check reads per kind,
+    exemptions apply to the objects of the subject kind, the kind whose
+    objects are reported. A check calls found on each violation, in verdict
+    mode that marks it done and it isn't given further objects.
+
+    A check of templates only reads fields the pods of a workload share with
+    its pod template. In the workload unit it is given one pod per workload
+    and reports the workload, see offender.
+    """
+
+    name = None
+    kinds = ()
+    """checks only reading object metadata are given PartialObjectMetadata"""
+    metadata_only = False
+    selectors = {}
+    subject = PODS
+    templates = False
+
+    def __init__(self, cluster_name, mode=REPORT, unit=POD, report_limit=None, **params):
+        self.cluster_name = cluster_name
+        self.params = params
+        self.mode = mode
+        self.unit = unit
+        self.report_limit = get_report_limit() if report_limit is None else report_limit
+        self.done = False
+
+    def found(self):
+        if self.mode == VERDICT:
+            self.done = True
+
+    def metadata_only_for(self, kind):
+        """Tells whether the objects of kind are read by their metadata only"""
+        return self.metadata_only
+
+    def per_workload(self):
+        return self.templates and self.unit == WORKLOAD
+
+    def offender(self, pod):
+        """Returns the name a pod is reported under, its workload in the workload unit"""
+        metadata = pod["metadata"]
+        if self.per_workload():
+            kind, name = workload_of(pod)
+            return f"{metadata.get('namespace')}/{kind}/{name}"
+        return metadata["name"]
+
+    def top(self, offenders):
+        """Returns the offenders for an annotation, bounded to report_limit
+
+        offenders is a list or a dict, the ones left out are counted.
+        """
+        if len(offenders) <= self.report_limit:
+            return f"{offenders}"
+        if isinstance(offenders, dict):
+            shown = dict(list(offenders.items())[: self.report_limit])
+        else:
+            shown = offenders[: self.report_limit]
+        return f"{shown} and {len(offenders) - self.report_limit} more"
+
+    def selector(self, kind, exemptions=None):
+        """Returns the Selector of the objects of kind visited, exemptions included"""
+        selector = self.selectors.get(kind, selectorutils.Selector())
+        if kind == self.subject:
+            selector = selector + selectorutils.compile_exemptions(exemptions, kind)
+        return selector
+
+    def visit(self, kind, item):
+        pass
+
+    @abstractmethod
+    def result(self):
+        """Returns the compliance type and annotation of the objects visited"""
+
+
+def controller_of(metadata):
+    owners = metadata.get("ownerReferences") or []
+    for owner in owners:
+        if owner.get("controller"):
+            return owner
+    return owners[0] if owners else None
+
+
+def workload_of(pod):
+    """Returns the (kind, name) of the workload running a pod
+
+    Pods of a ReplicaSet created by a Deployment are named after the
+    Deployment, the ReplicaSet name being the Deployment name followed by
+    the pod-template-hash label. Pods without an owner are their own workload.
+    """
+    metadata = pod["metadata"]
+    owner = controller_of(metadata)
+    if owner is None:
+        return "Pod", metadata["name"]
+    template_hash = (metadata.get("labels") or {}).get("pod-template-hash")
+    if (
+        owner["kind"] == "ReplicaSet"
+        and template_hash
+        and owner["name"].endswith(f"-{template_hash}")
+    ):
+        return "Deployment", owner["name"][: -len(template_hash) - 1]
+    return owner["kind"], owner["name"]
+
+
+def workload_key(pod):
+    """Identifies the pod template a pod was created from
+
+    Pods of the same owner share a template unless they carry different
+    pod-template-hash or controller-revision-hash labels, e.g. during a
+    rollout.
+    """
+    metadata = pod["metadata"]
+    owner = controller_of(metadata)
+    if owner is None:
+        return (metadata.get("namespace"), "Pod", metadata["name"], None)
+    labels = metadata.get("labels") or {}
+    revision = labels.get("pod-template-hash") or labels.get("controller-revision-hash")
+    return (metadata.get("namespace"), owner["kind"], owner["name"], revision)
+
+
+def register(check_class):
+    CHECKS[check_class.name] = check_class
+    return check_class
+
+
+"""API path of each kind"""
+KIND_PATHS = {
+    PODS: "/api/v1/pods",
+    NAMESPACES: "/api/v1/namespaces",
+    NETWORK_POLICIES: "/apis/networking.k8s.io/v1/networkpolicies",
+}
+
+
+"""kinds that can be listed in the protobuf wire format, with the fields decoded"""
+PROTOBUF_SCHEMAS = {
+    PODS: protoutils.POD_LIST,
+}
+
+
+def kind_list_fn(cluster_name, kind, metadata_only=False):
+    """Returns the list call of a kind, listing metadata only or full objects as dicts"""
+    if metadata_only:
+        accept = listutils.METADATA_ACCEPT
+    else:
+        accept = listutils.JSON_ACCEPT
+    return listutils.raw_list_fn(
+        auth.get_api_client(cluster_name),
+        KIND_PATHS[kind],
+        accept,
+        PROTOBUF_SCHEMAS.get(kind),
+    )
+
+
+"""container fields holding values, often secrets, that no check reads and snapshots don't keep"""
+SNAPSHOT_STRIPPED_FIELDS = ("env", "envFrom")
+
+
+def snapshot_view(kind, item):
+    """Returns a pod without the environment of its containers, other objects as they are"""
+    if kind != PODS or "spec" not in item:
+        return item
+    spec = dict(item["spec"])
+    for field in ["containers", "initContainers", "ephemeralContainers"]:
+        if field in spec:
+            spec[field] = [
+                {
+                    name: value
+                    for name, value in container.items()
+                    if name not in SNAPSHOT_STRIPPED_FIELDS
+                }
+                for container in spec[field]
+            ]
+    return dict(item, spec=spec)
+
+
+def metadata_view(item):
+    """Returns an object in the form of a metadata only list item"""
+    return {"metadata": item["metadata"]}
+
+
+def common_selector(selectors):
+    """Returns the requirements shared by all selectors, the part that can be sent with a shared list"""
+    first, others = selectors[0], selectors[1:]
+    return selectorutils.Selector(
+        [field for field in first.fields if all(field in other.fields for other in others)],
+        [label for label in first.labels if all(label in other.labels for other in others)],
+    )
+
+
+def list_consistency(cluster_name):
+    """Returns the consistency of the lists of a cluster
+
+    The watch cache is only read on clusters whose API server pages it,
+    other clusters are read from etcd so their lists stay paged.
+    """
+    consistency = listutils.get_consistency()
+    if consistency == listutils.CACHED:
+        version = clusterutils.describe_cluster(cluster_name).get("version")
+        if not listutils.pages_watch_cache(version):
+            logging.info(
+                f"cluster {cluster_name} runs Kubernetes {version}, which doesn't page lists of its watch cache, listing {listutils.CONSISTENT}"
+            )
+            return listutils.CONSISTENT
+    return consistency
+
+
+def list_kind(cluster_name, kind, metadata_only=False, selector=None):
+    """Returns the objects of a kind, from the shared snapshot when one is configured
+
+    With metadata_only the objects are listed as PartialObjectMetadata dicts.
+    The field and label requirements of selector are sent to the API server,
+    its predicates are left to the caller.
+    """
+    get_list_fn = lambda: kind_list_fn(cluster_name, kind, metadata_only)
+    selectors = {}
+    if selector is not None:
+        for name, value in [
+            ("field_selector", selector.field_selector),
+            ("label_selector", selector.label_selector),
+        ]:
+            if value:
+                selectors[name] = value
+    consistency = list_consistency(cluster_name)
+    store = snapshotutils.get_snapshot_store()
+    if store is None:
+        return listutils.list_items(
+            get_list_fn(), listutils.get_page_size(), consistency, **selectors
+        )
+
+    def list_pages():
+        for page in listutils.list_pages(
+            get_list_fn(), listutils.get_page_size(), consistency, **selectors
+        ):
+            yield listutils.page_resource_version(page), [
+                snapshot_view(kind, item) for item in listutils.page_items(page)
+            ]
+
+    snapshot_kind = f"{kind}{snapshotutils.METADATA_SUFFIX}" if metadata_only else kind
+    if (
+        not metadata_only
+        and kind in PROTOBUF_SCHEMAS
+        and listutils.get_encoding() == listutils.PROTOBUF
+    ):
+        # protobuf lists only hold the fields of the schema, rules listing JSON need the others
+        snapshot_kind += snapshotutils.PROTOBUF_SUFFIX
+    if selectors:
+        snapshot_kind += f"-{stateutils.params_hash(selectors)[:12]}"
+
+    def snapshot_pages():
+        # the pages are evaluated as they are listed and written, or read from the snapshot
+        pages = store.pages(cluster_name, snapshot_kind, list_pages)
+        try:
+            for items in pages:
+                yield {"items": items}
+        finally:
+            pages.close()
+
+    return listutils.PageItems(listutils.prefetch(snapshot_pages, name="snapshot-prefetch"))
+
+
+def not_applicable(cluster_name, error, clusterarn=None):
+    """Returns a NOT_APPLICABLE evaluation, without clusterarn clusterutils resolves the ARN"""
+    evaluation = {
+        "compliance_type": "NOT_APPLICABLE",
+        "annotation": f"Validation was not run against cluster {cluster_name}, error encountered: {error}",
+    }
+    if clusterarn is not None:
+        evaluation["clusterarn"] = clusterarn
+    return evaluation
+
+
+def evaluate_checks(cluster_name, clusterarn, checks, exemptions=None):
+    """Lists the kinds read by the checks once each and returns their evaluations
+
+    Objects not selected by a check, or exempt, are not visited by it. The
+    requirements shared by all readers of a kind are sent with its list call.
+    The listings of all kinds are started before the first is evaluated, so
+    with prefetching the first pages of every kind are requested together.
+    """
+    failed = {}
+    listings = {}
+    for kind in KIND_ORDER:
+        readers = [
+            name
+            for name, check in checks.items()
+            if kind in check.kinds and name not in failed and not check.done
+        ]
+        if not readers:
+            continue
+        metadata_only = all(checks[name].metadata_only_for(kind) for name in readers)
+        selectors = {name: checks[name].selector(kind, exemptions) for name in readers}
+        shared = common_selector(list(selectors.values()))
+        logging.info(
+            f"listing {kind} in cluster {cluster_name} for checks {readers}, metadata only: {metadata_only}, field selector: {shared.field_selector}, label selector: {shared.label_selector}"
+        )
+        try:
+            items = list_kind(cluster_name, kind, metadata_only, shared)
+        except Exception as e:
+            logging.error(f"issue listing {kind} in cluster {cluster_name}")
+            logging.error(e)
+            for name in readers:
+                failed.setdefault(name, str(e))
+            continue
+        listings[kind] = (readers, metadata_only, selectors, items)
+    try:
+        for kind, (readers, metadata_only, selectors, items) in listings.items():
+            if all(name in failed or checks[name].done for name in readers):
+                logging.info(f"checks {readers} reached a verdict, listing no more {kind}")
+                continue
+            evaluated_templates = {name: set() for name in readers}
+            try:
+                for item in items:
+                    view = None
+                    key = None
+                    for name in readers:
+                        if name in failed or checks[name].done:
+                            continue
+                        if not selectors[name].matches(item):
+                            continue
+                        if kind == PODS and checks[name].per_workload():
+                            key = key or workload_key(item)
+                            if key in evaluated_templates[name]:
+                                continue
+                            evaluated_templates[name].add(key)
+                        try:
+                            if checks[name].metadata_only_for(kind) and not metadata_only:
+                                view = view or metadata_view(item)
+                                checks[name].visit(kind, view)
+                            else:
+                                checks[name].visit(kind, item)
+                        except Exception as e:
+                            logging.error(f"check {name} failed on cluster {cluster_name}")
+                            logging.error(e)
+                            failed[name] = str(e)
+                    if all(name in failed or checks[name].done for name in readers):
+                        logging.info(f"checks {readers} reached a verdict, listing no more {kind}")
+                        break
+            except Exception as e:
+                logging.error(f"issue listing {kind} in cluster {cluster_name}")
+                logging.error(e)
+                for name in readers:
+                    failed.setdefault(name, str(e))
+            finally:
+                # closing the iterator of list_items stops it requesting further pages
+                if hasattr(items, "close"):
+                    items.close()
+    finally:
+        for readers, metadata_only, selectors, items in listings.values():
+            if hasattr(items, "close"):
+                items.close()
+    evaluations = {}
+    for name, check in checks.items():
+        if name in failed:
+            evaluations[name] = not_applicable(cluster_name, failed[name], clusterarn)
+            continue
+        try:
+            compliance_type, annotation = check.result()
+        except Exception as e:
+            logging.error(f"check {name} failed on cluster {cluster_name}")
+            logging.error(e)
+            evaluations[name] = not_applicable(cluster_name, str(e), clusterarn)
+            continue
+        evaluations[name] = {
+            "compliance_type": compliance_type,
+            "annotation": annotation,
+            "clusterarn": clusterarn,
+        }
+    return evaluations
+
+
+def memo_enabled():
+    """Tells whether verdicts are reused through RESOURCE_VERSION_MEMO, off by default
+
+    The resourceVersion of a list is the etcd revision of the whole cluster,
+    so the memo only hits on clusters without any write between two runs.
+    """
+    return os.environ.get("RESOURCE_VERSION_MEMO", "false").lower() == "true"
+
+
+def probe_resource_version(cluster_name, kind):
+    """Returns the resourceVersion of a collection with a one item metadata only list"""
+    page = kind_list_fn(cluster_name, kind, metadata_only=True)(limit=1, watch=False)
+    return listutils.page_resource_version(page)
+
+
+def count_memo(hit):
+    with _memo_lock:
+        memo_stats["hits" if hit else "misses"] += 1
+
+
+def log_memo_stats():
+    """Logs and resets the memo hits and misses counted since the last call"""
+    with _memo_lock:
+        logging.info(
+            f"resourceVersion memo: {memo_stats['hits']} hits, {memo_stats['misses']} misses"
+        )
+        memo_stats.update({"hits": 0, "misses": 0})
+
+
+def run_checks(cluster_name, check_names, report_verdicts=True, **params):
+    """Returns the evaluation of each named check against the cluster
+
+    A check that fails, or that reads a kind that could not be listed, is
+    reported as NOT_APPLICABLE without affecting the other checks. The
+    verdicts are remembered with the resourceVersion of the cluster, when a
+    one item list shows the same resourceVersion on the next run the
+    remembered verdict is returned without listing or evaluating again.
+    Rules that send no findings pass report_verdicts False, their verdicts
+    are never evaluated again as a report.
+    """
+    logging.info("checking cluster exists")
+    try:
+        clusterarn = clusterutils.describe_cluster(cluster_name)["arn"]
+    except ClientError as e:
+        error = e.response["Error"]["Code"]
+        logging.error(f"error {error} encountered discovering cluster {cluster_name}")
+        return {name: not_applicable(cluster_name, error) for name in check_names}
+    mode = get_mode()
+    unit = get_unit()
+    checks = {
+        name: CHECKS[name](cluster_name, mode=mode, unit=unit, **params) for name in check_names
+    }
+    exemptions = selectorutils.get_exemptions()
+    kinds = [
+        kind for kind in KIND_ORDER if any(kind in check.kinds for check in checks.values())
+    ]
+    evaluations = memo_checks(
+        cluster_name, clusterarn, checks, kinds, exemptions, dict(params, mode=mode, unit=unit)
+    )
+    if mode == VERDICT and report_verdicts:
+        evaluations = report_changed_verdicts(
+            cluster_name, clusterarn, evaluations, exemptions, dict(params, unit=unit)
+        )
+    return {name: evaluations[name] for name in check_names}
+
+
+def memo_checks(cluster_name, clusterarn, checks, kinds, exemptions, params):
+    """Evaluates the checks, reusing remembered verdicts while the resourceVersion is unchanged"""
+    if not memo_enabled() or not kinds:
+        return evaluate_checks(cluster_name, clusterarn, checks, exemptions)
+    try:
+        resource_version = probe_resource_version(cluster_name, kinds[0])
+    except Exception as e:
+        logging.error(f"issue reading resourceVersion of cluster {cluster_name}")
+        logging.error(e)
+        return evaluate_checks(cluster_name, clusterarn, checks, exemptions)
+    store = stateutils.get_state_store()
+    parameters = stateutils.params_hash(dict(params, exemptions=exemptions))
+    evaluations = {}
+    for name in list(checks):
+        memo = stateutils.get_memo(store, name, clusterarn)
+        hit = (
+            memo is not None
+            and memo["resource_version"] == resource_version
+            and memo["params_hash"] == parameters
+        )
+        count_memo(hit)
+        if hit:
+            logging.info(
+                f"cluster {cluster_name} unchanged since resourceVersion {resource_version}, reusing {name} verdict"
+            )
+            evaluations[name] = {
+                "compliance_type": memo["compliance_type"],
+                "annotation": memo["annotation"],
+                "clusterarn": clusterarn,
+            }
+            del checks[name]
+    if checks:
+        evaluated = evaluate_checks(cluster_name, clusterarn, checks, exemptions)
+        for name, evaluation in evaluated.items():
+            if evaluation["compliance_type"] != "NOT_APPLICABLE":
+                stateutils.record_memo(
+                    store,
+                    name,
+                    clusterarn,
+                    {
+                        "resource_version": resource_version,
+                        "params_hash": parameters,
+                        "compliance_type": evaluation["compliance_type"],
+                        "annotation": evaluation["annotation"],
+                    },
+                )
+        evaluations.update(evaluated)
+    return evaluations
+
+
+def report_changed_verdicts(cluster_name, clusterarn, evaluations, exemptions, params):
+    """Re-evaluates in report mode the checks that became NON_COMPLIANT
+
+    A NON_COMPLIANT verdict names the first offender only and is marked with
+    mode verdict, see findings_annotation. When the verdict differs from the
+    last one recorded for the cluster the check is evaluated again in report
+    mode, so the offenders are enumerated when the compliance changes. The
+    changed verdict is marked on the evaluation and only recorded by
+    record_verdict once its finding was delivered, so a report that wasn't
+    sent is evaluated again on the next run.
+    """
+    store = stateutils.get_state_store()
+    changed = {}
+    for name, evaluation in evaluations.items():
+        compliance_type = evaluation["compliance_type"]
+        if compliance_type == "NOT_APPLICABLE":
+            continue
+        if stateutils.get_verdict(store, name, clusterarn) == compliance_type:
+            if compliance_type == "NON_COMPLIANT":
+                evaluation["mode"] = VERDICT
+            continue
+        if compliance_type == "NON_COMPLIANT":
+            changed[name] = CHECKS[name](cluster_name, mode=REPORT, **params)
+        else:
+            evaluation[CHANGED_VERDICT] = name
+    if not changed:
+        return evaluations
+    logging.info(f"verdicts of {list(changed)} changed, evaluating a report")
+    reported = evaluate_checks(cluster_name, clusterarn, changed, exemptions)
+    for name, evaluation in reported.items():
+        if evaluation["compliance_type"] == "NOT_APPLICABLE":
+            evaluations[name]["mode"] = VERDICT
+            continue
+        evaluations[name] = dict(evaluation, **{CHANGED_VERDICT: name})
+    return evaluations
+
+
+def record_verdict(evaluation):
+    """Records the changed verdict of an evaluation once its finding needs no delivery or was delivered"""
+    name = evaluation.get(CHANGED_VERDICT)
+    if name is not None:
+        stateutils.record_verdict(
+            stateutils.get_state_store(), name, evaluation["clusterarn"], evaluation["compliance_type"]
+        )
+
+
+def findings_annotation(evaluation):
+    """Returns the annotation findings are compared on, None for a verdict not listing them all"""
+    if evaluation.get("mode") == VERDICT:
+        return None
+    return evaluation["annotation"]
+
+
+def run_check(cluster_name, check_name, report_verdicts=True, **params):
+    """Returns the evaluation of a single check, used by the rule lambdas"""
+    return run_checks(cluster_name, [check_name], report_verdicts, **params)[check_name]
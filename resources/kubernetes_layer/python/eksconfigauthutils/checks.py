@@ -0,0 +1,254 @@
+"""Checks of the Kubernetes based config rules, run by checkengine
+
+Each check is registered under the name of its rule in lambda_configs.
+"""
+import logging
+import eksconfigauthutils.allowlistutils as allowlistutils
+import eksconfigauthutils.imageutils as imageutils
+import eksconfigauthutils.netpolutils as netpolutils
+from eksconfigauthutils.selectorutils import Selector, EQUALS, NOT_EQUALS
+from eksconfigauthutils.checkengine import (
+    Check,
+    register,
+    PODS,
+    NAMESPACES,
+    NETWORK_POLICIES,
+    workload_of,
+)
+
+"""policy modes of the network policy check"""
+NAMESPACE_MODE = "namespace"
+COVERAGE_MODE = "coverage"
+
+
+@register
+class PrivEscalationCheck(Check):
+    """Pods running containers that allow privilege escalation"""
+
+    name = "privEscalation"
+    kinds = (PODS,)
+    templates = True
+
+    def __init__(self, cluster_name, **params):
+        super().__init__(cluster_name, **params)
+        self.noncompliantpods = []
+
+    def visit(self, kind, pod):
+        for container in pod["spec"]["containers"]:
+            security_context = container.get("securityContext")
+            if security_context is None:
+                logging.info(
+                    f"pod {container['name']} does not have security context configured, skipping"
+                )
+                continue
+            if security_context.get("allowPrivilegeEscalation") == True:
+                logging.info(f"pod {container['name']} allows escalation")
+                self.found()
+                if self.per_workload():
+                    """templates of a workload during a rollout are reported once"""
+                    if self.offender(pod) not in self.noncompliantpods:
+                        self.noncompliantpods.append(self.offender(pod))
+                    break
+                self.noncompliantpods.append(container["name"])
+
+    def result(self):
+        logging.info(self.noncompliantpods)
+        if len(self.noncompliantpods) > 0:
+            return (
+                "NON_COMPLIANT",
+                f"Pods: {self.top(self.noncompliantpods)} in cluster {self.cluster_name} have privilege escalation enabled, see https://kubernetes.io/docs/concepts/security/pod-security-standards/ for more details",
+            )
+        return (
+            "COMPLIANT",
+            f"No pods in cluster {self.cluster_name} have privilege escalation enabled ",
+        )
+
+
+@register
+class TrustedRegistryCheck(Check):
+    """Containers running images not allowed by trusted_registries, see allowlistutils"""
+
+    name = "trustedRegCheck"
+    kinds = (PODS,)
+    templates = True
+
+    def __init__(self, cluster_name, trusted_registries=(), **params):
+        super().__init__(cluster_name, **params)
+        self.trusted_registries = allowlistutils.parse_entries(trusted_registries)
+        self.nonconformantpods = {}
+        if len(self.trusted_registries) == 0:
+            """nothing can be evaluated, so pods are not listed for this check"""
+            self.kinds = ()
+        self.image_verdicts = imageutils.get_verdict_cache(
+            self.name,
+            tuple(self.trusted_registries),
+            allowlistutils.get_matcher(self.name, self.trusted_registries).matches,
+        )
+
+    def visit(self, kind, pod):
+        containers = []
+        for container in pod["spec"]["containers"]:
+            if not self.image_verdicts.get(container["image"]):
+                logging.info(
+                    f"image {container['image']} of container {container['name']} not found in list of permitted registries"
+                )
+                containers.append(f"name:{container['name']},image:{container['image']}")
+        if containers:
+            metadata = pod["metadata"]
+            if self.per_workload():
+                unit = {"Workload": "/".join(workload_of(pod))}
+            else:
+                unit = {"Pod": metadata["name"]}
+            self.nonconformantpods[self.offender(pod)] = {
+                **unit,
+                "Namespace": metadata["namespace"],
+                "containers": containers,
+            }
+            self.found()
+
+    def result(self):
+        if len(self.trusted_registries) == 0:
+            logging.error(
+                "List of trusted entries is empty, please populated and re-evaluate compliance"
+            )
+            return (
+                "NOT_APPLICABLE",
+                f"Validation was not run against cluster {self.cluster_name}, error encountered, no trusted registries defined. Ensure that trusted registries are defined in trusted registries input parameter for the associated config rule",
+            )
+        if len(self.nonconformantpods) > 0:
+            return (
+                "NON_COMPLIANT",
+                f"{self.cluster_name} has pods running images from untrusted registries, pods: {self.top(self.nonconformantpods)}",
+            )
+        return (
+            "COMPLIANT",
+            f"{self.cluster_name} has no pods running images from untrusted registries",
+        )
+
+
+@register
+class DefaultNamespaceCheck(Check):
+    """Pods running in the default namespace"""
+
+    name = "namespaceCheck"
+    kinds = (PODS,)
+    metadata_only = True
+    """only the pods of the default namespace are listed"""
+    selectors = {PODS: Selector([("metadata.namespace", EQUALS, "default")])}
+
+    def __init__(self, cluster_name, **params):
+        super().__init__(cluster_name, **params)
+        self.pods_default_namespace = []
+
+    def visit(self, kind, pod):
+        if pod["metadata"]["namespace"] == "default":
+            logging.info(f"pod {pod['metadata']['name']} is running in default namepace")
+            self.pods_default_namespace.append(pod["metadata"]["name"])
+            self.found()
+
+    def result(self):
+        if len(self.pods_default_namespace) > 0:
+            return (
+                "NON_COMPLIANT",
+                f"Pods: {self.top(self.pods_default_namespace)} are running in the default namespace in cluster: {self.cluster_name}, ensure that pods are not running in the default namespace",
+            )
+        return (
+            "COMPLIANT",
+            f"Cluster: {self.cluster_name} does not have any pods running in the default namespace",
+        )
+
+
+@register
+class NetworkPolicyCheck(Check):
+    """Namespaces without any network policy, or pods no policy selects
+
+    With policy_mode coverage the podSelector of each policy is resolved
+    against an index of pod labels, see netpolutils, and pods that no
+    Ingress or no Egress policy selects are reported.
+    """
+
+    name = "netPolCheck"
+    kinds = (NETWORK_POLICIES, NAMESPACES)
+    metadata_only = True
+    subject = NAMESPACES
+
+    def __init__(self, cluster_name, policy_mode=NAMESPACE_MODE, **params):
+        super().__init__(cluster_name, **params)
+        self.policy_mode = policy_mode
+        self.netpol_namespaces = set()
+        self.insecure_namespaces = []
+        if policy_mode == COVERAGE_MODE:
+            self.kinds = (NETWORK_POLICIES, PODS)
+            self.subject = PODS
+            """pods that completed are not subject to network policies"""
+            self.selectors = {
+                PODS: Selector(
+                    [
+                        ("status.phase", NOT_EQUALS, "Succeeded"),
+                        ("status.phase", NOT_EQUALS, "Failed"),
+                    ]
+                )
+            }
+            self.policies = []
+            self.pod_index = netpolutils.PodIndex()
+
+    def metadata_only_for(self, kind):
+        return self.policy_mode != COVERAGE_MODE or kind != NETWORK_POLICIES
+
+    def visit(self, kind, item):
+        metadata = item["metadata"]
+        if self.policy_mode == COVERAGE_MODE:
+            if kind == NETWORK_POLICIES:
+                self.policies.append(
+                    (
+                        metadata["namespace"],
+                        item["spec"].get("podSelector"),
+                        netpolutils.policy_types(item),
+                    )
+                )
+            else:
+                self.pod_index.add(
+                    metadata["namespace"], metadata["name"], metadata.get("labels")
+                )
+        elif kind == NETWORK_POLICIES:
+            self.netpol_namespaces.add(metadata["namespace"])
+        elif metadata["name"] not in self.netpol_namespaces:
+            logging.info(
+                f"namespace {metadata['name']} does not have a network policy defined"
+            )
+            self.insecure_namespaces.append(metadata["name"])
+            self.found()
+
+    def coverage_result(self):
+        uncovered = netpolutils.uncovered_pods(self.pod_index, self.policies)
+        findings = [
+            f"{len(pods)} pods not selected by any {direction} policy: {self.top(pods)}"
+            for direction, pods in uncovered.items()
+            if pods
+        ]
+        if findings:
+            return (
+                "NON_COMPLIANT",
+                f"Cluster {self.cluster_name} has {', '.join(findings)}. For further information see: https://kubernetes.io/docs/concepts/services-networking/network-policies/",
+            )
+        return (
+            "COMPLIANT",
+            f"Each pod in cluster {self.cluster_name} is selected by an Ingress and an Egress network policy",
+        )
+
+    def result(self):
+        if self.policy_mode == COVERAGE_MODE:
+            return self.coverage_result()
+        if len(self.insecure_namespaces) > 0:
+            logging.info("Namespaces without network policy encountered")
+            return (
+                "NON_COMPLIANT",
+                f"Namespaces {self.top(self.insecure_namespaces)} in cluster {self.cluster_name} do not have any network policy configured. For further information see: https://kubernetes.io/docs/concepts/services-networking/network-policies/",
+            )
+        logging.info(
+            f"Each namespace in cluster {self.cluster_name} has a network policy configured"
+        )
+        return (
+            "COMPLIANT",
+            f"Each namespace in cluster {self.cluster_name} has a network policy configured",
+        )
@@ -0,0 +1,18 @@
+"""Thread safe access to boto3 clients shared by the threads of a lambda container"""
+import threading
+import boto3
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(service_name):
+    """Returns a boto3 client for the service, created once per container
+
+    boto3.client() is not thread safe, the clients it returns are, so clients
+    are created under a lock and then shared between cluster evaluations.
+    """
+    with _lock:
+        if service_name not in _clients:
+            _clients[service_name] = boto3.client(service_name)
+        return _clients[service_name]
@@ -0,0 +1,302 @@
+"""Resolves the clusters in scope of a rule and evaluates them concurrently"""
+import os
+import json
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+import eksconfigauthutils.clientutils as clientutils
+
+DEFAULT_MAX_WORKERS = 8
+
+"""seconds cluster metadata is reused across warm invocations"""
+DEFAULT_METADATA_TTL = 3600
+
+"""seconds a cluster that was not found is remembered as missing"""
+DEFAULT_NOT_FOUND_TTL = 21600
+
+"""seconds of the lambda timeout kept back for putting evaluations and sending findings"""
+RESERVED_SECONDS = 30
+
+ALL_CLUSTERS = "*"
+TAG_PREFIX = "tag:"
+
+"""clusters are evaluated in a thread pool"""
+THREADS = "threads"
+"""clusters are evaluated on an asyncio event loop, see asyncutils"""
+ASYNCIO = "asyncio"
+
+
+def get_max_workers():
+    """Returns the number of clusters evaluated at once, set through MAX_CLUSTER_WORKERS"""
+    try:
+        max_workers = int(os.environ.get("MAX_CLUSTER_WORKERS", DEFAULT_MAX_WORKERS))
+    except ValueError:
+        logging.error("MAX_CLUSTER_WORKERS is not a number, using the default")
+        return DEFAULT_MAX_WORKERS
+    return max(max_workers, 1)
+
+
+def get_runtime():
+    """Returns the runtime clusters are evaluated with, set through EVALUATION_RUNTIME"""
+    runtime = os.environ.get("EVALUATION_RUNTIME", THREADS).lower()
+    if runtime not in [THREADS, ASYNCIO]:
+        logging.error(f"unknown EVALUATION_RUNTIME {runtime}, using {THREADS}")
+        return THREADS
+    return runtime
+
+
+def list_clusters():
+    """Returns the name of every EKS cluster in the account and region"""
+    paginator = clientutils.get_client("eks").get_paginator("list_clusters")
+    clusters = []
+    for page in paginator.paginate():
+        clusters.extend(page["clusters"])
+    return clusters
+
+
+_metadata = {}
+_metadata_lock = threading.Lock()
+
+
+def get_ttl(variable, default):
+    try:
+        return float(os.environ.get(variable, default))
+    except ValueError:
+        logging.error(f"{variable} is not a number, using the default")
+        return default
+
+
+def not_found_error(cluster_name):
+    return ClientError(
+        {
+            "Error": {
+                "Code": "ResourceNotFoundException",
+                "Message": f"No cluster found for name: {cluster_name} (cached)",
+            }
+        },
+        "DescribeCluster",
+    )
+
+
+def describe_cluster(cluster_name):
+    """Returns the metadata of a cluster, described at most once per TTL
+
+    The arn, endpoint, certificate authority, logging configuration, version,
+    status and tags are cached for CLUSTER_METADATA_TTL seconds, which removes
+    the duplicate DescribeCluster calls of authutils and the checks within an
+    invocation and across warm invocations. Clusters that don't exist are
+    remembered for CLUSTER_NOT_FOUND_TTL seconds and raise the original
+    ResourceNotFoundException without calling EKS. Other errors are not cached.
+    """
+    now = time.time()
+    with _metadata_lock:
+        cached = _metadata.get(cluster_name)
+    if cached is not None:
+        if cached["not_found"]:
+            if now - cached["fetched_at"] < get_ttl(
+                "CLUSTER_NOT_FOUND_TTL", DEFAULT_NOT_FOUND_TTL
+            ):
+                logging.info(f"cluster {cluster_name} is cached as not found")
+                raise not_found_error(cluster_name)
+        elif now - cached["fetched_at"] < get_ttl(
+            "CLUSTER_METADATA_TTL", DEFAULT_METADATA_TTL
+        ):
+            return cached["cluster"]
+
+    try:
+        response = clientutils.get_client("eks").describe_cluster(name=cluster_name)
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ResourceNotFoundException":
+            with _metadata_lock:
+                _metadata[cluster_name] = {
+                    "not_found": True,
+                    "fetched_at": now,
+                    "cluster": None,
+                }
+        raise
+    cluster = response["cluster"]
+    metadata = {
+        "name": cluster["name"],
+        "arn": cluster["arn"],
+        "endpoint": cluster.get("endpoint"),
+        "ca_data": cluster.get("certificateAuthority", {}).get("data"),
+        "logging": cluster.get("logging", {}),
+        "version": cluster.get("version"),
+        "status": cluster.get("status"),
+        "tags": cluster.get("tags", {}),
+    }
+    with _metadata_lock:
+        _metadata[cluster_name] = {
+            "not_found": False,
+            "fetched_at": now,
+            "cluster": metadata,
+        }
+    return metadata
+
+
+def get_cluster_tags(cluster_name):
+    """Returns the tags of a cluster, or None when the cluster can't be described"""
+    try:
+        return describe_cluster(cluster_name)["tags"]
+    except ClientError as e:
+        logging.error(f"Issue describing cluster {cluster_name}")
+        logging.error(str(e))
+        return None
+
+
+def matches_tag(tags, tag_filter):
+    """Checks a tag filter of the form key=value, or key to only require the tag"""
+    key, separator, value = tag_filter.partition("=")
+    if tags is None or key not in tags:
+        return False
+    return not separator or tags[key] == value
+
+
+def parse_scope(inscopeclusters):
+    """Splits the inscopeclusters rule parameter into its entries
+
+    The parameter can be a list, a JSON list or a comma separated string.
+    """
+    if isinstance(inscopeclusters, str):
+        inscopeclusters = inscopeclusters.strip()
+        if inscopeclusters.startswith("["):
+            inscopeclusters = json.loads(inscopeclusters)
+        else:
+            inscopeclusters = inscopeclusters.split(",")
+    return [str(entry).strip() for entry in inscopeclusters if str(entry).strip()]
+
+
+def resolve_clusters(inscopeclusters):
+    """Returns the names of the clusters a rule should evaluate
+
+    Each entry of inscopeclusters is either a cluster name, * for every cluster
+    in the account, or tag:key=value for every cluster carrying that tag. The
+    clusters selected by each entry are combined and duplicates removed.
+    """
+    entries = parse_scope(inscopeclusters)
+    tag_filters = [
+        entry[len(TAG_PREFIX) :] for entry in entries if entry.startswith(TAG_PREFIX)
+    ]
+    account_clusters = []
+    if ALL_CLUSTERS in entries or tag_filters:
+        account_clusters = list_clusters()
+        logging.info(f"found {len(account_clusters)} clusters in the account")
+
+    clusters = []
+    for entry in entries:
+        if entry == ALL_CLUSTERS:
+            clusters.extend(account_clusters)
+        elif not entry.startswith(TAG_PREFIX):
+            clusters.append(entry)
+
+    if tag_filters and account_clusters:
+        with ThreadPoolExecutor(
+            max_workers=min(get_max_workers(), len(account_clusters))
+        ) as executor:
+            cluster_tags = executor.map(get_cluster_tags, account_clusters)
+        for cluster_name, tags in zip(account_clusters, cluster_tags):
+            if any(matches_tag(tags, tag_filter) for tag_filter in tag_filters):
+                clusters.append(cluster_name)
+
+    clusters = list(dict.fromkeys(clusters))
+    logging.info(f"clusters in scope: {clusters}")
+    return clusters
+
+
+_account_id = None
+
+
+def get_account_id():
+    """Returns the account of the lambda, looked up once per container"""
+    global _account_id
+    if _account_id is None:
+        _account_id = clientutils.get_client("sts").get_caller_identity()["Account"]
+    return _account_id
+
+
+def cluster_arn(cluster_name):
+    """Returns the ARN of a cluster, built from the account and region when it can't be described
+
+    Evaluations are stored and put under the cluster ARN, so a cluster that
+    could not be evaluated gets the same resource id as when it was.
+    """
+    try:
+        return describe_cluster(cluster_name)["arn"]
+    except (ClientError, BotoCoreError) as e:
+        logging.info(f"cluster {cluster_name} can't be described, building its arn: {e}")
+    try:
+        session = boto3.session.Session()
+        partition = session.get_partition_for_region(session.region_name)
+        return f"arn:{partition}:eks:{session.region_name}:{get_account_id()}:cluster/{cluster_name}"
+    except (ClientError, BotoCoreError, TypeError) as e:
+        logging.error(f"issue building the arn of cluster {cluster_name}")
+        logging.error(str(e))
+        return cluster_name
+
+
+def not_applicable(cluster_name, reason):
+    return {
+        "compliance_type": "NOT_APPLICABLE",
+        "annotation": f"Validation was not run against cluster {cluster_name}, error encountered: {reason}",
+        "clusterarn": cluster_arn(cluster_name),
+    }
+
+
+def get_timeout(context):
+    """Returns the seconds left to evaluate clusters, None without a lambda context"""
+    if context is None:
+        return None
+    remaining_seconds = context.get_remaining_time_in_millis() / 1000
+    return max(remaining_seconds - RESERVED_SECONDS, 0)
+
+
+def collect_results(clusters, futures, not_done):
+    """Returns (cluster_name, evaluation) for the futures of the evaluations of clusters"""
+    results = []
+    for cluster_name, future in zip(clusters, futures):
+        if future in not_done:
+            logging.error(f"evaluation of cluster {cluster_name} did not finish in time")
+            evaluation = not_applicable(cluster_name, "evaluation timed out")
+        elif future.exception() is not None:
+            logging.error(f"evaluation of cluster {cluster_name} failed")
+            logging.error(str(future.exception()))
+            evaluation = not_applicable(cluster_name, str(future.exception()))
+        elif not isinstance(future.result(), dict):
+            logging.error(f"evaluation of cluster {cluster_name} returned no result")
+            evaluation = not_applicable(cluster_name, str(future.result()))
+        else:
+            evaluation = future.result()
+            if "clusterarn" not in evaluation:
+                evaluation["clusterarn"] = cluster_arn(cluster_name)
+        results.append((cluster_name, evaluation))
+    return results
+
+
+def evaluate_clusters(evaluate_fn, clusters, context=None, *args):
+    """Evaluates every cluster in a bounded thread pool
+
+    evaluate_fn is called as evaluate_fn(cluster_name, *args). Returns a list
+    of (cluster_name, evaluation) in the order of clusters. Clusters that fail
+    or are still running when the lambda is about to time out are reported as
+    NOT_APPLICABLE, so every cluster still gets its own evaluation. With
+    EVALUATION_RUNTIME set to asyncio the clusters are evaluated by
+    asyncutils instead.
+    """
+    if len(clusters) == 0:
+        return []
+    if get_runtime() == ASYNCIO:
+        # asyncutils imports this module
+        import eksconfigauthutils.asyncutils as asyncutils
+
+        return asyncutils.evaluate_clusters(evaluate_fn, clusters, context, *args)
+    executor = ThreadPoolExecutor(
+        max_workers=min(get_max_workers(), len(clusters)),
+        thread_name_prefix="cluster",
+    )
+    futures = [executor.submit(evaluate_fn, cluster, *args) for cluster in clusters]
+    done, not_done = wait(futures, timeout=get_timeout(context))
+    executor.shutdown(wait=False, cancel_futures=True)
+    return collect_results(clusters, futures, not_done)
@@ -0,0 +1,111 @@
+"""Collects config evaluations of a rule run and puts them in batches"""
+import os
+import time
+import logging
+from botocore.exceptions import ClientError
+import eksconfigauthutils.clientutils as clientutils
+
+"""PutEvaluations accepts up to 100 evaluations per request"""
+MAX_EVALUATIONS_PER_REQUEST = 100
+
+"""Config rejects annotations longer than 256 characters"""
+MAX_ANNOTATION_LENGTH = 256
+
+MAX_ATTEMPTS = 5
+THROTTLING_ERRORS = ["ThrottlingException", "Throttling", "TooManyRequestsException"]
+
+
+def get_test_mode():
+    """Returns True when evaluations should be validated by Config but not recorded"""
+    return os.environ.get("EVALUATIONS_TEST_MODE", "false").lower() == "true"
+
+
+class EvaluationAccumulator:
+    """Accumulates evaluations and flushes them in chunks of 100
+
+    Used by the rule lambdas instead of one put_evaluations call per cluster:
+    evaluations are added while clusters or resources are evaluated and
+    flushed once at the end of the run. Throttled requests are retried with
+    exponential backoff. With test_mode Config validates the evaluations
+    without recording them, which allows dry runs against real clusters.
+    """
+
+    def __init__(self, result_token, test_mode=None, client=None):
+        self.result_token = result_token
+        self.test_mode = get_test_mode() if test_mode is None else test_mode
+        self.client = client
+        self.evaluations = []
+        self.requests = 0
+
+    def add(
+        self,
+        resource_id,
+        compliance_type,
+        annotation,
+        ordering_timestamp,
+        resource_type="AWS::EKS::Cluster",
+    ):
+        self.evaluations.append(
+            {
+                "ComplianceResourceType": resource_type,
+                "ComplianceResourceId": resource_id,
+                "ComplianceType": compliance_type,
+                "Annotation": annotation[:MAX_ANNOTATION_LENGTH],
+                "OrderingTimestamp": ordering_timestamp,
+            }
+        )
+
+    def put_chunk(self, chunk):
+        client = self.client or clientutils.get_client("config")
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                self.requests += 1
+                response = client.put_evaluations(
+                    Evaluations=chunk,
+                    ResultToken=self.result_token,
+                    TestMode=self.test_mode,
+                )
+                return response.get("FailedEvaluations", [])
+            except ClientError as e:
+                if (
+                    e.response["Error"]["Code"] not in THROTTLING_ERRORS
+                    or attempt == MAX_ATTEMPTS - 1
+                ):
+                    raise
+                delay = 2 ** attempt * 0.5
+                logging.info(f"put_evaluations throttled, retrying in {delay} seconds")
+                time.sleep(delay)
+
+    def take_chunks(self):
+        """Returns the accumulated evaluations in chunks of one request and clears them"""
+        evaluations, self.evaluations = self.evaluations, []
+        return [
+            evaluations[start : start + MAX_EVALUATIONS_PER_REQUEST]
+            for start in range(0, len(evaluations), MAX_EVALUATIONS_PER_REQUEST)
+        ]
+
+    def put_batch(self, chunk):
+        """Puts one chunk of evaluations, returns the evaluations Config rejected"""
+        try:
+            return self.put_chunk(chunk)
+        except ClientError as e:
+            logging.error("error in putting config check results")
+            logging.error(str(e))
+            return chunk
+
+    def report(self, chunks, failed_evaluations):
+        if len(failed_evaluations) > 0:
+            logging.error(f"{len(failed_evaluations)} evaluations were not put")
+            logging.error(failed_evaluations)
+        logging.info(
+            f"put {sum(len(chunk) for chunk in chunks)} evaluations in {self.requests} requests, test mode: {self.test_mode}"
+        )
+
+    def flush(self):
+        """Puts every accumulated evaluation, returns the evaluations Config rejected"""
+        chunks = self.take_chunks()
+        failed_evaluations = []
+        for chunk in chunks:
+            failed_evaluations.extend(self.put_batch(chunk))
+        self.report(chunks, failed_evaluations)
+        return failed_evaluations
@@ -0,0 +1,134 @@
+"""Parses container image references and caches the verdict of each image
+
+Clusters run thousands of containers from a few dozen images, so the verdict
+of an image, e.g. whether its registry is trusted, is computed once and kept
+in an LRU cache. Caches are kept by the warm lambda container across runs
+unless IMAGE_CACHE_WARM is false, the hits and misses of all caches are
+counted in cache_stats.
+"""
+import os
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+DEFAULT_REGISTRY = "docker.io"
+"""images of Docker Hub without a namespace are in the library namespace"""
+DEFAULT_NAMESPACE = "library"
+DEFAULT_TAG = "latest"
+
+DEFAULT_CACHE_SIZE = 4096
+
+ImageReference = namedtuple("ImageReference", ["registry", "repository", "tag", "digest"])
+
+cache_stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+"""key and verdict cache of each rule"""
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def is_registry(component):
+    """Tells whether the first component of a reference names a registry host"""
+    return "." in component or ":" in component or component == "localhost"
+
+
+def split_reference(reference):
+    """Returns the registry, repository, tag and digest of a reference as written
+
+    The tag and digest are None when the reference doesn't have them.
+    """
+    name, _, digest = reference.partition("@")
+    registry, slash, remainder = name.partition("/")
+    if not slash or not is_registry(registry):
+        registry, remainder = DEFAULT_REGISTRY, name
+    repository, colon, tag = remainder.rpartition(":")
+    if not colon or "/" in tag:
+        repository, tag = remainder, None
+    if registry == DEFAULT_REGISTRY and "/" not in repository:
+        repository = f"{DEFAULT_NAMESPACE}/{repository}"
+    return ImageReference(registry, repository, tag, digest or None)
+
+
+def parse_image(reference):
+    """Splits an image reference into registry, repository, tag and digest
+
+    Follows the rules of the Docker reference grammar: the first component
+    is a registry when it contains a dot or a port or is localhost, otherwise
+    the image is on Docker Hub. A reference with a digest and no tag has the
+    tag None, one with neither the latest tag.
+    """
+    image = split_reference(reference)
+    if image.tag is None and image.digest is None:
+        return image._replace(tag=DEFAULT_TAG)
+    return image
+
+
+def count(hit):
+    with _stats_lock:
+        cache_stats["hits" if hit else "misses"] += 1
+
+
+def log_cache_stats():
+    """Logs and resets the image cache hits and misses counted since the last call"""
+    with _stats_lock:
+        lookups = cache_stats["hits"] + cache_stats["misses"]
+        rate = cache_stats["hits"] / lookups if lookups else 0
+        logging.info(
+            f"image verdict cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, hit rate {rate:.1%}"
+        )
+        cache_stats.update({"hits": 0, "misses": 0})
+
+
+class ImageVerdictCache:
+    """LRU cache of the verdict of each image reference
+
+    verdict_fn is called with the parsed ImageReference of images not in the
+    cache.
+    """
+
+    def __init__(self, verdict_fn, maxsize=DEFAULT_CACHE_SIZE):
+        self.verdict_fn = verdict_fn
+        self.maxsize = maxsize
+        self.verdicts = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, image):
+        with self.lock:
+            if image in self.verdicts:
+                self.verdicts.move_to_end(image)
+                count(True)
+                return self.verdicts[image]
+        verdict = self.verdict_fn(parse_image(image))
+        count(False)
+        with self.lock:
+            self.verdicts[image] = verdict
+            if len(self.verdicts) > self.maxsize:
+                self.verdicts.popitem(last=False)
+        return verdict
+
+
+def get_cache_size():
+    try:
+        return int(os.environ.get("IMAGE_CACHE_SIZE", DEFAULT_CACHE_SIZE))
+    except ValueError:
+        logging.error(
+            f"IMAGE_CACHE_SIZE is not a number, using the default of {DEFAULT_CACHE_SIZE}"
+        )
+        return DEFAULT_CACHE_SIZE
+
+
+def get_verdict_cache(rule, key, verdict_fn):
+    """Returns the cache of verdict_fn for a rule, kept across runs in a warm container
+
+    key identifies the verdict, e.g. the trusted registries it was
+    computed for. Each rule keeps a single cache, replaced when its key
+    changes, so verdicts of other parameters are neither mixed up nor kept.
+    """
+    if os.environ.get("IMAGE_CACHE_WARM", "true").lower() != "true":
+        return ImageVerdictCache(verdict_fn, get_cache_size())
+    with _caches_lock:
+        cached_key, cache = _caches.get(rule, (None, None))
+        if cached_key != key:
+            cache = ImageVerdictCache(verdict_fn, get_cache_size())
+            _caches[rule] = (key, cache)
+        return cache
@@ -0,0 +1,336 @@
+"""Helpers for listing Kubernetes resources one page at a time
+
+Pages are either model objects returned by the generated client methods or
+plain dicts returned by the list calls of raw_list_fn, the page_ helpers read
+both. list_items requests the pages from a background thread, up to
+PREFETCH_PAGES pages ahead of the items being evaluated, so the next page is
+on the wire while the current one is decoded and evaluated.
+"""
+import os
+import json
+import queue
+import logging
+import threading
+import eksconfigauthutils.protoutils as protoutils
+
+try:
+    import orjson
+
+    loads = orjson.loads
+except ImportError:
+    """orjson is a compiled wheel, when the layer was built without it the json module is used"""
+    loads = json.loads
+
+DEFAULT_PAGE_SIZE = 500
+DEFAULT_PREFETCH_PAGES = 1
+
+"""lists are served from the API server watch cache, which can be slightly stale"""
+CACHED = "cached"
+"""lists are read from etcd with a quorum read"""
+CONSISTENT = "consistent"
+
+"""API servers before this version ignore limit on lists served from the watch cache
+
+Paged lists from the watch cache (ListFromCacheSnapshot) are alpha and off
+by default in 1.33, and only enabled by default from 1.34.
+"""
+WATCH_CACHE_PAGING_VERSION = (1, 34)
+
+JSON_ACCEPT = "application/json"
+"""built-in kinds are returned as protobuf, anything else falls back to JSON"""
+PROTOBUF_ACCEPT = "application/vnd.kubernetes.protobuf, application/json"
+PROTOBUF_CONTENT_TYPE = "application/vnd.kubernetes.protobuf"
+
+JSON = "json"
+PROTOBUF = "protobuf"
+"""asks the API server for the metadata of each object only"""
+METADATA_ACCEPT = "application/json;as=PartialObjectMetadataList;g=meta.k8s.io;v=v1"
+
+
+def get_page_size():
+    """Returns the page size configured for the rule through the PAGE_SIZE variable"""
+    try:
+        page_size = int(os.environ.get("PAGE_SIZE", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        logging.error("PAGE_SIZE is not a number, using the default page size")
+        return DEFAULT_PAGE_SIZE
+    if page_size <= 0:
+        return DEFAULT_PAGE_SIZE
+    return page_size
+
+
+def get_prefetch_pages():
+    """Returns the pages listed ahead of evaluation configured through PREFETCH_PAGES, 0 disables"""
+    try:
+        return int(os.environ.get("PREFETCH_PAGES", DEFAULT_PREFETCH_PAGES))
+    except ValueError:
+        logging.error(
+            f"PREFETCH_PAGES is not a number, using the default of {DEFAULT_PREFETCH_PAGES}"
+        )
+        return DEFAULT_PREFETCH_PAGES
+
+
+def get_consistency():
+    """Returns the consistency of list calls configured for the rule through LIST_CONSISTENCY"""
+    consistency = os.environ.get("LIST_CONSISTENCY", CACHED).lower()
+    if consistency not in [CACHED, CONSISTENT]:
+        logging.error(f"unknown LIST_CONSISTENCY {consistency}, using {CACHED}")
+        return CACHED
+    return consistency
+
+
+def pages_watch_cache(server_version):
+    """Tells whether an API server of server_version, e.g. "1.34", pages lists served from its watch cache
+
+    Older API servers return the whole collection in a single response to
+    a list with resourceVersion 0, whatever its limit.
+    """
+    try:
+        major, minor = server_version.split(".")[:2]
+        return (int(major), int(minor.rstrip("+"))) >= WATCH_CACHE_PAGING_VERSION
+    except (AttributeError, ValueError):
+        return False
+
+
+def get_encoding():
+    """Returns the wire format of list calls configured for the rule through LIST_ENCODING"""
+    encoding = os.environ.get("LIST_ENCODING", JSON).lower()
+    if encoding not in [JSON, PROTOBUF]:
+        logging.error(f"unknown LIST_ENCODING {encoding}, using {JSON}")
+        return JSON
+    return encoding
+
+
+def page_items(page):
+    return page["items"] if isinstance(page, dict) else page.items
+
+
+def page_continue(page):
+    if isinstance(page, dict):
+        return page["metadata"].get("continue")
+    return page.metadata._continue
+
+
+def page_resource_version(page):
+    if isinstance(page, dict):
+        return page["metadata"].get("resourceVersion")
+    return page.metadata.resource_version
+
+
+def raw_list_fn(api_client, path, accept=JSON_ACCEPT, protobuf_schema=None):
+    """Returns a list call for path that returns each page as a plain dict
+
+    The generated client methods build V1Pod and other model objects from
+    each response, which takes most of the time of listing large clusters.
+    The returned call takes the same arguments as those methods, reads the
+    raw response with _preload_content=False and decodes it with orjson into
+    dicts using the API field names. It sends its own Accept header, e.g.
+    METADATA_ACCEPT to receive the metadata of each object only.
+
+    With a protobuf_schema from protoutils and LIST_ENCODING set to protobuf,
+    full objects are requested in the protobuf wire format and the fields of
+    the schema decoded. JSON is used when the server answers with JSON, e.g.
+    for custom resources, and the page is requested again as JSON when the
+    protobuf response can't be decoded.
+    """
+    use_protobuf = (
+        protobuf_schema is not None and accept == JSON_ACCEPT and get_encoding() == PROTOBUF
+    )
+
+    def list_fn(
+        limit=None,
+        watch=False,
+        _continue=None,
+        resource_version=None,
+        resource_version_match=None,
+        label_selector=None,
+        field_selector=None,
+    ):
+        params = {
+            "limit": limit,
+            "continue": _continue,
+            "resourceVersion": resource_version,
+            "resourceVersionMatch": resource_version_match,
+            "labelSelector": label_selector,
+            "fieldSelector": field_selector,
+        }
+        query_params = [("watch", watch)] + [
+            (name, value) for name, value in params.items() if value is not None
+        ]
+
+        def get(header_accept):
+            return api_client.call_api(
+                path,
+                "GET",
+                query_params=query_params,
+                header_params={"Accept": header_accept},
+                auth_settings=["BearerToken"],
+                _return_http_data_only=True,
+                _preload_content=False,
+            )
+
+        if use_protobuf:
+            response = get(PROTOBUF_ACCEPT)
+            content_type = response.headers.get("Content-Type", "")
+            if content_type.startswith(PROTOBUF_CONTENT_TYPE):
+                try:
+                    return protoutils.decode_list(response.data, protobuf_schema)
+                except protoutils.DecodeError as e:
+                    logging.error(f"issue decoding protobuf list of {path}, listing as JSON")
+                    logging.error(str(e))
+                    response = get(accept)
+        else:
+            response = get(accept)
+        return loads(response.data)
+
+    return list_fn
+
+
+def list_pages(list_fn, page_size=None, consistency=None, **kwargs):
+    """Yields each page of a paginated Kubernetes list call
+
+    list_fn is any list method of the kubernetes client, e.g.
+    k8s_api.list_pod_for_all_namespaces. The continue token of each page is
+    passed to the next request, so only a single page is held in memory.
+
+    With the cached consistency the first request asks for resourceVersion 0
+    with NotOlderThan matching, which the API server answers from its watch
+    cache instead of a quorum read from etcd. The following pages are read at
+    the resourceVersion held by the continue token. API servers before 1.34
+    ignore the limit of such lists, see pages_watch_cache.
+    """
+    if page_size is None:
+        page_size = get_page_size()
+    if consistency is None:
+        consistency = get_consistency()
+    if consistency == CACHED:
+        kwargs.update({"resource_version": "0", "resource_version_match": "NotOlderThan"})
+    _continue = None
+    pages = 0
+    while True:
+        if _continue:
+            # resourceVersion can't be combined with a continue token
+            kwargs.pop("resource_version", None)
+            kwargs.pop("resource_version_match", None)
+            kwargs["_continue"] = _continue
+        page = list_fn(limit=page_size, watch=False, **kwargs)
+        pages += 1
+        logging.info(f"received page {pages} with {len(page_items(page))} items")
+        if len(page_items(page)) > page_size:
+            logging.error(
+                f"the API server ignored the limit of {page_size} items, the list is not paged"
+            )
+        yield page
+        _continue = page_continue(page)
+        if not _continue:
+            break
+
+
+class Prefetcher:
+    """Iterates over what iterable_fn returns, produced by a background thread
+
+    The thread starts when the Prefetcher is created and stays at most depth
+    elements ahead of the consumer, a bounded queue holding it back. An
+    exception raised by the producer is raised to the consumer. close stops
+    the producer before its next element, e.g. when a verdict was reached.
+    """
+
+    DONE = object()
+    """seconds between checks whether the consumer closed the Prefetcher while the queue is full"""
+    POLL_SECONDS = 0.1
+
+    def __init__(self, iterable_fn, depth=DEFAULT_PREFETCH_PAGES, name="prefetch"):
+        self.queue = queue.Queue(maxsize=max(depth, 1))
+        self.stopped = threading.Event()
+        self.finished = False
+        self.thread = threading.Thread(
+            target=self.produce, args=(iterable_fn,), name=name, daemon=True
+        )
+        self.thread.start()
+
+    def put(self, entry):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(entry, timeout=self.POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce(self, iterable_fn):
+        elements = None
+        try:
+            elements = iterable_fn()
+            for element in elements:
+                if not self.put((element, None)):
+                    return
+        except Exception as e:
+            self.put((self.DONE, e))
+            return
+        finally:
+            # closing a generator runs its cleanup, e.g. releasing a snapshot lease
+            if hasattr(elements, "close"):
+                elements.close()
+        self.put((self.DONE, None))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.finished:
+            raise StopIteration
+        element, error = self.queue.get()
+        if element is self.DONE:
+            self.finished = True
+            if error is not None:
+                raise error
+            raise StopIteration
+        return element
+
+    def close(self):
+        self.finished = True
+        self.stopped.set()
+
+
+def prefetch(iterable_fn, depth=None, name="prefetch"):
+    """Returns a Prefetcher of iterable_fn, or what it returns when prefetching is disabled"""
+    if depth is None:
+        depth = get_prefetch_pages()
+    if depth <= 0:
+        return iterable_fn()
+    return Prefetcher(iterable_fn, depth, name)
+
+
+class PageItems:
+    """Iterates over the items of pages, closing the pages when closed"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.items = (item for page in pages for item in page_items(page))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.items)
+
+    def close(self):
+        self.items.close()
+        if hasattr(self.pages, "close"):
+            self.pages.close()
+
+
+def list_items(list_fn, page_size=None, consistency=None, prefetch_pages=None, **kwargs):
+    """Returns an iterator over each item of a paginated Kubernetes list call
+
+    The first page is requested right away by the prefetching thread, unless
+    prefetch_pages or PREFETCH_PAGES is 0. Closing the iterator stops the
+    requests for further pages.
+    """
+    return PageItems(
+        prefetch(
+            lambda: list_pages(list_fn, page_size, consistency, **kwargs),
+            prefetch_pages,
+            name="list-prefetch",
+        )
+    )
@@ -0,0 +1,104 @@
+"""Local stand-ins for the S3 and SQS clients used by the shared helpers
+
+They implement the subset of the boto3 client API the helpers call, so the
+helpers can be exercised in tests or run locally without AWS. LocalS3Client
+keeps objects as files under a directory, LocalSQSClient keeps messages in
+memory.
+"""
+import os
+import io
+import uuid
+import hashlib
+import threading
+from botocore.exceptions import ClientError
+
+"""SQS rejects batches whose messages add up to more than 256 KiB"""
+MAX_SQS_BATCH_BYTES = 262144
+
+
+class LocalS3Client:
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+
+    def object_path(self, Bucket, Key):
+        return os.path.join(self.root_dir, Bucket, *Key.split("/"))
+
+    def put_object(self, Bucket, Key, Body, IfNoneMatch=None, **kwargs):
+        if isinstance(Body, str):
+            Body = Body.encode()
+        path = self.object_path(Bucket, Key)
+        if IfNoneMatch == "*" and os.path.exists(path):
+            raise ClientError(
+                {"Error": {"Code": "PreconditionFailed", "Message": Key}}, "PutObject"
+            )
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(Body)
+        return {"ETag": f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None, **kwargs):
+        path = self.object_path(Bucket, Key)
+        if not os.path.exists(path):
+            raise ClientError(
+                {"Error": {"Code": "NoSuchKey", "Message": Key}}, "GetObject"
+            )
+        with open(path, "rb") as f:
+            body = f.read()
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if IfNoneMatch is not None and IfNoneMatch == etag:
+            raise ClientError(
+                {"Error": {"Code": "304", "Message": "Not Modified"}}, "GetObject"
+            )
+        return {"Body": io.BytesIO(body), "ETag": etag, "ContentLength": len(body)}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        response = self.get_object(Bucket, Key)
+        return {"ETag": response["ETag"], "ContentLength": response["ContentLength"]}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        path = self.object_path(Bucket, Key)
+        if os.path.exists(path):
+            os.remove(path)
+        return {}
+
+
+class LocalSQSClient:
+    def __init__(self):
+        self.messages = []
+        self.lock = threading.Lock()
+
+    def send_message(self, QueueUrl, MessageBody, **kwargs):
+        message_id = str(uuid.uuid4())
+        with self.lock:
+            self.messages.append(
+                {"QueueUrl": QueueUrl, "MessageId": message_id, "Body": MessageBody}
+            )
+        return {"MessageId": message_id}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        if len(Entries) > 10:
+            raise ClientError(
+                {"Error": {"Code": "TooManyEntriesInBatchRequest"}}, "SendMessageBatch"
+            )
+        if sum(len(entry["MessageBody"].encode()) for entry in Entries) > MAX_SQS_BATCH_BYTES:
+            raise ClientError(
+                {"Error": {"Code": "BatchRequestTooLong"}}, "SendMessageBatch"
+            )
+        successful = []
+        for entry in Entries:
+            response = self.send_message(QueueUrl, entry["MessageBody"])
+            successful.append({"Id": entry["Id"], "MessageId": response["MessageId"]})
+        return {"Successful": successful, "Failed": []}
+
+    def to_lambda_event(self, region="us-east-1"):
+        """Returns the queued messages as the event of an SQS triggered lambda"""
+        return {
+            "Records": [
+                {
+                    "messageId": message["MessageId"],
+                    "body": message["Body"],
+                    "awsRegion": region,
+                }
+                for message in self.messages
+            ]
+        }
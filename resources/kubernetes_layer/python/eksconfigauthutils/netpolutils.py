@@ -0,0 +1,117 @@
+"""Resolves the pods selected by network policies through an index of pod labels
+
+PodIndex numbers the pods it is given and indexes them by namespace, by
+(namespace, label key) and by (namespace, label key, value). The podSelector
+of a policy is then resolved with set intersections and differences over
+the index rather than by matching every pod against every policy, which
+keeps coverage of thousands of policies over tens of thousands of pods
+proportional to the pods each policy selects.
+"""
+INGRESS = "Ingress"
+EGRESS = "Egress"
+DIRECTIONS = [INGRESS, EGRESS]
+
+
+def policy_types(policy):
+    """Returns the directions a policy applies to, following the defaults of the API
+
+    Without policyTypes a policy applies to ingress, and to egress when it
+    has egress rules.
+    """
+    spec = policy.get("spec") or {}
+    if spec.get("policyTypes"):
+        return spec["policyTypes"]
+    if spec.get("egress"):
+        return [INGRESS, EGRESS]
+    return [INGRESS]
+
+
+class PodIndex:
+    """Pods of a cluster indexed by namespace and labels"""
+
+    def __init__(self):
+        self.names = []
+        self.namespaces = {}
+        self.keys = {}
+        self.labels = {}
+
+    def add(self, namespace, name, labels):
+        pod = len(self.names)
+        self.names.append(f"{namespace}/{name}")
+        self.namespaces.setdefault(namespace, set()).add(pod)
+        for key, value in (labels or {}).items():
+            self.keys.setdefault((namespace, key), set()).add(pod)
+            self.labels.setdefault((namespace, key, value), set()).add(pod)
+        return pod
+
+    def requirement(self, namespace, key, operator, values):
+        """Returns the pods of namespace meeting a label selector requirement"""
+        if operator == "In":
+            selected = set()
+            for value in values:
+                selected |= self.labels.get((namespace, key, value), set())
+            return selected
+        if operator == "NotIn":
+            excluded = set()
+            for value in values:
+                excluded |= self.labels.get((namespace, key, value), set())
+            return self.namespaces.get(namespace, set()) - excluded
+        if operator == "Exists":
+            return self.keys.get((namespace, key), set())
+        if operator == "DoesNotExist":
+            return self.namespaces.get(namespace, set()) - self.keys.get((namespace, key), set())
+        raise ValueError(f"unsupported label selector operator {operator}")
+
+    def select(self, namespace, selector):
+        """Returns the pods of namespace selected by a LabelSelector
+
+        Requirements are intersected smallest first, an empty selector selects
+        every pod of the namespace.
+        """
+        selector = selector or {}
+        requirements = [
+            (key, "In", [value]) for key, value in (selector.get("matchLabels") or {}).items()
+        ]
+        for expression in selector.get("matchExpressions") or []:
+            requirements.append(
+                (expression["key"], expression["operator"], expression.get("values") or [])
+            )
+        if not requirements:
+            return self.namespaces.get(namespace, set())
+        sets = sorted(
+            (self.requirement(namespace, *requirement) for requirement in requirements), key=len
+        )
+        selected = set(sets[0])
+        for pods in sets[1:]:
+            if not selected:
+                break
+            selected &= pods
+        return selected
+
+
+def uncovered_pods(index, policies, directions=DIRECTIONS):
+    """Returns, per direction, the names of the pods no policy of that direction selects
+
+    policies are (namespace, podSelector, policy types) tuples. A namespace
+    whose pods are all selected by a policy is skipped by the later policies
+    of that direction.
+    """
+    uncovered = {}
+    for direction in directions:
+        covered = set()
+        complete = set()
+        for namespace, selector, types in policies:
+            if direction not in types or namespace in complete:
+                continue
+            selected = index.select(namespace, selector)
+            if selected is index.namespaces.get(namespace):
+                complete.add(namespace)
+            else:
+                covered |= selected
+        uncovered[direction] = sorted(
+            index.names[pod]
+            for namespace, pods in index.namespaces.items()
+            if namespace not in complete
+            for pod in pods - covered
+        )
+    return uncovered
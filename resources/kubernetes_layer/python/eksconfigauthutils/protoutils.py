@@ -0,0 +1,245 @@
+"""Decodes Kubernetes protobuf list responses into the dicts the checks read
+
+The API server returns built-in kinds as application/vnd.kubernetes.protobuf
+when asked: a four byte magic number followed by a runtime.Unknown message
+whose raw field holds the encoded list. There is no Python package with the
+Kubernetes protobuf types, so the messages are decoded against small schemas
+naming only the fields the checks read, using the field numbers of the
+generated.proto files of k8s.io/api. Other fields are skipped by length
+without being decoded, which is where the time is saved. The dicts use the
+same API field names as the JSON responses.
+"""
+MAGIC = b"k8s\x00"
+
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+FIXED32 = 5
+
+
+class DecodeError(Exception):
+    pass
+
+
+"""a schema maps field numbers to (json name, type, repeated, nested schema)"""
+STRING = "string"
+BOOL = "bool"
+INT = "int"
+BYTES = "bytes"
+MESSAGE = "message"
+MAP = "map"
+
+"""map fields are repeated entries with the key and value as fields 1 and 2"""
+MAP_ENTRY = {
+    1: ("key", STRING, False, None),
+    2: ("value", STRING, False, None),
+}
+
+OWNER_REFERENCE = {
+    1: ("kind", STRING, False, None),
+    3: ("name", STRING, False, None),
+    4: ("uid", STRING, False, None),
+    5: ("apiVersion", STRING, False, None),
+    6: ("controller", BOOL, False, None),
+}
+
+OBJECT_META = {
+    1: ("name", STRING, False, None),
+    3: ("namespace", STRING, False, None),
+    5: ("uid", STRING, False, None),
+    6: ("resourceVersion", STRING, False, None),
+    11: ("labels", MAP, False, None),
+    12: ("annotations", MAP, False, None),
+    13: ("ownerReferences", MESSAGE, True, OWNER_REFERENCE),
+}
+
+SECURITY_CONTEXT = {
+    2: ("privileged", BOOL, False, None),
+    4: ("runAsUser", INT, False, None),
+    5: ("runAsNonRoot", BOOL, False, None),
+    6: ("readOnlyRootFilesystem", BOOL, False, None),
+    7: ("allowPrivilegeEscalation", BOOL, False, None),
+}
+
+CONTAINER = {
+    1: ("name", STRING, False, None),
+    2: ("image", STRING, False, None),
+    15: ("securityContext", MESSAGE, False, SECURITY_CONTEXT),
+}
+
+POD_SPEC = {
+    2: ("containers", MESSAGE, True, CONTAINER),
+    8: ("serviceAccountName", STRING, False, None),
+    10: ("nodeName", STRING, False, None),
+    20: ("initContainers", MESSAGE, True, CONTAINER),
+}
+
+POD_STATUS = {
+    1: ("phase", STRING, False, None),
+}
+
+POD = {
+    1: ("metadata", MESSAGE, False, OBJECT_META),
+    2: ("spec", MESSAGE, False, POD_SPEC),
+    3: ("status", MESSAGE, False, POD_STATUS),
+}
+
+LIST_META = {
+    2: ("resourceVersion", STRING, False, None),
+    3: ("continue", STRING, False, None),
+}
+
+
+def list_schema(item_schema):
+    return {
+        1: ("metadata", MESSAGE, False, LIST_META),
+        2: ("items", MESSAGE, True, item_schema),
+    }
+
+
+POD_LIST = list_schema(POD)
+
+UNKNOWN = {
+    2: ("raw", BYTES, False, None),
+    4: ("contentType", STRING, False, None),
+}
+
+
+def read_varint(data, position):
+    result = 0
+    shift = 0
+    while True:
+        if position >= len(data):
+            raise DecodeError("truncated varint")
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, position
+        shift += 7
+        if shift > 63:
+            raise DecodeError("varint too long")
+
+
+def decode_message(data, schema, start=0, end=None):
+    """Decodes the fields of schema from data[start:end] into a dict"""
+    if end is None:
+        end = len(data)
+    message = {}
+    position = start
+    while position < end:
+        # keys and lengths below 128 are a single byte, read them without read_varint
+        key = data[position]
+        if key < 0x80:
+            position += 1
+        else:
+            key, position = read_varint(data, position)
+        number = key >> 3
+        wire_type = key & 7
+        if wire_type == VARINT:
+            value, position = read_varint(data, position)
+        elif wire_type == LENGTH_DELIMITED:
+            length = data[position]
+            if length < 0x80:
+                position += 1
+            else:
+                length, position = read_varint(data, position)
+            value = (position, position + length)
+            position += length
+        elif wire_type == FIXED64:
+            position += 8
+            continue
+        elif wire_type == FIXED32:
+            position += 4
+            continue
+        else:
+            raise DecodeError(f"unsupported wire type {wire_type}")
+        if position > end:
+            raise DecodeError("field runs past the end of its message")
+        field = schema.get(number)
+        if field is None:
+            continue
+        name, field_type, repeated, nested = field
+        if field_type == MESSAGE:
+            value = decode_message(data, nested, *value)
+        elif field_type == STRING:
+            value = data[value[0] : value[1]].decode()
+        elif field_type == BYTES:
+            value = data[value[0] : value[1]]
+        elif field_type == BOOL:
+            value = bool(value)
+        elif field_type == INT:
+            if value >= 1 << 63:
+                value -= 1 << 64
+        elif field_type == MAP:
+            entry = decode_message(data, MAP_ENTRY, *value)
+            message.setdefault(name, {})[entry.get("key", "")] = entry.get("value", "")
+            continue
+        if repeated:
+            message.setdefault(name, []).append(value)
+        else:
+            message[name] = value
+    return message
+
+
+def decode_list(data, schema):
+    """Decodes a protobuf list response, raising DecodeError when it is not one"""
+    if not data.startswith(MAGIC):
+        raise DecodeError("response is not a Kubernetes protobuf message")
+    try:
+        unknown = decode_message(data, UNKNOWN, len(MAGIC))
+        if "raw" not in unknown:
+            raise DecodeError("response has no raw message")
+        decoded = decode_message(unknown["raw"], schema)
+    except (IndexError, UnicodeDecodeError) as e:
+        raise DecodeError(f"malformed message: {e}")
+    decoded.setdefault("metadata", {})
+    decoded.setdefault("items", [])
+    return decoded
+
+
+def write_varint(value):
+    if value < 0:
+        value += 1 << 64
+    encoded = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+def encode_message(message, schema):
+    """Encodes the fields of schema from a dict, used by the tests and benchmarks"""
+    encoded = bytearray()
+    for number, (name, field_type, repeated, nested) in sorted(schema.items()):
+        if name not in message:
+            continue
+        if field_type == MAP:
+            values = [
+                encode_message({"key": key, "value": value}, MAP_ENTRY)
+                for key, value in message[name].items()
+            ]
+            field_type = BYTES
+        else:
+            values = message[name] if repeated else [message[name]]
+        for value in values:
+            if field_type in [BOOL, INT]:
+                encoded += write_varint(number << 3 | VARINT) + write_varint(int(value))
+                continue
+            if field_type == MESSAGE:
+                value = encode_message(value, nested)
+            elif field_type == STRING:
+                value = value.encode()
+            encoded += write_varint(number << 3 | LENGTH_DELIMITED)
+            encoded += write_varint(len(value)) + value
+    return bytes(encoded)
+
+
+def encode_list(decoded, schema):
+    """Wraps an encoded list the way the API server does, used by the tests and benchmarks"""
+    unknown = {"raw": encode_message(decoded, schema), "contentType": ""}
+    return MAGIC + encode_message(unknown, UNKNOWN)
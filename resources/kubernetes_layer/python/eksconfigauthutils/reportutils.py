@@ -0,0 +1,140 @@
+"""Reports the evaluations of a rule run to Config and to the Security Hub queue
+
+The rule lambdas hand the evaluations of their clusters to
+report_evaluations, which queues a finding for each cluster whose
+compliance or findings changed since the last finding sent, adds an
+evaluation of every cluster for Config, writes both through
+asyncutils.flush_writes and then records the state and the verdict of the
+findings SQS accepted, so a finding that wasn't sent is sent again on the
+next run.
+Rules without a queue, e.g. the default namespace check, only put their
+evaluations to Config.
+"""
+import os
+import logging
+from botocore.exceptions import ClientError
+import eksconfigauthutils.asyncutils as asyncutils
+import eksconfigauthutils.checkengine as checkengine
+import eksconfigauthutils.clientutils as clientutils
+import eksconfigauthutils.evalutils as evalutils
+import eksconfigauthutils.sqsutils as sqsutils
+import eksconfigauthutils.stateutils as stateutils
+
+"""annotation put to Config for rules whose findings are sent to Security Hub"""
+SECURITY_HUB_ANNOTATION = "check security hub"
+
+
+def get_config_evaldetails(configrule):
+    """obtain last run status for config rule to pass to SQS"""
+    try:
+        client = clientutils.get_client("config")
+        response = client.describe_config_rule_evaluation_status(
+            ConfigRuleNames=[configrule]
+        )
+        if "LastSuccessfulEvaluationTime" in response["ConfigRulesEvaluationStatus"][0]:
+            last_eval_time = response["ConfigRulesEvaluationStatus"][0][
+                "LastSuccessfulEvaluationTime"
+            ]
+            logging.info("converting to normal datetime format")
+        else:
+            last_eval_time = "Null"
+        return str(last_eval_time)
+    except ClientError as e:
+        logging.error("problem obtaining last_eval_time for configrule")
+        logging.error(str(e))
+
+
+def finding_message(event, evaluation, first_recorded_time, event_time):
+    """Returns the message the sechub lambda imports into Security Hub for an evaluation"""
+    return {
+        "configRuleArn": event["configRuleArn"],
+        "configRule": event["configRuleName"],
+        "accountid": event["accountId"],
+        "event_details": evaluation["annotation"],
+        "compliance_status": evaluation["compliance_type"],
+        "first_recorded_time": first_recorded_time,
+        "event_time": event_time,
+        "resourceId": evaluation["clusterarn"],
+        "description": os.environ.get("RULE_DESCRIPTION"),
+    }
+
+
+def report_evaluations(event, invoking_event, evaluations, sqs_queue_url, config_annotation=None):
+    """Sends the changed findings and puts the evaluations of a rule run
+
+    evaluations are the (cluster_name, evaluation) pairs returned by
+    clusterutils.evaluate_clusters. Without sqs_queue_url no findings are
+    sent. config_annotation returns the annotation put to Config for an
+    evaluation, by default SECURITY_HUB_ANNOTATION when findings are sent
+    and the annotation of the evaluation otherwise. Returns the evaluations
+    Config rejected.
+    """
+    state_store = stateutils.get_state_store()
+    config_evaluations = evalutils.EvaluationAccumulator(event["resultToken"])
+    findings_producer = sqsutils.FindingsProducer(sqs_queue_url) if sqs_queue_url else None
+    if config_annotation is None:
+        config_annotation = (
+            (lambda evaluation: SECURITY_HUB_ANNOTATION)
+            if findings_producer
+            else (lambda evaluation: evaluation["annotation"])
+        )
+    changed_evaluations = []
+    last_eval_time = None
+    for configuration_item, evaluation in evaluations:
+        logging.info(f"evaluation result for cluster {configuration_item}")
+        logging.info(evaluation)
+        config_evaluations.add(
+            evaluation["clusterarn"],
+            evaluation["compliance_type"],
+            config_annotation(evaluation),
+            invoking_event["notificationCreationTime"],
+        )
+        if findings_producer is None:
+            checkengine.record_verdict(evaluation)
+            continue
+        logging.info("checking for change in compliance state")
+        logging.info(f"event name is {event['configRuleName']}")
+        compliance_state_change = stateutils.check_compliancechange(
+            state_store,
+            event["configRuleName"],
+            evaluation["clusterarn"],
+            evaluation["compliance_type"],
+            checkengine.findings_annotation(evaluation),
+        )
+        logging.info(f"compliance state change: {compliance_state_change}")
+        if compliance_state_change == True:
+            logging.info(
+                "Compliance state has changed since last evaluation, adding evaluation metadata to sqs queue to import findings into Security Hub"
+            )
+            if last_eval_time is None:
+                last_eval_time = get_config_evaldetails(event["configRuleName"])
+            if last_eval_time == "Null":
+                logging.info(
+                    f"Evaluation never completed for config rule {event['configRuleName']} before"
+                )
+                last_eval_time = invoking_event["notificationCreationTime"]
+            findings_producer.add(
+                finding_message(
+                    event, evaluation, last_eval_time, invoking_event["notificationCreationTime"]
+                ),
+                evaluation["clusterarn"],
+            )
+            changed_evaluations.append(evaluation)
+        else:
+            logging.info("No changes in compliance state since last evaluation")
+            checkengine.record_verdict(evaluation)
+    logging.info("sending changed findings to sqs and putting compliance findings")
+    sent_resources, failed_evaluations = asyncutils.flush_writes(
+        findings_producer, config_evaluations
+    )
+    for evaluation in changed_evaluations:
+        if evaluation["clusterarn"] in sent_resources:
+            stateutils.record_compliance(
+                state_store,
+                event["configRuleName"],
+                evaluation["clusterarn"],
+                evaluation["compliance_type"],
+                evaluation["annotation"],
+            )
+            checkengine.record_verdict(evaluation)
+    return failed_evaluations
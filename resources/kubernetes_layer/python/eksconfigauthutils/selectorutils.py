@@ -0,0 +1,223 @@
+"""Field and label selectors, and the exemptions compiled into them
+
+A Selector holds field requirements, label requirements and client side
+predicates. The field and label requirements are sent to the API server as
+fieldSelector and labelSelector so objects that don't match are never
+transferred. The same requirements are also evaluated on the listed objects,
+which keeps the result right when objects come from a snapshot or a list
+shared with other checks. Exemptions that the API server can't evaluate,
+such as namespace patterns, only become client side predicates.
+
+Exemptions are configured per rule as JSON in the EXEMPTIONS variable:
+
+    {"namespaces": ["kube-system", "kube-*"],
+     "labelSelector": "compliance.example.com/exempt!=true",
+     "phases": ["Running", "Pending"]}
+
+namespaces lists exempt namespaces (glob patterns allowed), labelSelector
+selects the objects that are evaluated, phases the pod phases evaluated.
+"""
+import os
+import re
+import json
+import fnmatch
+import logging
+
+"""pod phases, so a set of phases to keep can be sent as the phases to leave out"""
+POD_PHASES = ["Pending", "Running", "Succeeded", "Failed", "Unknown"]
+
+EQUALS = "="
+NOT_EQUALS = "!="
+IN = "in"
+NOT_IN = "notin"
+EXISTS = "exists"
+DOES_NOT_EXIST = "!"
+
+SET_REQUIREMENT = re.compile(r"^([^\s!=,()]+)\s+(in|notin)\s+\(([^)]*)\)$")
+
+
+def split_requirements(text):
+    """Splits a selector on the commas that are not inside parentheses"""
+    requirements = []
+    depth = 0
+    current = ""
+    for character in text:
+        if character == "(":
+            depth += 1
+        elif character == ")":
+            depth -= 1
+        if character == "," and depth == 0:
+            requirements.append(current.strip())
+            current = ""
+        else:
+            current += character
+    if current.strip():
+        requirements.append(current.strip())
+    return requirements
+
+
+def parse_label_selector(text):
+    """Returns the (key, operator, values) requirements of a label selector string"""
+    requirements = []
+    for requirement in split_requirements(text or ""):
+        match = SET_REQUIREMENT.match(requirement)
+        if match:
+            values = [value.strip() for value in match.group(3).split(",") if value.strip()]
+            requirements.append((match.group(1), match.group(2), values))
+        elif "!=" in requirement:
+            key, value = requirement.split("!=", 1)
+            requirements.append((key.strip(), NOT_EQUALS, [value.strip()]))
+        elif "=" in requirement:
+            key, value = requirement.replace("==", "=").split("=", 1)
+            requirements.append((key.strip(), EQUALS, [value.strip()]))
+        elif requirement.startswith("!"):
+            requirements.append((requirement[1:].strip(), DOES_NOT_EXIST, []))
+        else:
+            requirements.append((requirement, EXISTS, []))
+    return requirements
+
+
+def requirement_matches(operator, values, present, value):
+    if operator == EQUALS or operator == IN:
+        return present and value in values
+    if operator == NOT_EQUALS or operator == NOT_IN:
+        return not present or value not in values
+    if operator == EXISTS:
+        return present
+    return not present
+
+
+def labels_match(requirements, labels):
+    labels = labels or {}
+    return all(
+        requirement_matches(operator, values, key in labels, labels.get(key))
+        for key, operator, values in requirements
+    )
+
+
+def format_label_selector(requirements):
+    parts = []
+    for key, operator, values in requirements:
+        if operator in [IN, NOT_IN]:
+            parts.append(f"{key} {operator} ({','.join(values)})")
+        elif operator == EXISTS:
+            parts.append(key)
+        elif operator == DOES_NOT_EXIST:
+            parts.append(f"!{key}")
+        else:
+            parts.append(f"{key}{operator}{values[0]}")
+    return ",".join(parts)
+
+
+def field_value(item, path):
+    """Returns (present, value) of a dotted field path such as status.phase"""
+    value = item
+    for name in path.split("."):
+        if not isinstance(value, dict) or name not in value:
+            return False, None
+        value = value[name]
+    return True, value
+
+
+class Selector:
+    """Requirements an object has to meet to be evaluated by a check"""
+
+    def __init__(self, fields=(), labels=(), predicates=()):
+        """fields are (path, operator, value) with = or !=, labels parsed label requirements"""
+        self.fields = list(fields)
+        self.labels = list(labels)
+        self.predicates = list(predicates)
+
+    def __add__(self, other):
+        return Selector(
+            self.fields + other.fields,
+            self.labels + other.labels,
+            self.predicates + other.predicates,
+        )
+
+    @property
+    def field_selector(self):
+        if not self.fields:
+            return None
+        return ",".join(f"{path}{operator}{value}" for path, operator, value in self.fields)
+
+    @property
+    def label_selector(self):
+        if not self.labels:
+            return None
+        return format_label_selector(self.labels)
+
+    def key(self):
+        """Identifies the objects selected on the API server, e.g. for snapshots"""
+        return (self.field_selector, self.label_selector)
+
+    def matches(self, item):
+        """Evaluates the selector on a listed object
+
+        Field requirements on fields the object doesn't carry, e.g. the status
+        of PartialObjectMetadata, were evaluated by the API server and are
+        skipped.
+        """
+        for path, operator, value in self.fields:
+            present, actual = field_value(item, path)
+            if not present:
+                if field_value(item, path.split(".")[0])[0]:
+                    actual = None
+                else:
+                    continue
+            if (actual == value) != (operator == EQUALS):
+                return False
+        metadata = item.get("metadata", {})
+        if self.labels and not labels_match(self.labels, metadata.get("labels")):
+            return False
+        return all(predicate(item) for predicate in self.predicates)
+
+
+def namespace_predicate(patterns, path):
+    def predicate(item):
+        present, namespace = field_value(item, path)
+        return not present or not any(
+            fnmatch.fnmatchcase(namespace, pattern) for pattern in patterns
+        )
+
+    return predicate
+
+
+def compile_exemptions(exemptions, kind):
+    """Compiles exemptions into the selector of the objects of kind a check evaluates
+
+    Exact namespaces become != field requirements, namespace patterns client
+    side predicates. phases are sent as the pod phases to leave out, since
+    a field selector can only require one value per field.
+    """
+    if not exemptions:
+        return Selector()
+    if kind == "namespaces":
+        namespace_path = "metadata.name"
+    else:
+        namespace_path = "metadata.namespace"
+    fields = []
+    predicates = []
+    namespaces = exemptions.get("namespaces", [])
+    patterns = [namespace for namespace in namespaces if any(c in namespace for c in "*?[")]
+    for namespace in namespaces:
+        if namespace not in patterns:
+            fields.append((namespace_path, NOT_EQUALS, namespace))
+    if patterns:
+        predicates.append(namespace_predicate(patterns, namespace_path))
+    phases = exemptions.get("phases")
+    if phases and kind == "pods":
+        for phase in POD_PHASES:
+            if phase not in phases:
+                fields.append(("status.phase", NOT_EQUALS, phase))
+    labels = parse_label_selector(exemptions.get("labelSelector"))
+    return Selector(fields, labels, predicates)
+
+
+def get_exemptions():
+    """Returns the exemptions configured for the rule through the EXEMPTIONS variable"""
+    try:
+        return json.loads(os.environ.get("EXEMPTIONS") or "{}")
+    except ValueError:
+        logging.error("EXEMPTIONS is not valid JSON, no objects are exempt")
+        return {}
@@ -0,0 +1,273 @@
+"""Shares the objects listed from a cluster between the rule lambdas of a cycle
+
+The rule lambdas are started together by Config and read the same pods,
+namespaces and network policies. The first lambda to list a kind writes each
+page to the snapshot bucket as it is listed and evaluated, gzip compressed,
+and once the last page is written a manifest holding the resourceVersion
+and number of pages, which makes the snapshot visible. The other lambdas
+read the pages one at a time while the manifest is younger than
+SNAPSHOT_TTL seconds, so neither side holds more than a page in memory. A
+listing stopped early, e.g. by a verdict, leaves no manifest. A lease object
+marks a snapshot being written, so lambdas starting at the same time wait
+for it rather than all listing the cluster.
+
+SNAPSHOT_BUCKET selects the bucket created by the config stack, SNAPSHOT_DIR
+a local directory (used for tests and local runs), without either no
+snapshots are kept.
+"""
+import os
+import json
+import gzip
+import time
+import uuid
+import logging
+from botocore.exceptions import ClientError
+import eksconfigauthutils.clientutils as clientutils
+import eksconfigauthutils.listutils as listutils
+from eksconfigauthutils.localclients import LocalS3Client
+
+"""bumped when the layout of snapshots changes, older snapshots are ignored"""
+SNAPSHOT_FORMAT = 3
+
+DEFAULT_SNAPSHOT_TTL = 300
+DEFAULT_SNAPSHOT_WAIT = 30
+POLL_SECONDS = 1
+
+"""appended to the kind of snapshots holding metadata only lists"""
+METADATA_SUFFIX = "-metadata"
+
+"""appended to the kind of snapshots holding the fields decoded from protobuf lists"""
+PROTOBUF_SUFFIX = "-protobuf"
+
+
+def get_seconds(variable, default):
+    try:
+        return int(os.environ.get(variable, default))
+    except ValueError:
+        logging.error(f"{variable} is not a number, using the default of {default}")
+        return default
+
+
+def error_code(e):
+    return e.response["Error"]["Code"]
+
+
+class SnapshotStore:
+    """Reads and writes snapshots of a cluster's objects, a manifest and its pages per kind
+
+    The pages of each snapshot are written under a new generation, so a
+    lambda still reading the previous snapshot isn't given pages of the
+    next one. Pages of earlier generations expire with the bucket lifecycle.
+    """
+
+    def __init__(self, bucket, s3=None, ttl=None, wait_seconds=None, prefix="snapshots"):
+        self.bucket = bucket
+        self.s3 = s3
+        self.ttl = get_seconds("SNAPSHOT_TTL", DEFAULT_SNAPSHOT_TTL) if ttl is None else ttl
+        self.wait_seconds = (
+            get_seconds("SNAPSHOT_WAIT", DEFAULT_SNAPSHOT_WAIT)
+            if wait_seconds is None
+            else wait_seconds
+        )
+        self.prefix = prefix
+
+    def client(self):
+        return self.s3 or clientutils.get_client("s3")
+
+    def key(self, cluster_name, kind):
+        return f"{self.prefix}/{cluster_name}/{kind}.json"
+
+    def page_key(self, cluster_name, kind, generation, number):
+        return f"{self.prefix}/{cluster_name}/{kind}/{generation}/{number}.json.gz"
+
+    def lease_key(self, cluster_name, kind):
+        return f"{self.prefix}/{cluster_name}/{kind}.lease"
+
+    def load(self, cluster_name, kind):
+        """Returns the manifest of a fresh snapshot, None otherwise"""
+        try:
+            response = self.client().get_object(
+                Bucket=self.bucket, Key=self.key(cluster_name, kind)
+            )
+        except ClientError as e:
+            if error_code(e) not in ["NoSuchKey", "404"]:
+                logging.error(f"issue reading {kind} snapshot of cluster {cluster_name}")
+                logging.error(str(e))
+            return None
+        manifest = json.loads(response["Body"].read())
+        age = time.time() - manifest["created_at"]
+        if manifest.get("format") != SNAPSHOT_FORMAT or age > self.ttl:
+            logging.info(f"{kind} snapshot of cluster {cluster_name} is stale")
+            return None
+        logging.info(
+            f"using {kind} snapshot of cluster {cluster_name} at resourceVersion {manifest['resource_version']}, {int(age)} seconds old"
+        )
+        return manifest
+
+    def read_pages(self, cluster_name, kind, manifest):
+        """Yields the items of each page of a snapshot, reading a page when the previous one was consumed"""
+        for number in range(manifest["pages"]):
+            response = self.client().get_object(
+                Bucket=self.bucket,
+                Key=self.page_key(cluster_name, kind, manifest["generation"], number),
+            )
+            yield listutils.loads(gzip.decompress(response["Body"].read()))
+
+    def save_page(self, cluster_name, kind, generation, number, items):
+        """Writes a page of a snapshot, returns False when it could not be written"""
+        try:
+            self.client().put_object(
+                Bucket=self.bucket,
+                Key=self.page_key(cluster_name, kind, generation, number),
+                Body=gzip.compress(json.dumps(items).encode()),
+            )
+            return True
+        except ClientError as e:
+            logging.error(f"issue saving {kind} snapshot page of cluster {cluster_name}")
+            logging.error(str(e))
+            return False
+
+    def save(self, cluster_name, kind, generation, resource_version, pages, items):
+        """Writes the manifest of a snapshot whose pages were all written"""
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "created_at": time.time(),
+            "resource_version": resource_version,
+            "generation": generation,
+            "pages": pages,
+            "items": items,
+        }
+        try:
+            self.client().put_object(
+                Bucket=self.bucket, Key=self.key(cluster_name, kind), Body=json.dumps(manifest)
+            )
+            logging.info(
+                f"saved {kind} snapshot of cluster {cluster_name} with {items} items in {pages} pages"
+            )
+        except ClientError as e:
+            logging.error(f"issue saving {kind} snapshot of cluster {cluster_name}")
+            logging.error(str(e))
+
+    def write_pages(self, cluster_name, kind, pages):
+        """Yields the items of each listed page, writing it to the snapshot first
+
+        pages yields (resource_version, items). The manifest is only written
+        when every page was listed and written, the lease is released either
+        way.
+        """
+        generation = uuid.uuid4().hex
+        number = 0
+        items_count = 0
+        resource_version = None
+        saving = True
+        complete = False
+        try:
+            for resource_version, items in pages:
+                saving = saving and self.save_page(cluster_name, kind, generation, number, items)
+                number += 1
+                items_count += len(items)
+                yield items
+            complete = True
+        finally:
+            if hasattr(pages, "close"):
+                pages.close()
+            if complete and saving:
+                self.save(cluster_name, kind, generation, resource_version, number, items_count)
+            elif not complete:
+                logging.info(
+                    f"listing of {kind} in cluster {cluster_name} stopped after {number} pages, no snapshot saved"
+                )
+            self.release(cluster_name, kind)
+
+    def acquire(self, cluster_name, kind):
+        """Creates the lease of a snapshot, returns False when another lambda holds it
+
+        A lease left behind by a lambda that timed out expires after
+        wait_seconds and is taken over.
+        """
+        s3 = self.client()
+        lease_key = self.lease_key(cluster_name, kind)
+        lease = json.dumps({"expires_at": time.time() + self.wait_seconds})
+        for attempt in range(2):
+            try:
+                s3.put_object(Bucket=self.bucket, Key=lease_key, Body=lease, IfNoneMatch="*")
+                return True
+            except ClientError as e:
+                if error_code(e) not in ["PreconditionFailed", "ConditionalRequestConflict"]:
+                    logging.error(f"issue creating lease {lease_key}")
+                    logging.error(str(e))
+                    return True
+            try:
+                current = json.loads(
+                    s3.get_object(Bucket=self.bucket, Key=lease_key)["Body"].read()
+                )
+            except ClientError:
+                continue
+            if current["expires_at"] > time.time():
+                return False
+            logging.info(f"taking over expired lease {lease_key}")
+            s3.delete_object(Bucket=self.bucket, Key=lease_key)
+        return False
+
+    def leased(self, cluster_name, kind):
+        """Tells whether another lambda still holds the lease of a snapshot"""
+        try:
+            self.client().head_object(Bucket=self.bucket, Key=self.lease_key(cluster_name, kind))
+            return True
+        except ClientError as e:
+            return error_code(e) not in ["NoSuchKey", "404"]
+
+    def release(self, cluster_name, kind):
+        try:
+            self.client().delete_object(
+                Bucket=self.bucket, Key=self.lease_key(cluster_name, kind)
+            )
+        except ClientError as e:
+            logging.error(f"issue releasing {kind} snapshot lease of cluster {cluster_name}")
+            logging.error(str(e))
+
+    def wait(self, cluster_name, kind):
+        """Polls for the snapshot another lambda is writing, until it releases its lease"""
+        logging.info(f"waiting for {kind} snapshot of cluster {cluster_name}")
+        deadline = time.time() + self.wait_seconds
+        while time.time() < deadline:
+            time.sleep(POLL_SECONDS)
+            manifest = self.load(cluster_name, kind)
+            if manifest is not None:
+                return manifest
+            if not self.leased(cluster_name, kind):
+                return None
+        return None
+
+    def pages(self, cluster_name, kind, list_fn):
+        """Yields the items of each page of a kind, from the snapshot or listed while it is written
+
+        list_fn returns an iterator over the listed pages of the kind as
+        (resource_version, items).
+        """
+        manifest = self.load(cluster_name, kind)
+        if manifest is None:
+            if self.acquire(cluster_name, kind):
+                yield from self.write_pages(cluster_name, kind, list_fn())
+                return
+            manifest = self.wait(cluster_name, kind)
+        if manifest is None:
+            logging.info(f"no {kind} snapshot of cluster {cluster_name} was written, listing")
+            for resource_version, items in list_fn():
+                yield items
+            return
+        yield from self.read_pages(cluster_name, kind, manifest)
+
+
+_store = None
+
+
+def get_snapshot_store():
+    """Returns the snapshot store configured for the lambda, None when snapshots are disabled"""
+    global _store
+    if _store is None:
+        if os.environ.get("SNAPSHOT_BUCKET"):
+            _store = SnapshotStore(os.environ["SNAPSHOT_BUCKET"])
+        elif os.environ.get("SNAPSHOT_DIR"):
+            _store = SnapshotStore("snapshots", s3=LocalS3Client(os.environ["SNAPSHOT_DIR"]))
+    return _store
@@ -0,0 +1,174 @@
+"""Sends findings to the Security Hub queue in compressed batches
+
+Findings are JSON messages. Bodies larger than COMPRESS_MIN_BYTES are gzip
+compressed, and bodies that are still larger than CLAIM_CHECK_BYTES are
+written to the findings bucket with only a pointer sent through SQS (the
+claim check pattern), which keeps large annotations under the SQS size
+limit. decode_message turns any of these back into the original message.
+"""
+import os
+import json
+import gzip
+import base64
+import uuid
+import logging
+from botocore.exceptions import ClientError
+import eksconfigauthutils.clientutils as clientutils
+
+"""SendMessageBatch accepts up to 10 entries"""
+MAX_BATCH_ENTRIES = 10
+
+"""SQS rejects batches whose messages add up to more than 256 KiB, and larger messages"""
+MAX_BATCH_BYTES = 262144
+
+COMPRESS_MIN_BYTES = 1024
+DEFAULT_CLAIM_CHECK_BYTES = 131072
+
+GZIP_ENCODING = "gzip"
+CLAIM_CHECK_ENCODING = "s3"
+
+
+class MessageTooLarge(Exception):
+    pass
+
+
+def get_claim_check_bytes():
+    try:
+        return int(os.environ.get("CLAIM_CHECK_BYTES", DEFAULT_CLAIM_CHECK_BYTES))
+    except ValueError:
+        logging.error("CLAIM_CHECK_BYTES is not a number, using the default")
+        return DEFAULT_CLAIM_CHECK_BYTES
+
+
+def decode_message(body, s3=None):
+    """Returns the message sent by FindingsProducer, fetching claim checks from S3
+
+    Bodies without an encoding are returned as they are, so messages sent
+    before compression was introduced are still understood.
+    """
+    message = json.loads(body)
+    encoding = message.get("encoding") if isinstance(message, dict) else None
+    if encoding == GZIP_ENCODING:
+        return json.loads(gzip.decompress(base64.b64decode(message["payload"])))
+    if encoding == CLAIM_CHECK_ENCODING:
+        s3 = s3 or clientutils.get_client("s3")
+        response = s3.get_object(Bucket=message["bucket"], Key=message["key"])
+        return json.loads(gzip.decompress(response["Body"].read()))
+    return message
+
+
+class FindingsProducer:
+    """Collects findings of a rule run and sends them with send_message_batch
+
+    add() queues a message under a key, typically the cluster arn, and
+    flush() returns the keys whose messages were accepted by SQS so callers
+    only record state for findings that were actually sent.
+    """
+
+    def __init__(self, queue_url, bucket=None, sqs=None, s3=None, claim_check_bytes=None):
+        self.queue_url = queue_url
+        self.bucket = bucket if bucket is not None else os.environ.get("FINDINGS_BUCKET")
+        self.sqs = sqs
+        self.s3 = s3
+        self.claim_check_bytes = claim_check_bytes or get_claim_check_bytes()
+        self.pending = []
+
+    def add(self, message, key):
+        self.pending.append((key, message))
+
+    def encode(self, message):
+        """Returns the body sent for a message, sizes are measured in UTF-8 bytes as SQS does
+
+        Raises MessageTooLarge when the body exceeds the SQS limit and no
+        findings bucket is configured to hold it.
+        """
+        body = json.dumps(message)
+        body_bytes = len(body.encode())
+        if body_bytes < COMPRESS_MIN_BYTES:
+            return body
+        payload = gzip.compress(body.encode())
+        encoded = json.dumps(
+            {"encoding": GZIP_ENCODING, "payload": base64.b64encode(payload).decode()}
+        )
+        encoded_bytes = len(encoded.encode())
+        if encoded_bytes <= self.claim_check_bytes:
+            return encoded
+        if not self.bucket:
+            if encoded_bytes <= MAX_BATCH_BYTES:
+                return encoded
+            raise MessageTooLarge(
+                f"finding of {encoded_bytes} compressed bytes exceeds the SQS limit and FINDINGS_BUCKET is not set"
+            )
+        key = f"findings/{message.get('configRule', 'unknown')}/{uuid.uuid4()}.json.gz"
+        s3 = self.s3 or clientutils.get_client("s3")
+        s3.put_object(Bucket=self.bucket, Key=key, Body=payload)
+        logging.info(f"finding of {body_bytes} bytes stored in s3://{self.bucket}/{key}")
+        return json.dumps(
+            {"encoding": CLAIM_CHECK_ENCODING, "bucket": self.bucket, "key": key}
+        )
+
+    def batches(self, entries):
+        """Groups (key, body) entries into batches within the SQS count and size limits"""
+        batch = []
+        batch_bytes = 0
+        for key, body in entries:
+            body_bytes = len(body.encode())
+            if batch and (
+                len(batch) == MAX_BATCH_ENTRIES or batch_bytes + body_bytes > MAX_BATCH_BYTES
+            ):
+                yield batch
+                batch = []
+                batch_bytes = 0
+            batch.append((key, body))
+            batch_bytes += body_bytes
+        if batch:
+            yield batch
+
+    def take_entries(self):
+        """Encodes the pending messages as (key, body) entries and clears them
+
+        Returns the number of messages that were pending and their entries,
+        messages whose claim check couldn't be stored, or that are too large
+        to send without one, are left out.
+        """
+        pending, self.pending = self.pending, []
+        entries = []
+        for key, message in pending:
+            try:
+                entries.append((key, self.encode(message)))
+            except ClientError as e:
+                logging.error(f"issue storing finding for {key} in s3")
+                logging.error(str(e))
+            except MessageTooLarge as e:
+                logging.error(f"dropping finding for {key}")
+                logging.error(str(e))
+        return len(pending), entries
+
+    def send_batch(self, batch):
+        """Sends one batch of (key, body) entries, returns the set of keys that were sent"""
+        sqs = self.sqs or clientutils.get_client("sqs")
+        try:
+            response = sqs.send_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {"Id": str(index), "MessageBody": body}
+                    for index, (key, body) in enumerate(batch)
+                ],
+            )
+        except ClientError as e:
+            logging.error(f"issue sending message to sqs queue {self.queue_url}")
+            logging.error(str(e))
+            return set()
+        for failed in response.get("Failed", []):
+            logging.error(f"message for {batch[int(failed['Id'])][0]} was not sent")
+            logging.error(failed)
+        return {batch[int(successful["Id"])][0] for successful in response.get("Successful", [])}
+
+    def flush(self):
+        """Sends every pending message, returns the set of keys that were sent"""
+        pending, entries = self.take_entries()
+        sent_keys = set()
+        for batch in self.batches(entries):
+            sent_keys |= self.send_batch(batch)
+        logging.info(f"sent {len(sent_keys)} of {pending} findings to sqs")
+        return sent_keys
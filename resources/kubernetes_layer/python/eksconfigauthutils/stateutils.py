@@ -0,0 +1,199 @@
+"""Stores the last reported compliance state of each rule and resource
+
+The rules use the store to decide whether findings need to be sent to Security
+Hub, instead of asking Config for the previous evaluation. The store is picked
+from the environment: STATE_TABLE selects the DynamoDB table created by the
+config stack, STATE_DB_PATH a SQLite file, otherwise an in-memory store is used
+which only lives as long as the lambda container.
+"""
+import os
+import json
+import hashlib
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+import eksconfigauthutils.clientutils as clientutils
+
+
+class MemoryStateStore:
+    """Keeps state in a dict, used for tests and when no table is configured"""
+
+    def __init__(self):
+        self.states = {}
+
+    def get(self, rule_name, resource_id):
+        return self.states.get((rule_name, resource_id))
+
+    def put(self, rule_name, resource_id, state):
+        self.states[(rule_name, resource_id)] = dict(state)
+
+
+class SQLiteStateStore:
+    """Keeps state in a SQLite database file"""
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS compliance_state ("
+                "rule_name TEXT, resource_id TEXT, state TEXT, "
+                "PRIMARY KEY (rule_name, resource_id))"
+            )
+
+    def get(self, rule_name, resource_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT state FROM compliance_state WHERE rule_name = ? AND resource_id = ?",
+                (rule_name, resource_id),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, rule_name, resource_id, state):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO compliance_state VALUES (?, ?, ?)",
+                (rule_name, resource_id, json.dumps(state)),
+            )
+
+
+class DynamoDBStateStore:
+    """Keeps state in a DynamoDB table keyed by rule_name and resource_id"""
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+
+    def get(self, rule_name, resource_id):
+        response = clientutils.get_client("dynamodb").get_item(
+            TableName=self.table_name,
+            Key={"rule_name": {"S": rule_name}, "resource_id": {"S": resource_id}},
+            ConsistentRead=True,
+        )
+        if "Item" not in response:
+            return None
+        return json.loads(response["Item"]["state"]["S"])
+
+    def put(self, rule_name, resource_id, state):
+        clientutils.get_client("dynamodb").put_item(
+            TableName=self.table_name,
+            Item={
+                "rule_name": {"S": rule_name},
+                "resource_id": {"S": resource_id},
+                "state": {"S": json.dumps(state)},
+                "updated_at": {"S": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")},
+            },
+        )
+
+
+_store = None
+
+
+def get_state_store():
+    """Returns the state store configured for the lambda, created once per container"""
+    global _store
+    if _store is None:
+        if os.environ.get("STATE_TABLE"):
+            _store = DynamoDBStateStore(os.environ["STATE_TABLE"])
+        elif os.environ.get("STATE_DB_PATH"):
+            _store = SQLiteStateStore(os.environ["STATE_DB_PATH"])
+        else:
+            logging.info("no state table configured, keeping compliance state in memory")
+            _store = MemoryStateStore()
+    return _store
+
+
+def findings_hash(compliance_type, annotation):
+    return hashlib.sha256(f"{compliance_type}:{annotation}".encode()).hexdigest()
+
+
+def check_compliancechange(store, rule_name, resource_id, compliance_type, annotation):
+    """Returns True when the compliance type or the findings of a resource changed
+
+    When the store can't be read the findings are treated as changed, sending
+    a finding twice only updates the same Security Hub finding. Without an
+    annotation, e.g. for a verdict that doesn't list the findings, only the
+    compliance type is compared.
+    """
+    try:
+        previous_state = store.get(rule_name, resource_id)
+    except Exception as e:
+        logging.error("issue determining change in compliance")
+        logging.error(str(e))
+        return True
+    if previous_state is None or "findings_hash" not in previous_state:
+        logging.info(f"no previous state recorded for {resource_id}")
+        return True
+    if annotation is None and previous_state["compliance_type"] == compliance_type:
+        logging.info("Compliance state matches")
+        return False
+    if previous_state["findings_hash"] == findings_hash(compliance_type, annotation):
+        logging.info("Compliance state and findings match")
+        return False
+    logging.info(
+        f"Compliance state has changed, previous state was: {previous_state['compliance_type']}, current state is: {compliance_type}"
+    )
+    return True
+
+
+def record_compliance(store, rule_name, resource_id, compliance_type, annotation):
+    """Records the state that was last reported for a resource"""
+    try:
+        state = store.get(rule_name, resource_id) or {}
+        state.update(
+            {
+                "compliance_type": compliance_type,
+                "findings_hash": findings_hash(compliance_type, annotation),
+            }
+        )
+        store.put(rule_name, resource_id, state)
+    except Exception as e:
+        logging.error(f"issue recording compliance state of {resource_id}")
+        logging.error(str(e))
+
+
+def params_hash(params):
+    """Hashes the parameters a verdict was evaluated with, e.g. the trusted registries"""
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_memo(store, rule_name, resource_id):
+    """Returns the verdict remembered for a resource with its resourceVersion, if any"""
+    try:
+        state = store.get(rule_name, resource_id)
+    except Exception as e:
+        logging.error(f"issue reading memo of {resource_id}")
+        logging.error(str(e))
+        return None
+    return (state or {}).get("memo")
+
+
+def record_memo(store, rule_name, resource_id, memo):
+    try:
+        state = store.get(rule_name, resource_id) or {}
+        state["memo"] = memo
+        store.put(rule_name, resource_id, state)
+    except Exception as e:
+        logging.error(f"issue recording memo of {resource_id}")
+        logging.error(str(e))
+
+
+def get_verdict(store, rule_name, resource_id):
+    """Returns the compliance type of the last verdict evaluated for a resource, if any"""
+    try:
+        state = store.get(rule_name, resource_id)
+    except Exception as e:
+        logging.error(f"issue reading verdict of {resource_id}")
+        logging.error(str(e))
+        return None
+    return (state or {}).get("verdict")
+
+
+def record_verdict(store, rule_name, resource_id, compliance_type):
+    try:
+        state = store.get(rule_name, resource_id) or {}
+        state["verdict"] = compliance_type
+        store.put(rule_name, resource_id, state)
+    except Exception as e:
+        logging.error(f"issue recording verdict of {resource_id}")
+        logging.error(str(e))
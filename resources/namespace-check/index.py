@@ -1,5 +1,8 @@
 
-import authutils as auth
+import eksconfigauthutils.checkengine as checkengine
+import eksconfigauthutils.checks
+import eksconfigauthutils.clusterutils as clusterutils
+import eksconfigauthutils.reportutils as reportutils
 import os
 import kubernetes
 from kubernetes.client.rest import ApiException
@@ -46,18 +49,8 @@ logging.basicConfig(
 )
 
 def evaluate_compliance(configuration_item):
-    try:
-        token = auth.get_k8s_cluster_token(configuration_item)
-        logging.info('Token received')
-        endpoint = auth.get_k8s_cluster_endpoint(configuration_item)
-        logging.info('Endpoint received')
-        k8s_api = auth.initialize_k8s_api(configuration_item, token, endpoint)
-        logging.info('K8s API initialized')
-        logging.info(f'checking for pods that allow privilege escalation in cluster {configuration_item}')
-        evaluation_test = check_default_namespace(k8s_api,cluster_name=configuration_item)
-        return evaluation_test
-    except Exception as e:
-        return str(e)
+    logging.info(f'checking for pods in the default namespace in cluster {configuration_item}')
+    return checkengine.run_check(configuration_item, 'namespaceCheck', report_verdicts=False)
 # def auth.get_k8s_cluster_token(cluster_name):
 #     work_session = session.get_session()
 #     client_factory = STSClientFactory(work_session)
@@ -78,62 +71,6 @@ def evaluate_compliance(configuration_item):
 #     return token
 
 
-# Check network policy is configured on namespacedef check_pods_default_namespace(k8s_api,cluster_name):
-def check_default_namespace(k8s_api,cluster_name):
-    try:
-        logging.info('checking cluster exists')
-        clustercheck = describe_cluster(cluster_name)
-        errors = ['ResourceNotFoundException','ClientException','ServerException','ServiceUnavailableException']
-        if clustercheck in errors:
-            logging.error(f'error {clustercheck} encountered discovering cluster {cluster_name}')
-            return {
-                "compliance_type": 'NOT_APPLICABLE',
-                "annotation": f"Validation was not run against cluster {cluster_name}, error encountered: {clustercheck}"
-            }
-        else:
-            pods = k8s_api.list_pod_for_all_namespaces(watch=False)
-            pods_default_namespace = []
-            for pod in pods.items:
-                if pod.metadata.namespace == 'default':
-                    logging.info(f'pod {pod.metadata.name} is running in default namepace')
-                    pods_default_namespace.append(pod.metadata.name)
-                else:
-                    logging.info(f'pod {pod.metadata.name} is compliant, running in namspace {pod.metadata.namespace}')
-                if len(pods_default_namespace) > 0:
-                    return {
-                        "compliance_type": 'NON_COMPLIANT',
-                        "annotation": f"Pods: {pods_default_namespace} are running in the default namespace in cluster: {cluster_name}, ensure that pods are not running in the default namespace",
-                        "clusterarn": clustercheck
-                    }
-                elif len(pods_default_namespace) == 0: 
-                    return {
-                        "compliance_type": 'COMPLIANT',
-                        "annotation": f"Cluster: {cluster_name} does not have any pods running in the default namespace",
-                        "clusterarn": clustercheck
-                    }
-                else:
-                    return {
-                        "compliance_type": 'NOT_APPLICABLE',
-                        "annotation": f"Unable to determine status of Cluster: {cluster_name}",
-                        "clusterarn": clustercheck
-                    }
-    except Exception as e:
-        logging.error('issue encountered determining network policies on namespace')
-        logging.error(e)
-
-
-'''Validates EKS CLuster exists and obtains ARN'''
-def describe_cluster(cluster_name):
-    try:
-        client = boto3.client('eks')
-        cluster = client.describe_cluster(name=cluster_name)
-        clusterarn = cluster['cluster']['arn']
-        return clusterarn
-    except ClientError as e:
-        logging.error(f'Issue describing cluster {cluster_name}')
-        logging.error(str(e))
-        return e.response['Error']['Code']
-
 # def auth.initialize_k8s_api(cluster_name, token, endpoint):
 #     configuration = kubernetes.client.Configuration()
 #     configuration.api_key['authorization'] = token
@@ -157,33 +94,14 @@ def lambda_handler(event, context):
         invoking_event = json.loads(event['invokingEvent'])
         rule_params = json.loads(event['ruleParameters'])
         logging.info(rule_params)
-        configuration_items = [rule_params['inscopeclusters']]
-        config = boto3.client('config')
+        configuration_items = clusterutils.resolve_clusters(rule_params['inscopeclusters'])
         
         logging.info('Setting up connection to EKS cluster')
 
-        for configuration_item in configuration_items:
-            logging.info(f'checking compliance for cluster {configuration_item}')
-            evaluation = evaluate_compliance(configuration_item)
-            logging.info('evaluation result')
-            logging.info(evaluation)
-            
-            logging.info('putting compliance findings')
-            try:
-                response = config.put_evaluations(
-                    Evaluations=[
-                        {
-                            'ComplianceResourceType': 'AWS::EKS::Cluster',
-                            'ComplianceResourceId': evaluation['clusterarn'],
-                            'ComplianceType': evaluation['compliance_type'],
-                            'Annotation': evaluation['annotation'],
-                            'OrderingTimestamp': invoking_event['notificationCreationTime']
-                        },
-                    ],
-                    ResultToken=event['resultToken'])
-            except ClientError as e:
-                    logging.error('error in putting config check results')
-                    logging.error(str(e))
+        evaluations = clusterutils.evaluate_clusters(evaluate_compliance, configuration_items, context)
+        checkengine.log_memo_stats()
+        logging.info('putting compliance findings')
+        reportutils.report_evaluations(event, invoking_event, evaluations, None)
         
     except Exception as e:
         logging.error('Error in compliance check operation')
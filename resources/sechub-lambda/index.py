@@ -1,7 +1,22 @@
 import boto3
-import json
+import os
+import time
 import logging
 import hashlib
+import eksconfigauthutils.sqsutils as sqsutils
+
+"""BatchImportFindings accepts up to 100 findings per request"""
+MAX_FINDINGS_PER_IMPORT = 100
+
+"""ASFF caps Remediation.Recommendation.Text and the values of UserDefinedFields"""
+MAX_RECOMMENDATION_TEXT = 512
+MAX_USER_DEFINED_FIELD = 1024
+
+"""descriptions of config rules are cached in the container for this many seconds"""
+description_ttl = int(os.environ.get("DESCRIPTION_TTL", 3600))
+RULE_PREFIX = "eks-"
+rule_descriptions = {}
+descriptions_loaded_at = 0
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
@@ -12,9 +27,33 @@ logging.basicConfig(
 )
 
 
-def get_description_of_rule(configrule):
+def load_rule_descriptions():
+    """Caches the description of every eks- config rule with one paginated call"""
+    global descriptions_loaded_at
     config = boto3.client("config")
+    paginator = config.get_paginator("describe_config_rules")
+    for page in paginator.paginate():
+        for rule in page["ConfigRules"]:
+            if rule["ConfigRuleName"].startswith(RULE_PREFIX):
+                rule_descriptions[rule["ConfigRuleName"]] = rule.get(
+                    "Description", rule["ConfigRuleName"]
+                )
+    descriptions_loaded_at = time.time()
+    logging.info(f"cached descriptions of {len(rule_descriptions)} config rules")
+
+
+def get_description_of_rule(configrule):
     """Gather description of config rule."""
+    if time.time() - descriptions_loaded_at >= description_ttl:
+        rule_descriptions.clear()
+        try:
+            load_rule_descriptions()
+        except Exception as error:
+            logging.error("Error caching config rule descriptions")
+            logging.error(str(error))
+    if configrule in rule_descriptions:
+        return rule_descriptions[configrule]
+    config = boto3.client("config")
     description = ""
     try:
         response = config.describe_config_rules(ConfigRuleNames=[configrule])
@@ -22,12 +61,20 @@ def get_description_of_rule(configrule):
             description = response["ConfigRules"][0]["Description"]
         else:
             description = response["ConfigRules"][0]["ConfigRuleName"]
+        rule_descriptions[configrule] = description
         return description
     except Exception as error:
         print("Error: ", error)
         raise
 
 
+def truncate(text, limit):
+    """Shortens text to limit characters, ending with ... when it was cut"""
+    if len(text) <= limit:
+        return text
+    return text[: limit - 3] + "..."
+
+
 def get_compliance_and_severity(new_status):
     """Return compliance status."""
     status = ["FAILED", 3.0, 30]
@@ -37,77 +84,113 @@ def get_compliance_and_severity(new_status):
 
 
 def map_config_findings_to_sh(event_details, awsRegion):
-    sechub = boto3.client("securityhub")
     """Create custom finding."""
-    new_findings = []
-    logging.info("more")
-    print(event_details)
-    print(type(event_details))
-    logging.info("logs")
+    logging.info(event_details)
     new_status = event_details["compliance_status"]
     config_rule_name = event_details["configRule"]
     compliance_status = get_compliance_and_severity(new_status)
-    description = get_description_of_rule(config_rule_name)
+    if event_details.get("description"):
+        description = event_details["description"]
+    else:
+        description = get_description_of_rule(config_rule_name)
     remediation_url = f"https://console.aws.amazon.com/config/home?region={awsRegion}#/rules/details?configRuleName={config_rule_name}"
     finding_hash = hashlib.sha256(
         f"{event_details['configRuleArn']}-{event_details['resourceId']}".encode()
     ).hexdigest()
     finding_id = f"arn:aws:securityhub:{awsRegion}:{event_details['accountid']}:config/rules/{config_rule_name}/finding/{finding_hash}"
-    new_findings.append(
-        {
-            "SchemaVersion": "2018-10-08",
-            "Id": finding_id,
-            "ProductArn": (
-                f"arn:aws:securityhub:{awsRegion}:"
-                f"{event_details['accountid']}:"
-                f"product/{event_details['accountid']}/default"
-            ),
-            "GeneratorId": event_details["configRuleArn"],
-            "AwsAccountId": event_details["accountid"],
-            "ProductFields": {"ProviderName": "AWS Config"},
-            "Types": ["Software and Configuration Checks/AWS Config Analysis"],
-            "CreatedAt": event_details["first_recorded_time"],
-            "UpdatedAt": (event_details["event_time"]),
-            "Severity": {
-                "Product": compliance_status[1],
-                "Normalized": compliance_status[2],
-                "Label": "MEDIUM",
-            },
-            "Title": config_rule_name,
-            "Description": description,
-            "Remediation": {
-                "Recommendation": {
-                    "Text": str(event_details['event_details'])
-                    #"Url": remediation_url,
-                }
-            },
-            "UserDefinedFields":{
-                "eventdata": str(event_details['event_details'])
-            },
-            "Resources": [
-                {
-                    "Id": event_details["resourceId"],
-                    "Type": "EKS Cluster",
-                    "Partition": "aws",
-                    "Region": awsRegion,
-                }
-            ],
-            "Compliance": {"Status": compliance_status[0]},
-        }
-    )
+    return {
+        "SchemaVersion": "2018-10-08",
+        "Id": finding_id,
+        "ProductArn": (
+            f"arn:aws:securityhub:{awsRegion}:"
+            f"{event_details['accountid']}:"
+            f"product/{event_details['accountid']}/default"
+        ),
+        "GeneratorId": event_details["configRuleArn"],
+        "AwsAccountId": event_details["accountid"],
+        "ProductFields": {"ProviderName": "AWS Config"},
+        "Types": ["Software and Configuration Checks/AWS Config Analysis"],
+        "CreatedAt": event_details["first_recorded_time"],
+        "UpdatedAt": (event_details["event_time"]),
+        "Severity": {
+            "Product": compliance_status[1],
+            "Normalized": compliance_status[2],
+            "Label": "MEDIUM",
+        },
+        "Title": config_rule_name,
+        "Description": description,
+        "Remediation": {
+            "Recommendation": {
+                "Text": truncate(str(event_details['event_details']), MAX_RECOMMENDATION_TEXT)
+                #"Url": remediation_url,
+            }
+        },
+        "UserDefinedFields":{
+            "eventdata": truncate(str(event_details['event_details']), MAX_USER_DEFINED_FIELD)
+        },
+        "Resources": [
+            {
+                "Id": event_details["resourceId"],
+                "Type": "EKS Cluster",
+                "Partition": "aws",
+                "Region": awsRegion,
+            }
+        ],
+        "Compliance": {"Status": compliance_status[0]},
+    }
 
-    try:
-        response = sechub.batch_import_findings(Findings=new_findings)
+
+def import_findings(findings):
+    """Imports (message id, finding) pairs in batches, returns the message ids that failed"""
+    sechub = boto3.client("securityhub")
+    failed_message_ids = set()
+    for start in range(0, len(findings), MAX_FINDINGS_PER_IMPORT):
+        batch = findings[start : start + MAX_FINDINGS_PER_IMPORT]
+        try:
+            response = sechub.batch_import_findings(
+                Findings=[finding for message_id, finding in batch]
+            )
+        except Exception as error:
+            logging.error(f"Error importing batch of {len(batch)} findings")
+            logging.error(str(error))
+            failed_message_ids.update(message_id for message_id, finding in batch)
+            continue
         if response["FailedCount"] > 0:
-            print("Failed to import {} findings".format(response["FailedCount"]))
-    except Exception as error:
-        print("Error: ", error)
-        raise
+            logging.error("Failed to import {} findings".format(response["FailedCount"]))
+            failed_ids = set()
+            for failed_finding in response["FailedFindings"]:
+                logging.error(failed_finding)
+                failed_ids.add(failed_finding["Id"])
+            failed_message_ids.update(
+                message_id for message_id, finding in batch if finding["Id"] in failed_ids
+            )
+    return failed_message_ids
 
 
 def lambda_handler(event, context):
-    print(event)
-    payload = json.loads(event["Records"][0]["body"])
-    awsRegion = event["Records"][0]["awsRegion"]
+    """Imports the findings of every SQS record, reporting failures per record
+
+    Only the records whose findings could not be mapped or imported are
+    returned in batchItemFailures, so the rest of the batch is deleted from
+    the queue and only the failed messages are retried.
+    """
+    logging.info(f"received {len(event['Records'])} records")
+    findings = []
+    failed_message_ids = set()
+    for record in event["Records"]:
+        try:
+            payload = sqsutils.decode_message(record["body"])
+            findings.append(
+                (record["messageId"], map_config_findings_to_sh(payload, record["awsRegion"]))
+            )
+        except Exception as error:
+            logging.error(f"Error mapping record {record['messageId']} to a finding")
+            logging.error(str(error))
+            failed_message_ids.add(record["messageId"])
     logging.info("adding results to securityhub")
-    map_config_findings_to_sh(payload, awsRegion)
+    failed_message_ids.update(import_findings(findings))
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": message_id} for message_id in failed_message_ids
+        ]
+    }
@@ -0,0 +1,10 @@
+import os
+import sys
+
+# make the shared lambda layer importable the same way it is inside the lambdas
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(__file__), "..", "..", "resources", "kubernetes_layer", "python"
+    ),
+)
@@ -0,0 +1,142 @@
+import os
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+import eksconfigauthutils.allowlistutils as allowlistutils
+import eksconfigauthutils.clientutils as clientutils
+from eksconfigauthutils.localclients import LocalS3Client
+
+ALLOWLIST = """
+602401143452.dkr.ecr.us-east-1.amazonaws.com,busybox
+111111111111.dkr.ecr.*.amazonaws.com/team-*  # any region, team repositories
+localhost:5000
+nginx:1.25
+quay.io/app@sha256:abc
+"""
+
+
+@pytest.fixture
+def matcher():
+    return allowlistutils.RegistryMatcher(allowlistutils.parse_entries(ALLOWLIST))
+
+
+def test_parse_entries():
+    assert allowlistutils.parse_entries(["quay.io, busybox", ""]) == ["quay.io", "busybox"]
+    assert len(allowlistutils.parse_entries(ALLOWLIST)) == 6
+
+
+@pytest.mark.parametrize(
+    "image,allowed",
+    [
+        ("602401143452.dkr.ecr.us-east-1.amazonaws.com/eks/coredns:v1.8.7", True),
+        ("602401143452.dkr.ecr.us-west-2.amazonaws.com/eks/coredns:v1.8.7", False),
+        ("evil.602401143452.dkr.ecr.us-east-1.amazonaws.com/app", False),
+        ("busybox:1.36", True),
+        ("docker.io/library/busybox", True),
+        ("busybox-extra", False),
+        ("111111111111.dkr.ecr.eu-west-1.amazonaws.com/team-a/api:1", True),
+        ("111111111111.dkr.ecr.eu-west-1.amazonaws.com/other/api:1", False),
+        ("localhost:5000/app", True),
+        ("nginx:1.25", True),
+        ("nginx:latest", False),
+        ("quay.io/app@sha256:abc", True),
+        ("quay.io/app:1@sha256:abc", True),
+        ("quay.io/app:1", False),
+    ],
+)
+def test_matches(matcher, image, allowed):
+    assert matcher.matches_reference(image) == allowed
+
+
+"""Checks a component is only tried against the wildcards sharing its literal prefix"""
+
+
+def test_wildcards_are_indexed_by_prefix():
+    matcher = allowlistutils.RegistryMatcher(
+        [f"quay.io/team-{i}-*" for i in range(1000)] + ["quay.io/*-svc", "quay.io/te?m"]
+    )
+    node = matcher.root.children["io"].children["quay"].children[allowlistutils.SEPARATOR]
+    assert len(node.prefixes["team-7-"]) == 1
+    assert [len(node.prefixes[prefix]) for prefix in ["", "te"]] == [1, 1]
+    assert len(list(node.matching_wildcards("team-7-api"))) == 1
+    assert matcher.matches_reference("quay.io/team-7-api/server")
+    assert matcher.matches_reference("quay.io/api-svc")
+    assert matcher.matches_reference("quay.io/team")
+    assert not matcher.matches_reference("quay.io/team-x-api")
+
+
+def test_matchers_are_compiled_once(monkeypatch):
+    monkeypatch.setattr(allowlistutils, "_matchers", {})
+    entries = ["quay.io"]
+    matcher = allowlistutils.get_matcher("rule", entries)
+    assert allowlistutils.get_matcher("rule", list(entries)) is matcher
+    assert allowlistutils.get_matcher("rule", ["docker.io"]) is not matcher
+    assert list(allowlistutils._matchers) == ["rule"]
+
+
+@pytest.fixture
+def sources(monkeypatch):
+    monkeypatch.setattr(allowlistutils, "_sources", {})
+
+
+def test_file_allowlist_reloads_when_modified(tmp_path, sources, monkeypatch):
+    path = tmp_path / "allowlist.txt"
+    path.write_text("quay.io\n")
+    reference = f"file://{path}"
+    assert allowlistutils.load_entries(reference) == ["quay.io"]
+    reads = []
+    fetch_file = allowlistutils.fetch_file
+    monkeypatch.setitem(
+        allowlistutils.FETCHERS,
+        allowlistutils.FILE_PREFIX,
+        lambda reference, version: reads.append(version) or fetch_file(reference, version),
+    )
+    assert allowlistutils.load_entries(reference) == ["quay.io"]
+    path.write_text("quay.io\nbusybox\n")
+    os.utime(path, ns=(0, 1))
+    assert allowlistutils.load_entries(reference) == ["quay.io", "busybox"]
+    assert len(reads) == 2
+
+
+def test_s3_allowlist_is_fetched_when_the_etag_changes(tmp_path, sources, monkeypatch):
+    s3 = LocalS3Client(str(tmp_path))
+    calls = []
+    get_object = s3.get_object
+    s3.get_object = lambda **kwargs: calls.append(kwargs) or get_object(**kwargs)
+    monkeypatch.setattr(clientutils, "get_client", lambda service_name: s3)
+    s3.put_object(Bucket="config", Key="eks-config-rules/allowlist", Body=b"quay.io")
+    reference = "s3://config/eks-config-rules/allowlist"
+    assert allowlistutils.load_entries(reference) == ["quay.io"]
+    assert allowlistutils.load_entries(reference) == ["quay.io"]
+    assert "IfNoneMatch" in calls[1]
+    s3.put_object(Bucket="config", Key="eks-config-rules/allowlist", Body=b"docker.io")
+    assert allowlistutils.load_entries(reference) == ["docker.io"]
+
+
+def test_ssm_allowlist_keeps_entries_when_unavailable(sources, monkeypatch):
+    class SSM:
+        value = "quay.io,busybox"
+
+        def get_parameter(self, Name):
+            if self.value is None:
+                raise ClientError({"Error": {"Code": "ThrottlingException"}}, "GetParameter")
+            return {"Parameter": {"Name": Name, "Version": 1, "Value": self.value}}
+
+    ssm = SSM()
+    monkeypatch.setattr(clientutils, "get_client", lambda service_name: ssm)
+    reference = "ssm:/eks-config-rules/trusted-registries"
+    assert allowlistutils.load_entries(reference) == ["quay.io", "busybox"]
+    ssm.value = None
+    assert allowlistutils.load_entries(reference) == ["quay.io", "busybox"]
+    with pytest.raises(allowlistutils.AllowlistError):
+        allowlistutils.load_entries("ssm:/eks-config-rules/other")
+
+
+def test_unreachable_allowlist_is_an_error(sources, monkeypatch):
+    def unreachable(reference, version):
+        raise EndpointConnectionError(endpoint_url="https://ssm.us-east-1.amazonaws.com")
+
+    monkeypatch.setitem(allowlistutils.FETCHERS, allowlistutils.SSM_PREFIX, unreachable)
+    with pytest.raises(allowlistutils.AllowlistError):
+        allowlistutils.load_entries("ssm:/eks-config-rules/trusted-registries")
@@ -0,0 +1,162 @@
+import time
+import base64
+import threading
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+
+import pytest
+from botocore.exceptions import ClientError
+
+import eksconfigauthutils.asyncutils as asyncutils
+import eksconfigauthutils.authutils as auth
+import eksconfigauthutils.clusterutils as clusterutils
+import eksconfigauthutils.evalutils as evalutils
+import eksconfigauthutils.sqsutils as sqsutils
+
+
+@pytest.fixture
+def fake_aws(monkeypatch):
+    """Describes clusters and signs tokens with a delay, recording the most calls in flight"""
+    calls = {"describe": 0, "token": 0, "in_flight": 0, "most_in_flight": 0}
+    lock = threading.Lock()
+
+    def slow(name):
+        with lock:
+            calls[name] += 1
+            calls["in_flight"] += 1
+            calls["most_in_flight"] = max(calls["most_in_flight"], calls["in_flight"])
+        time.sleep(0.05)
+        with lock:
+            calls["in_flight"] -= 1
+
+    def describe_cluster(cluster_name):
+        slow("describe")
+        if cluster_name == "deleted":
+            raise ClientError({"Error": {"Code": "ResourceNotFoundException"}}, "DescribeCluster")
+        return {
+            "arn": f"arn:aws:eks:us-east-1:111111111111:cluster/{cluster_name}",
+            "endpoint": f"https://{cluster_name}.eks",
+            "ca_data": base64.b64encode(b"ca").decode(),
+        }
+
+    def generate_token(cluster_name):
+        slow("token")
+        return f"token-{cluster_name}", datetime.utcnow() + timedelta(minutes=14)
+
+    monkeypatch.setattr(auth, "_clusters", {})
+    monkeypatch.setattr(clusterutils, "describe_cluster", describe_cluster)
+    monkeypatch.setattr(clusterutils, "_account_id", "111111111111")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setattr(auth, "generate_token", generate_token)
+    monkeypatch.setenv("EVALUATION_RUNTIME", "asyncio")
+    return calls
+
+
+"""Checks credentials are prepared for all clusters at once, within the limit of each target"""
+
+
+def test_credentials_are_prepared_concurrently(fake_aws, monkeypatch):
+    monkeypatch.setenv("ASYNC_CONCURRENCY", '{"eks": 2, "sts": 2}')
+
+    def evaluate(cluster_name):
+        assert auth.credentials_cached(cluster_name)
+        return {"compliance_type": "COMPLIANT", "clusterarn": cluster_name}
+
+    clusters = [f"c-{index}" for index in range(6)]
+    results = clusterutils.evaluate_clusters(evaluate, clusters)
+    assert [cluster for cluster, evaluation in results] == clusters
+    assert all(evaluation["compliance_type"] == "COMPLIANT" for cluster, evaluation in results)
+    assert fake_aws["describe"] == fake_aws["token"] == 6
+    assert 2 < fake_aws["most_in_flight"] <= 4
+    assert auth.get_k8s_cluster_token("c-0") == "token-c-0"
+    clusterutils.evaluate_clusters(evaluate, clusters)
+    assert fake_aws["describe"] == 6
+
+
+def test_failures_and_timeouts_are_not_applicable(fake_aws, monkeypatch):
+    monkeypatch.setattr(clusterutils, "RESERVED_SECONDS", 0)
+    context = SimpleNamespace(get_remaining_time_in_millis=lambda: 300)
+
+    def evaluate(cluster_name):
+        if cluster_name == "deleted":
+            raise Exception("ResourceNotFoundException")
+        time.sleep(1 if cluster_name == "slow" else 0)
+        return {"compliance_type": "COMPLIANT"}
+
+    results = dict(clusterutils.evaluate_clusters(evaluate, ["fast", "deleted", "slow"], context))
+    assert results["fast"] == {
+        "compliance_type": "COMPLIANT",
+        "clusterarn": "arn:aws:eks:us-east-1:111111111111:cluster/fast",
+    }
+    assert results["deleted"]["clusterarn"] == "arn:aws:eks:us-east-1:111111111111:cluster/deleted"
+    assert "ResourceNotFoundException" in results["deleted"]["annotation"]
+    assert results["slow"]["annotation"].endswith("evaluation timed out")
+
+
+"""Checks each batch is written on its own call, the findings while the evaluations are put"""
+
+
+def test_writes_are_flushed_in_batches(monkeypatch):
+    monkeypatch.setenv("EVALUATION_RUNTIME", "asyncio")
+    monkeypatch.setenv("ASYNC_CONCURRENCY", '{"sqs": 4, "config": 2}')
+    in_flight = {"sqs": 0, "config": 0, "all": 0}
+    most_in_flight = dict(in_flight)
+    lock = threading.Lock()
+
+    def call(target):
+        with lock:
+            for name in [target, "all"]:
+                in_flight[name] += 1
+                most_in_flight[name] = max(most_in_flight[name], in_flight[name])
+        time.sleep(0.05)
+        with lock:
+            for name in [target, "all"]:
+                in_flight[name] -= 1
+
+    class Clients:
+        def send_message_batch(self, QueueUrl, Entries):
+            call("sqs")
+            return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+        def put_evaluations(self, Evaluations, ResultToken, TestMode):
+            call("config")
+            return {"FailedEvaluations": []}
+
+    findings_producer = sqsutils.FindingsProducer("queue", sqs=Clients())
+    config_evaluations = evalutils.EvaluationAccumulator("token", client=Clients())
+    for index in range(60):
+        findings_producer.add({"index": index}, f"arn-{index}")
+    for index in range(500):
+        config_evaluations.add(f"arn-{index}", "COMPLIANT", "check security hub", "now")
+    sent, failed = asyncutils.flush_writes(findings_producer, config_evaluations)
+    assert (len(sent), failed) == (60, [])
+    assert config_evaluations.requests == 5
+    assert most_in_flight["sqs"] == 4
+    assert most_in_flight["config"] == 2
+    assert most_in_flight["all"] == 6
+
+
+def test_threads_runtime_flushes_in_order(monkeypatch):
+    monkeypatch.delenv("EVALUATION_RUNTIME", raising=False)
+    order = []
+    sent, failed = asyncutils.flush_writes(
+        SimpleNamespace(flush=lambda: order.append("sqs") or {"arn-a"}),
+        SimpleNamespace(flush=lambda: order.append("config") or []),
+    )
+    assert order == ["sqs", "config"]
+    assert (sent, failed) == ({"arn-a"}, [])
+
+
+def test_config_only_writes_go_through_the_runtime(monkeypatch):
+    monkeypatch.setenv("EVALUATION_RUNTIME", "asyncio")
+    threads = []
+    config_evaluations = evalutils.EvaluationAccumulator(
+        "token",
+        client=SimpleNamespace(
+            put_evaluations=lambda **kwargs: threads.append(threading.current_thread().name)
+            or {"FailedEvaluations": []}
+        ),
+    )
+    config_evaluations.add("arn-a", "COMPLIANT", "no pods in default", "now")
+    assert asyncutils.flush_writes(None, config_evaluations) == (set(), [])
+    assert threads and threads[0].startswith("async")
@@ -0,0 +1,77 @@
+import base64
+import threading
+from datetime import datetime, timedelta
+
+import eksconfigauthutils.authutils as auth
+
+
+def fake_auth(monkeypatch, expires_in_minutes=14):
+    calls = {"describe": 0, "token": 0}
+
+    def describe_endpoint(cluster_name):
+        calls["describe"] += 1
+        return f"https://{cluster_name}.eks", base64.b64encode(b"ca").decode()
+
+    def generate_token(cluster_name):
+        calls["token"] += 1
+        expiration = datetime.utcnow() + timedelta(minutes=expires_in_minutes)
+        return f"token-{calls['token']}", expiration
+
+    monkeypatch.setattr(auth, "_clusters", {})
+    monkeypatch.setattr(auth, "_cluster_locks", {})
+    monkeypatch.setattr(auth, "describe_endpoint", describe_endpoint)
+    monkeypatch.setattr(auth, "generate_token", generate_token)
+    return calls
+
+
+"""Checks that warm invocations reuse the token, endpoint and ApiClient of a cluster"""
+
+
+def test_cluster_credentials_are_cached(monkeypatch):
+    calls = fake_auth(monkeypatch)
+    core_api = auth.initialize_k8s_api("a")
+    net_api = auth.initialize_k8s_net_api("a")
+    assert auth.get_k8s_cluster_token("a") == "token-1"
+    assert auth.get_k8s_cluster_endpoint("a") == "https://a.eks"
+    assert core_api.api_client is net_api.api_client
+    assert calls == {"describe": 1, "token": 1}
+    auth.initialize_k8s_api("b")
+    assert calls == {"describe": 2, "token": 2}
+
+
+"""Checks that the client swaps in a new token once the old one is close to expiry"""
+
+
+def test_expiring_token_is_refreshed_before_requests(monkeypatch):
+    calls = fake_auth(monkeypatch, expires_in_minutes=1)
+    configuration = auth.get_api_client("a").configuration
+    assert configuration.get_api_key_with_prefix("authorization") == "Bearer token-2"
+    assert calls["describe"] == 1
+
+
+"""Checks a cluster being described doesn't hold up the others or the token of a cached cluster"""
+
+
+def test_clusters_are_prepared_independently(monkeypatch):
+    fake_auth(monkeypatch)
+    describe_endpoint = auth.describe_endpoint
+    described = threading.Event()
+    release = threading.Event()
+
+    def slow_describe(cluster_name):
+        if cluster_name == "slow":
+            described.set()
+            release.wait(timeout=5)
+        return describe_endpoint(cluster_name)
+
+    monkeypatch.setattr(auth, "describe_endpoint", slow_describe)
+    slow = threading.Thread(target=auth.get_cached_cluster, args=["slow"])
+    slow.start()
+    assert described.wait(timeout=5)
+    assert auth.get_k8s_cluster_endpoint("fast") == "https://fast.eks"
+    with auth._lock:
+        assert auth.get_k8s_cluster_token("fast") == "token-1"
+    assert not release.is_set()
+    release.set()
+    slow.join(timeout=5)
+    assert auth.get_k8s_cluster_endpoint("slow") == "https://slow.eks"
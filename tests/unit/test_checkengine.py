@@ -0,0 +1,482 @@
+
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+import eksconfigauthutils.checkengine as checkengine
+import eksconfigauthutils.checks
+import eksconfigauthutils.clusterutils as clusterutils
+import eksconfigauthutils.listutils as listutils
+import eksconfigauthutils.snapshotutils as snapshotutils
+import eksconfigauthutils.stateutils as stateutils
+from eksconfigauthutils.localclients import LocalS3Client
+
+CLUSTER_ARN = "arn:aws:eks:us-east-1:111111111111:cluster/test"
+
+
+def pod(name, namespace, image="602401143452.dkr.ecr.us-east-1.amazonaws.com/app", escalation=False):
+    return {
+        "metadata": {"name": name, "namespace": namespace},
+        "spec": {
+            "containers": [
+                {
+                    "name": name,
+                    "image": image,
+                    "securityContext": {"allowPrivilegeEscalation": escalation},
+                }
+            ]
+        },
+    }
+
+
+def named(name, namespace=None):
+    metadata = {"name": name}
+    if namespace:
+        metadata["namespace"] = namespace
+    return {"metadata": metadata}
+
+
+@pytest.fixture
+def versions():
+    """resourceVersion returned by the lists of each kind"""
+    return {kind: "100" for kind in checkengine.KIND_ORDER}
+
+
+@pytest.fixture
+def pushed():
+    """(kind, field selector, label selector) of each list call"""
+    return []
+
+
+@pytest.fixture
+def listers(monkeypatch, versions, pushed):
+    """Serves a small cluster and counts the list calls made for each kind"""
+    calls = {kind: 0 for kind in checkengine.KIND_ORDER}
+    resources = {
+        checkengine.PODS: [
+            pod("web", "default", escalation=True),
+            pod("api", "apps", image="docker.io/api"),
+        ],
+        checkengine.NAMESPACES: [named("default"), named("apps")],
+        checkengine.NETWORK_POLICIES: [named("deny-all", "apps")],
+    }
+
+    def kind_list_fn(cluster_name, kind, metadata_only=False):
+        def list_fn(limit=None, watch=False, **kwargs):
+            calls[kind] += 1
+            if limit != 1:
+                pushed.append(
+                    (kind, kwargs.get("field_selector"), kwargs.get("label_selector"))
+                )
+            items = resources[kind][:limit]
+            if metadata_only:
+                items = [checkengine.metadata_view(item) for item in items]
+            return {"metadata": {"resourceVersion": versions[kind]}, "items": items}
+
+        return list_fn
+
+    monkeypatch.setattr(checkengine, "kind_list_fn", kind_list_fn)
+    monkeypatch.setattr(
+        clusterutils, "describe_cluster", lambda cluster_name: {"arn": CLUSTER_ARN}
+    )
+    monkeypatch.setattr(snapshotutils, "_store", None)
+    monkeypatch.setattr(stateutils, "_store", stateutils.MemoryStateStore())
+    monkeypatch.setenv("RESOURCE_VERSION_MEMO", "false")
+    monkeypatch.setattr(checkengine, "memo_stats", {"hits": 0, "misses": 0})
+    return calls
+
+
+"""Checks every pod check is evaluated from a single list of pods"""
+
+
+def test_pods_are_listed_once_for_all_checks(listers):
+    evaluations = checkengine.run_checks(
+        "test",
+        ["privEscalation", "trustedRegCheck", "namespaceCheck"],
+        trusted_registries=["602401143452.dkr.ecr.us-east-1.amazonaws.com"],
+    )
+    assert listers == {"pods": 1, "namespaces": 0, "networkpolicies": 0}
+    assert evaluations["privEscalation"]["compliance_type"] == "NON_COMPLIANT"
+    assert "web" in evaluations["privEscalation"]["annotation"]
+    assert evaluations["trustedRegCheck"]["compliance_type"] == "NON_COMPLIANT"
+    assert "docker.io/api" in evaluations["trustedRegCheck"]["annotation"]
+    assert "untrusted registries" in evaluations["trustedRegCheck"]["annotation"]
+    assert evaluations["namespaceCheck"]["compliance_type"] == "NON_COMPLIANT"
+    assert all(e["clusterarn"] == CLUSTER_ARN for e in evaluations.values())
+
+
+"""Checks a container without securityContext doesn't hide the containers after it"""
+
+
+def test_containers_after_one_without_security_context_are_checked():
+    item = pod("web", "default", escalation=True)
+    item["spec"]["containers"].insert(0, {"name": "sidecar", "image": "docker.io/sidecar"})
+    check = eksconfigauthutils.checks.PrivEscalationCheck("test")
+    check.visit(checkengine.PODS, item)
+    assert check.result()[0] == "NON_COMPLIANT"
+
+
+def test_network_policy_check(listers):
+    evaluation = checkengine.run_check("test", "netPolCheck")
+    assert listers == {"pods": 0, "namespaces": 1, "networkpolicies": 1}
+    assert evaluation["compliance_type"] == "NON_COMPLIANT"
+    assert "['default']" in evaluation["annotation"]
+
+
+"""Checks the namespaces are requested while the network policies are still being listed"""
+
+
+def test_kinds_are_listed_concurrently(listers, monkeypatch):
+    namespaces_requested = threading.Event()
+    overlapped = []
+    kind_list_fn = checkengine.kind_list_fn
+
+    def list_fn(cluster_name, kind, metadata_only=False):
+        served = kind_list_fn(cluster_name, kind, metadata_only)
+
+        def wait_for_namespaces(**kwargs):
+            overlapped.append(namespaces_requested.wait(timeout=5))
+            return served(**kwargs)
+
+        def request_namespaces(**kwargs):
+            namespaces_requested.set()
+            return served(**kwargs)
+
+        return wait_for_namespaces if kind == checkengine.NETWORK_POLICIES else request_namespaces
+
+    monkeypatch.setattr(checkengine, "kind_list_fn", list_fn)
+    monkeypatch.setenv("PREFETCH_PAGES", "1")
+    evaluation = checkengine.run_check("test", "netPolCheck")
+    assert overlapped == [True]
+    assert evaluation["compliance_type"] == "NON_COMPLIANT"
+
+
+def test_empty_trusted_registries_skip_listing(listers):
+    evaluation = checkengine.run_check("test", "trustedRegCheck", trusted_registries=[])
+    assert listers["pods"] == 0
+    assert evaluation["compliance_type"] == "NOT_APPLICABLE"
+
+
+def test_list_failure_only_affects_readers(listers, monkeypatch):
+    def fail(limit, watch, **kwargs):
+        raise RuntimeError("forbidden")
+
+    kind_list_fn = checkengine.kind_list_fn
+    monkeypatch.setattr(
+        checkengine,
+        "kind_list_fn",
+        lambda cluster_name, kind, metadata_only=False: fail
+        if kind == checkengine.PODS
+        else kind_list_fn(cluster_name, kind, metadata_only),
+    )
+    evaluations = checkengine.run_checks("test", ["namespaceCheck", "netPolCheck"])
+    assert evaluations["namespaceCheck"]["compliance_type"] == "NOT_APPLICABLE"
+    assert "forbidden" in evaluations["namespaceCheck"]["annotation"]
+    assert evaluations["netPolCheck"]["compliance_type"] == "NON_COMPLIANT"
+
+
+"""Checks the watch cache is only read on clusters whose API server pages it"""
+
+
+def test_watch_cache_needs_paging_api_server(monkeypatch):
+    monkeypatch.delenv("LIST_CONSISTENCY", raising=False)
+    versions = {"old": "1.33", "new": "1.34"}
+    monkeypatch.setattr(
+        clusterutils,
+        "describe_cluster",
+        lambda cluster_name: {"arn": CLUSTER_ARN, "version": versions[cluster_name]},
+    )
+    assert checkengine.list_consistency("old") == listutils.CONSISTENT
+    assert checkengine.list_consistency("new") == listutils.CACHED
+    monkeypatch.setenv("LIST_CONSISTENCY", "consistent")
+    assert checkengine.list_consistency("new") == listutils.CONSISTENT
+
+
+def test_missing_cluster_is_not_applicable(monkeypatch):
+    def describe_cluster(cluster_name):
+        raise ClientError(
+            {"Error": {"Code": "ResourceNotFoundException"}}, "DescribeCluster"
+        )
+
+    monkeypatch.setattr(clusterutils, "describe_cluster", describe_cluster)
+    evaluation = checkengine.run_check("gone", "privEscalation")
+    assert evaluation["compliance_type"] == "NOT_APPLICABLE"
+    assert "ResourceNotFoundException" in evaluation["annotation"]
+    assert "clusterarn" not in evaluation
+
+
+"""Checks a verdict is reused while the cluster resourceVersion is unchanged"""
+
+
+def test_unchanged_cluster_reuses_verdict(listers, versions, monkeypatch):
+    monkeypatch.setenv("RESOURCE_VERSION_MEMO", "true")
+    first = checkengine.run_check("test", "namespaceCheck")
+    assert listers["pods"] == 2
+    second = checkengine.run_check("test", "namespaceCheck")
+    assert listers["pods"] == 3
+    assert second == first
+    assert checkengine.memo_stats == {"hits": 1, "misses": 1}
+    versions["pods"] = "101"
+    checkengine.run_check("test", "namespaceCheck")
+    assert listers["pods"] == 5
+    checkengine.log_memo_stats()
+    assert checkengine.memo_stats == {"hits": 0, "misses": 0}
+
+
+def test_memo_is_opt_in(listers, monkeypatch):
+    monkeypatch.delenv("RESOURCE_VERSION_MEMO")
+    checkengine.run_check("test", "namespaceCheck")
+    checkengine.run_check("test", "namespaceCheck")
+    assert listers["pods"] == 2
+    assert checkengine.memo_stats == {"hits": 0, "misses": 0}
+
+
+def test_changed_parameters_are_evaluated_again(listers, monkeypatch):
+    monkeypatch.setenv("RESOURCE_VERSION_MEMO", "true")
+    trusted = checkengine.run_check(
+        "test", "trustedRegCheck", trusted_registries=["docker.io", "602401143452.dkr.ecr.us-east-1.amazonaws.com"]
+    )
+    untrusted = checkengine.run_check(
+        "test", "trustedRegCheck", trusted_registries=["602401143452.dkr.ecr.us-east-1.amazonaws.com"]
+    )
+    assert trusted["compliance_type"] == "COMPLIANT"
+    assert untrusted["compliance_type"] == "NON_COMPLIANT"
+    checkengine.log_memo_stats()
+
+
+def test_metadata_only_checks_get_metadata_of_full_lists(listers):
+    evaluations = checkengine.run_checks("test", ["privEscalation", "namespaceCheck"])
+    assert listers["pods"] == 1
+    assert "['web']" in evaluations["namespaceCheck"]["annotation"]
+
+
+def test_namespace_check_lists_the_default_namespace(listers, pushed):
+    checkengine.run_check("test", "namespaceCheck")
+    assert pushed == [("pods", "metadata.namespace=default", None)]
+
+
+def test_exemptions_are_sent_and_applied(listers, pushed, monkeypatch):
+    monkeypatch.setenv("EXEMPTIONS", '{"namespaces": ["def*"], "labelSelector": "!exempt"}')
+    evaluations = checkengine.run_checks("test", ["privEscalation", "netPolCheck"])
+    assert ("pods", None, "!exempt") in pushed
+    assert ("namespaces", None, "!exempt") in pushed
+    assert ("networkpolicies", None, None) in pushed
+    assert evaluations["privEscalation"]["compliance_type"] == "COMPLIANT"
+    assert evaluations["netPolCheck"]["compliance_type"] == "COMPLIANT"
+
+
+"""Checks only the requirements shared by all readers are sent with a shared list"""
+
+
+def test_shared_list_sends_common_requirements(listers, pushed, monkeypatch):
+    monkeypatch.setenv("EXEMPTIONS", '{"namespaces": ["kube-system"]}')
+    evaluations = checkengine.run_checks("test", ["privEscalation", "namespaceCheck"])
+    assert pushed == [("pods", "metadata.namespace!=kube-system", None)]
+    assert evaluations["privEscalation"]["compliance_type"] == "NON_COMPLIANT"
+    assert evaluations["namespaceCheck"]["compliance_type"] == "NON_COMPLIANT"
+    assert "api" not in evaluations["namespaceCheck"]["annotation"]
+
+
+@pytest.fixture
+def paged_pods(listers, monkeypatch):
+    """Serves pods one per page, recording the continue token of each page requested"""
+    requested = []
+    pods = [pod(f"web-{index}", "apps", escalation=True) for index in range(5)]
+
+    def kind_list_fn(cluster_name, kind, metadata_only=False):
+        def list_fn(limit=None, watch=False, _continue=None, **kwargs):
+            requested.append(_continue)
+            start = int(_continue or 0)
+            remaining = str(start + 1) if start + 1 < len(pods) else None
+            return {
+                "metadata": {"resourceVersion": "100", "continue": remaining},
+                "items": pods[start : start + 1],
+            }
+
+        return list_fn
+
+    monkeypatch.setattr(checkengine, "kind_list_fn", kind_list_fn)
+    monkeypatch.setenv("PAGE_SIZE", "1")
+    """pages are requested as they are evaluated, so the requests are exactly those needed"""
+    monkeypatch.setenv("PREFETCH_PAGES", "0")
+    return requested
+
+
+def test_verdict_stops_listing(paged_pods, monkeypatch):
+    monkeypatch.setenv("EVALUATION_MODE", "verdict")
+    stateutils.record_verdict(
+        stateutils.get_state_store(), "privEscalation", CLUSTER_ARN, "NON_COMPLIANT"
+    )
+    evaluation = checkengine.run_check("test", "privEscalation")
+    assert paged_pods == [None]
+    assert evaluation["compliance_type"] == "NON_COMPLIANT"
+    assert checkengine.findings_annotation(evaluation) is None
+
+
+"""Checks the snapshot is written from the pages being evaluated, without listing ahead of a verdict"""
+
+
+def test_snapshot_streams_pages(paged_pods, monkeypatch, tmp_path):
+    store = snapshotutils.SnapshotStore(
+        "snapshots", s3=LocalS3Client(str(tmp_path)), ttl=300, wait_seconds=1
+    )
+    monkeypatch.setattr(snapshotutils, "_store", store)
+    monkeypatch.setenv("EVALUATION_MODE", "verdict")
+    stateutils.record_verdict(
+        stateutils.get_state_store(), "privEscalation", CLUSTER_ARN, "NON_COMPLIANT"
+    )
+    assert checkengine.run_check("test", "privEscalation")["compliance_type"] == "NON_COMPLIANT"
+    assert paged_pods == [None]
+    assert not store.leased("test", "pods")
+    monkeypatch.setenv("EVALUATION_MODE", "report")
+    report = checkengine.run_check("test", "privEscalation")
+    assert len(paged_pods) == 6
+    assert checkengine.run_check("test", "privEscalation") == report
+    assert len(paged_pods) == 6
+
+
+"""Checks lists decoded from protobuf aren't shared with rules listing JSON"""
+
+
+def test_snapshots_are_kept_per_encoding(listers, monkeypatch, tmp_path):
+    store = snapshotutils.SnapshotStore(
+        "snapshots", s3=LocalS3Client(str(tmp_path)), ttl=300, wait_seconds=1
+    )
+    monkeypatch.setattr(snapshotutils, "_store", store)
+    monkeypatch.setenv("LIST_ENCODING", "protobuf")
+    checkengine.run_check("test", "privEscalation")
+    checkengine.run_check("test", "privEscalation")
+    assert listers["pods"] == 1
+    monkeypatch.setenv("LIST_ENCODING", "json")
+    checkengine.run_check("test", "privEscalation")
+    assert listers["pods"] == 2
+
+
+"""Checks the environment of containers isn't written to snapshots"""
+
+
+def test_snapshots_leave_out_container_env():
+    item = pod("web", "default")
+    item["spec"]["containers"][0]["env"] = [{"name": "PASSWORD", "value": "secret"}]
+    item["spec"]["containers"][0]["envFrom"] = [{"secretRef": {"name": "db"}}]
+    view = checkengine.snapshot_view(checkengine.PODS, item)
+    assert "env" not in view["spec"]["containers"][0]
+    assert "envFrom" not in view["spec"]["containers"][0]
+    assert view["spec"]["containers"][0]["securityContext"] == {"allowPrivilegeEscalation": False}
+    assert "env" in item["spec"]["containers"][0]
+
+
+"""Checks a verdict that changed is evaluated again as a report, and only recorded once delivered"""
+
+
+def test_changed_verdict_is_reported(paged_pods, monkeypatch):
+    monkeypatch.setenv("EVALUATION_MODE", "verdict")
+    evaluation = checkengine.run_check("test", "privEscalation")
+    assert paged_pods == [None, None, "1", "2", "3", "4"]
+    assert "web-4" in checkengine.findings_annotation(evaluation)
+    store = stateutils.get_state_store()
+    assert stateutils.get_verdict(store, "privEscalation", CLUSTER_ARN) is None
+    checkengine.record_verdict(evaluation)
+    assert stateutils.get_verdict(store, "privEscalation", CLUSTER_ARN) == "NON_COMPLIANT"
+    paged_pods.clear()
+    assert checkengine.run_check("test", "privEscalation")["mode"] == "verdict"
+    assert paged_pods == [None]
+
+
+def test_verdicts_without_findings_are_not_reported(paged_pods, monkeypatch):
+    monkeypatch.setenv("EVALUATION_MODE", "verdict")
+    evaluation = checkengine.run_check("test", "privEscalation", report_verdicts=False)
+    assert paged_pods == [None]
+    assert evaluation["compliance_type"] == "NON_COMPLIANT"
+    assert checkengine.CHANGED_VERDICT not in evaluation
+
+
+def test_report_limit(paged_pods, monkeypatch):
+    monkeypatch.setenv("REPORT_LIMIT", "2")
+    evaluation = checkengine.run_check("test", "privEscalation")
+    assert "['web-0', 'web-1'] and 3 more" in evaluation["annotation"]
+
+
+def replica(name, owner_kind, owner_name, template_hash=None, image="docker.io/web"):
+    item = pod(name, "apps", image=image, escalation=True)
+    item["metadata"]["ownerReferences"] = [
+        {"kind": owner_kind, "name": owner_name, "controller": True}
+    ]
+    if template_hash:
+        item["metadata"]["labels"] = {"pod-template-hash": template_hash}
+    return item
+
+
+@pytest.mark.parametrize(
+    "item,workload",
+    [
+        (replica("web-5d8f-a", "ReplicaSet", "web-5d8f", "5d8f"), ("Deployment", "web")),
+        (replica("web-a", "ReplicaSet", "web"), ("ReplicaSet", "web")),
+        (replica("db-0", "StatefulSet", "db"), ("StatefulSet", "db")),
+        (pod("debug", "apps"), ("Pod", "debug")),
+    ],
+)
+def test_workload_of(item, workload):
+    assert checkengine.workload_of(item) == workload
+
+
+"""Checks pod template checks evaluate and report each workload once"""
+
+
+def test_workload_unit(listers, monkeypatch):
+    pods = [replica(f"web-5d8f-{index}", "ReplicaSet", "web-5d8f", "5d8f") for index in range(3)]
+    pods.append(replica("web-6c9a-0", "ReplicaSet", "web-6c9a", "6c9a", image="quay.io/web"))
+    pods.append(pod("debug", "apps", image="docker.io/debug", escalation=True))
+    visited = []
+    visit = eksconfigauthutils.checks.TrustedRegistryCheck.visit
+    monkeypatch.setattr(
+        eksconfigauthutils.checks.TrustedRegistryCheck,
+        "visit",
+        lambda self, kind, item: visited.append(item["metadata"]["name"]) or visit(self, kind, item),
+    )
+    monkeypatch.setattr(
+        checkengine,
+        "kind_list_fn",
+        lambda cluster_name, kind, metadata_only=False: lambda **kwargs: {
+            "metadata": {"resourceVersion": "100"},
+            "items": pods,
+        },
+    )
+    monkeypatch.setenv("EVALUATION_UNIT", "workload")
+    evaluations = checkengine.run_checks(
+        "test", ["privEscalation", "trustedRegCheck"], trusted_registries=["quay.io"]
+    )
+    assert visited == ["web-5d8f-0", "web-6c9a-0", "debug"]
+    assert "['apps/Deployment/web', 'apps/Pod/debug']" in (
+        evaluations["privEscalation"]["annotation"]
+    )
+    annotation = evaluations["trustedRegCheck"]["annotation"]
+    assert "'Workload': 'Deployment/web'" in annotation
+    assert "'Workload': 'Pod/debug'" in annotation
+
+
+def test_network_policy_coverage(listers, monkeypatch):
+    policies = [
+        {
+            "metadata": {"name": "web", "namespace": "default"},
+            "spec": {"podSelector": {"matchLabels": {"app": "web"}}, "policyTypes": ["Ingress"]},
+        }
+    ]
+    pods = [
+        {"metadata": {"name": "web", "namespace": "default", "labels": {"app": "web"}}},
+        {"metadata": {"name": "api", "namespace": "apps", "labels": {"app": "api"}}},
+    ]
+    requested = {}
+
+    def kind_list_fn(cluster_name, kind, metadata_only=False):
+        requested[kind] = metadata_only
+        items = policies if kind == checkengine.NETWORK_POLICIES else pods
+        return lambda **kwargs: {"metadata": {"resourceVersion": "100"}, "items": items}
+
+    monkeypatch.setattr(checkengine, "kind_list_fn", kind_list_fn)
+    evaluation = checkengine.run_check("test", "netPolCheck", policy_mode="coverage")
+    assert requested == {"networkpolicies": False, "pods": True}
+    assert evaluation["compliance_type"] == "NON_COMPLIANT"
+    assert "1 pods not selected by any Ingress policy: ['apps/api']" in evaluation["annotation"]
+    assert "2 pods not selected by any Egress policy" in evaluation["annotation"]
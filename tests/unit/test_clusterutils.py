@@ -0,0 +1,130 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from botocore.exceptions import ClientError
+
+import eksconfigauthutils.clientutils as clientutils
+import eksconfigauthutils.clusterutils as clusterutils
+
+
+class FakeEksClient:
+    """Serves list_clusters in pages of two and describe_cluster from a dict of tags"""
+
+    def __init__(self, cluster_tags):
+        self.cluster_tags = cluster_tags
+        self.describe_calls = 0
+
+    def get_paginator(self, operation_name):
+        names = list(self.cluster_tags)
+        pages = [{"clusters": names[i : i + 2]} for i in range(0, len(names), 2)]
+        return SimpleNamespace(paginate=lambda: pages)
+
+    def describe_cluster(self, name):
+        self.describe_calls += 1
+        if name not in self.cluster_tags:
+            raise ClientError(
+                {"Error": {"Code": "ResourceNotFoundException"}}, "DescribeCluster"
+            )
+        return {
+            "cluster": {
+                "name": name,
+                "arn": f"arn:aws:eks:us-east-1:111111111111:cluster/{name}",
+                "tags": self.cluster_tags[name],
+            }
+        }
+
+
+def use_fake_eks(monkeypatch, cluster_tags):
+    client = FakeEksClient(cluster_tags)
+    monkeypatch.setitem(clientutils._clients, "eks", client)
+    monkeypatch.setattr(clusterutils, "_metadata", {})
+    return client
+
+
+def test_resolve_clusters_from_list_and_string(monkeypatch):
+    use_fake_eks(monkeypatch, {})
+    assert clusterutils.resolve_clusters("a, b,a") == ["a", "b"]
+    assert clusterutils.resolve_clusters('["a", "c"]') == ["a", "c"]
+    assert clusterutils.resolve_clusters(["c"]) == ["c"]
+
+
+def test_resolve_all_clusters_and_tag_filters(monkeypatch):
+    use_fake_eks(
+        monkeypatch,
+        {
+            "prod-1": {"env": "prod"},
+            "prod-2": {"env": "prod", "team": "a"},
+            "dev-1": {"env": "dev"},
+        },
+    )
+    assert clusterutils.resolve_clusters("*") == ["prod-1", "prod-2", "dev-1"]
+    assert clusterutils.resolve_clusters("tag:env=prod") == ["prod-1", "prod-2"]
+    assert clusterutils.resolve_clusters("dev-1,tag:team") == ["dev-1", "prod-2"]
+
+
+"""Checks that metadata is described once per TTL and missing clusters are remembered"""
+
+
+def test_describe_cluster_caches_metadata_and_not_found(monkeypatch):
+    client = use_fake_eks(monkeypatch, {"a": {}})
+    assert clusterutils.describe_cluster("a")["arn"].endswith("cluster/a")
+    clusterutils.describe_cluster("a")
+    assert client.describe_calls == 1
+    for attempt in range(2):
+        with pytest.raises(ClientError) as error:
+            clusterutils.describe_cluster("deleted")
+        assert error.value.response["Error"]["Code"] == "ResourceNotFoundException"
+    assert client.describe_calls == 2
+    monkeypatch.setenv("CLUSTER_METADATA_TTL", "0")
+    clusterutils.describe_cluster("a")
+    assert client.describe_calls == 3
+
+
+"""Checks results keep the cluster order and failed clusters still get an evaluation"""
+
+
+def test_evaluate_clusters_reports_every_cluster(monkeypatch):
+    use_fake_eks(monkeypatch, {"broken": {}})
+
+    def evaluate(cluster_name, suffix):
+        if cluster_name == "broken":
+            raise Exception("cannot connect")
+        time.sleep(0.01)
+        return {"compliance_type": "COMPLIANT", "clusterarn": cluster_name + suffix}
+
+    results = clusterutils.evaluate_clusters(
+        evaluate, ["a", "broken", "b"], None, "-arn"
+    )
+    assert [cluster for cluster, evaluation in results] == ["a", "broken", "b"]
+    assert results[0][1]["clusterarn"] == "a-arn"
+    assert results[1][1]["compliance_type"] == "NOT_APPLICABLE"
+    assert results[1][1]["clusterarn"] == "arn:aws:eks:us-east-1:111111111111:cluster/broken"
+
+
+"""Checks clusters that can't be described are reported under the ARN they would have"""
+
+
+def test_not_applicable_uses_the_cluster_arn(monkeypatch):
+    use_fake_eks(monkeypatch, {"a": {}})
+    monkeypatch.setattr(clusterutils, "_account_id", "222222222222")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "eu-west-1")
+    assert clusterutils.not_applicable("a", "timed out")["clusterarn"].endswith("cluster/a")
+    assert (
+        clusterutils.not_applicable("deleted", "not found")["clusterarn"]
+        == "arn:aws:eks:eu-west-1:222222222222:cluster/deleted"
+    )
+
+
+def test_evaluate_clusters_stops_waiting_before_timeout(monkeypatch):
+    use_fake_eks(monkeypatch, {"fast": {}, "slow": {}})
+    monkeypatch.setattr(clusterutils, "RESERVED_SECONDS", 0)
+    context = SimpleNamespace(get_remaining_time_in_millis=lambda: 100)
+
+    def evaluate(cluster_name):
+        time.sleep(0.5 if cluster_name == "slow" else 0)
+        return {"compliance_type": "COMPLIANT"}
+
+    results = dict(clusterutils.evaluate_clusters(evaluate, ["fast", "slow"], context))
+    assert results["fast"]["compliance_type"] == "COMPLIANT"
+    assert results["slow"]["compliance_type"] == "NOT_APPLICABLE"
@@ -24,6 +24,7 @@ config_stack = lambdaStack(
     eks_lambda_role=eks_stack.lambda_role,
     eks_cluster=eks_stack.cluster.cluster_name,
     trusted_registries=trusted_registries,
+    allowlist_bucket="allowlist-bucket",
 )
 
 """Checks that the requisite IAM roles are created"""
@@ -146,6 +147,40 @@ def test_kms_keys():
     template.resource_count_is("AWS::KMS::Key", 1)
 
 
+"""Checks allowlists are only read from the allowlist bucket and SSM parameters of the rules"""
+
+
+def test_allowlist_policy():
+    template = assertions.Template.from_stack(config_stack)
+    template.has_resource_properties(
+        "AWS::IAM::Policy",
+        Match.object_like(
+            {
+                "PolicyDocument": {
+                    "Statement": [
+                        Match.object_like({"Action": "ssm:GetParameter"}),
+                        Match.object_like(
+                            {
+                                "Action": "s3:GetObject",
+                                "Resource": {
+                                    "Fn::Join": [
+                                        "",
+                                        [
+                                            "arn:",
+                                            {"Ref": "AWS::Partition"},
+                                            ":s3:::allowlist-bucket/eks-config-rules/*",
+                                        ],
+                                    ]
+                                },
+                            }
+                        ),
+                    ]
+                }
+            }
+        ),
+    )
+
+
 """Tests the requisite number of IAM roles are created"""
 
 
@@ -229,3 +264,37 @@ def test_config_resources():
             }
         },
     )
+
+
+"""Checks the compliance state table is created"""
+
+
+def test_state_table():
+    template = assertions.Template.from_stack(config_stack)
+    template.resource_count_is("AWS::DynamoDB::Table", 1)
+    template.has_resource_properties(
+        "AWS::DynamoDB::Table",
+        {
+            "KeySchema": [
+                {"AttributeName": "rule_name", "KeyType": "HASH"},
+                {"AttributeName": "resource_id", "KeyType": "RANGE"},
+            ],
+            "BillingMode": "PAY_PER_REQUEST",
+        },
+    )
+
+
+def test_findings_bucket():
+    template = assertions.Template.from_stack(config_stack)
+    template.resource_count_is("AWS::S3::Bucket", 2)
+    template.has_resource_properties(
+        "AWS::S3::Bucket",
+        {
+            "PublicAccessBlockConfiguration": {
+                "BlockPublicAcls": True,
+                "BlockPublicPolicy": True,
+                "IgnorePublicAcls": True,
+                "RestrictPublicBuckets": True,
+            },
+        },
+    )
@@ -0,0 +1,42 @@
+from botocore.exceptions import ClientError
+
+import eksconfigauthutils.evalutils as evalutils
+
+
+class FakeConfig:
+    def __init__(self, throttle_first=0):
+        self.throttle_first = throttle_first
+        self.requests = []
+
+    def put_evaluations(self, Evaluations, ResultToken, TestMode):
+        self.requests.append({"count": len(Evaluations), "test_mode": TestMode})
+        if self.throttle_first > 0:
+            self.throttle_first -= 1
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException"}}, "PutEvaluations"
+            )
+        return {"FailedEvaluations": []}
+
+
+"""Checks evaluations are put 100 at a time and annotations are trimmed to Config's limit"""
+
+
+def test_flush_puts_chunks_of_100():
+    config = FakeConfig()
+    accumulator = evalutils.EvaluationAccumulator("token", test_mode=True, client=config)
+    for i in range(250):
+        accumulator.add(f"arn-{i}", "COMPLIANT", "x" * 300, "2022-01-01T00:00:00Z")
+    assert len(accumulator.evaluations[0]["Annotation"]) == 256
+    assert accumulator.flush() == []
+    assert [request["count"] for request in config.requests] == [100, 100, 50]
+    assert all(request["test_mode"] for request in config.requests)
+    assert accumulator.evaluations == []
+
+
+def test_throttled_requests_are_retried(monkeypatch):
+    monkeypatch.setattr(evalutils.time, "sleep", lambda seconds: None)
+    config = FakeConfig(throttle_first=2)
+    accumulator = evalutils.EvaluationAccumulator("token", test_mode=False, client=config)
+    accumulator.add("arn", "NON_COMPLIANT", "pods", "2022-01-01T00:00:00Z")
+    assert accumulator.flush() == []
+    assert len(config.requests) == 3
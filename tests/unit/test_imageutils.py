@@ -0,0 +1,50 @@
+import pytest
+
+import eksconfigauthutils.imageutils as imageutils
+
+
+@pytest.mark.parametrize(
+    "reference,parsed",
+    [
+        ("nginx", ("docker.io", "library/nginx", "latest", None)),
+        ("bitnami/redis:7.0", ("docker.io", "bitnami/redis", "7.0", None)),
+        ("localhost:5000/app:1", ("localhost:5000", "app", "1", None)),
+        (
+            "602401143452.dkr.ecr.us-east-1.amazonaws.com/eks/coredns:v1.8.7",
+            ("602401143452.dkr.ecr.us-east-1.amazonaws.com", "eks/coredns", "v1.8.7", None),
+        ),
+        ("quay.io/team/app@sha256:abc", ("quay.io", "team/app", None, "sha256:abc")),
+        ("registry:5000/app:2@sha256:abc", ("registry:5000", "app", "2", "sha256:abc")),
+    ],
+)
+def test_parse_image(reference, parsed):
+    assert tuple(imageutils.parse_image(reference)) == parsed
+
+
+def test_verdict_cache(monkeypatch):
+    monkeypatch.setattr(imageutils, "cache_stats", {"hits": 0, "misses": 0})
+    parsed = []
+    cache = imageutils.ImageVerdictCache(
+        lambda image: parsed.append(image) or image.registry == "quay.io", maxsize=2
+    )
+    assert cache.get("quay.io/app")
+    assert cache.get("quay.io/app")
+    assert not cache.get("nginx")
+    cache.get("redis")
+    cache.get("quay.io/app")
+    assert len(parsed) == 4
+    assert imageutils.cache_stats == {"hits": 1, "misses": 4}
+    imageutils.log_cache_stats()
+    assert imageutils.cache_stats == {"hits": 0, "misses": 0}
+
+
+def test_warm_caches(monkeypatch):
+    monkeypatch.setattr(imageutils, "_caches", {})
+    verdict = lambda image: True
+    cache = imageutils.get_verdict_cache("rule", "a", verdict)
+    assert imageutils.get_verdict_cache("rule", "a", verdict) is cache
+    assert imageutils.get_verdict_cache("rule", "b", verdict) is not cache
+    assert imageutils.get_verdict_cache("rule", "a", verdict) is not cache
+    assert list(imageutils._caches) == ["rule"]
+    monkeypatch.setenv("IMAGE_CACHE_WARM", "false")
+    assert imageutils.get_verdict_cache("rule", "a", verdict) is not imageutils.get_verdict_cache("rule", "a", verdict)
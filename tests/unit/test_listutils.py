@@ -0,0 +1,138 @@
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import eksconfigauthutils.listutils as listutils
+
+
+def fake_list_fn(items, calls):
+    """Returns a list call that serves items in pages using continue tokens"""
+
+    def list_fn(limit, watch=False, _continue=None, **kwargs):
+        start = int(_continue or 0)
+        end = start + limit
+        calls.append({"limit": limit, "_continue": _continue, **kwargs})
+        next_token = str(end) if end < len(items) else None
+        return SimpleNamespace(
+            items=items[start:end], metadata=SimpleNamespace(_continue=next_token)
+        )
+
+    return list_fn
+
+
+"""Checks that every page is requested with the continue token of the previous page"""
+
+
+def test_list_pages_follows_continue_tokens():
+    calls = []
+    pages = list(listutils.list_pages(fake_list_fn(list(range(7)), calls), page_size=3))
+    assert [page.items for page in pages] == [[0, 1, 2], [3, 4, 5], [6]]
+    assert [call["_continue"] for call in calls] == [None, "3", "6"]
+    assert all(call["limit"] == 3 for call in calls)
+
+
+"""Checks that pages are only requested as the caller consumes them"""
+
+
+def test_list_items_is_lazy():
+    calls = []
+    items = listutils.list_items(
+        fake_list_fn(list(range(10)), calls), page_size=2, prefetch_pages=0
+    )
+    assert next(items) == 0
+    assert len(calls) == 1
+
+
+"""Checks pages are requested ahead of the consumer, at most prefetch_pages ahead"""
+
+
+def test_list_items_prefetches_bounded(monkeypatch):
+    calls = []
+    items = listutils.list_items(
+        fake_list_fn(list(range(20)), calls), page_size=2, prefetch_pages=1
+    )
+    assert next(items) == 0
+    deadline = time.time() + 5
+    while len(calls) < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    """the page consumed, the page queued and the page waiting for the queue"""
+    assert len(calls) == 3
+    items.close()
+    time.sleep(listutils.Prefetcher.POLL_SECONDS * 3)
+    assert len(calls) == 3
+    assert list(items) == []
+
+
+def test_prefetch_raises_errors_to_the_consumer():
+    def fail_on_second_page(limit, watch, _continue=None, **kwargs):
+        if _continue:
+            raise RuntimeError("forbidden")
+        return {"metadata": {"continue": "2"}, "items": [0, 1]}
+
+    items = listutils.list_items(fail_on_second_page, page_size=2, prefetch_pages=1)
+    assert next(items) == 0
+    assert next(items) == 1
+    with pytest.raises(RuntimeError):
+        next(items)
+
+
+def test_page_size_from_environment(monkeypatch):
+    monkeypatch.setenv("PAGE_SIZE", "250")
+    assert listutils.get_page_size() == 250
+    monkeypatch.setenv("PAGE_SIZE", "not-a-number")
+    assert listutils.get_page_size() == listutils.DEFAULT_PAGE_SIZE
+
+
+"""Checks only the first page is read from the watch cache, later pages use the continue token"""
+
+
+def test_cached_lists_read_the_watch_cache():
+    calls = []
+    list(listutils.list_pages(fake_list_fn(list(range(5)), calls), page_size=3, consistency="cached"))
+    assert calls[0]["resource_version"] == "0"
+    assert calls[0]["resource_version_match"] == "NotOlderThan"
+    assert "resource_version" not in calls[1]
+    assert calls[1]["_continue"] == "3"
+
+
+def test_consistent_lists_are_opt_in(monkeypatch):
+    monkeypatch.delenv("LIST_CONSISTENCY", raising=False)
+    assert listutils.get_consistency() == listutils.CACHED
+    monkeypatch.setenv("LIST_CONSISTENCY", "consistent")
+    assert listutils.get_consistency() == listutils.CONSISTENT
+    calls = []
+    list(listutils.list_pages(fake_list_fn(list(range(5)), calls), page_size=3, consistency="consistent"))
+    assert all("resource_version" not in call for call in calls)
+
+
+def test_watch_cache_is_paged_from_1_34():
+    assert listutils.pages_watch_cache("1.34")
+    assert listutils.pages_watch_cache("2.0")
+    assert not listutils.pages_watch_cache("1.33")
+    assert not listutils.pages_watch_cache(None)
+    assert not listutils.pages_watch_cache("latest")
+
+
+class FakeApiClient:
+    def __init__(self):
+        self.requests = []
+
+    def call_api(self, path, method, query_params, header_params, **kwargs):
+        self.requests.append({"path": path, "query": dict(query_params), **header_params})
+        body = {"metadata": {"continue": "", "resourceVersion": "7"}, "items": [{"metadata": {"name": "a"}}]}
+        return SimpleNamespace(data=json.dumps(body).encode())
+
+
+"""Checks metadata only lists send the PartialObjectMetadataList Accept header and return dicts"""
+
+
+def test_raw_list_fn_requests_metadata_only():
+    api_client = FakeApiClient()
+    list_fn = listutils.raw_list_fn(api_client, "/api/v1/pods", listutils.METADATA_ACCEPT)
+    items = list(listutils.list_items(list_fn, page_size=100, consistency="consistent"))
+    assert items == [{"metadata": {"name": "a"}}]
+    assert api_client.requests[0]["Accept"] == listutils.METADATA_ACCEPT
+    assert api_client.requests[0]["query"] == {"watch": False, "limit": 100}
@@ -0,0 +1,70 @@
+import time
+
+import eksconfigauthutils.netpolutils as netpolutils
+
+
+def make_index():
+    index = netpolutils.PodIndex()
+    index.add("apps", "web", {"app": "web", "tier": "frontend"})
+    index.add("apps", "api", {"app": "api", "tier": "backend"})
+    index.add("apps", "debug", {})
+    index.add("db", "postgres", {"app": "postgres"})
+    return index
+
+
+def names(index, pods):
+    return sorted(index.names[pod] for pod in pods)
+
+
+def test_select():
+    index = make_index()
+    assert names(index, index.select("apps", {"matchLabels": {"app": "web"}})) == ["apps/web"]
+    assert names(index, index.select("apps", {})) == ["apps/api", "apps/debug", "apps/web"]
+    selector = {
+        "matchExpressions": [
+            {"key": "tier", "operator": "In", "values": ["frontend", "backend"]},
+            {"key": "app", "operator": "NotIn", "values": ["web"]},
+        ]
+    }
+    assert names(index, index.select("apps", selector)) == ["apps/api"]
+    selector = {"matchExpressions": [{"key": "tier", "operator": "DoesNotExist"}]}
+    assert names(index, index.select("apps", selector)) == ["apps/debug"]
+    selector = {"matchExpressions": [{"key": "app", "operator": "Exists"}]}
+    assert names(index, index.select("db", selector)) == ["db/postgres"]
+
+
+def test_policy_types():
+    assert netpolutils.policy_types({"spec": {}}) == ["Ingress"]
+    assert netpolutils.policy_types({"spec": {"egress": [{}]}}) == ["Ingress", "Egress"]
+    assert netpolutils.policy_types({"spec": {"policyTypes": ["Egress"]}}) == ["Egress"]
+
+
+def test_uncovered_pods():
+    index = make_index()
+    policies = [
+        ("apps", {"matchLabels": {"tier": "frontend"}}, ["Ingress"]),
+        ("apps", {"matchLabels": {"tier": "backend"}}, ["Ingress", "Egress"]),
+        ("db", {}, ["Ingress", "Egress"]),
+    ]
+    assert netpolutils.uncovered_pods(index, policies) == {
+        "Ingress": ["apps/debug"],
+        "Egress": ["apps/debug", "apps/web"],
+    }
+
+
+"""Checks coverage of 5k policies over 50k pods stays within a second"""
+
+
+def test_coverage_scales():
+    index = netpolutils.PodIndex()
+    for pod in range(50000):
+        index.add(f"ns-{pod % 500}", f"pod-{pod}", {"app": f"app-{pod % 5000}", "team": "a"})
+    policies = [
+        (f"ns-{policy % 500}", {"matchLabels": {"app": f"app-{policy}", "team": "a"}}, ["Ingress"])
+        for policy in range(5000)
+    ]
+    start = time.perf_counter()
+    uncovered = netpolutils.uncovered_pods(index, policies)
+    assert time.perf_counter() - start < 1
+    assert uncovered["Ingress"] == []
+    assert len(uncovered["Egress"]) == 50000
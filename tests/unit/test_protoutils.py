@@ -0,0 +1,113 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import eksconfigauthutils.listutils as listutils
+import eksconfigauthutils.protoutils as protoutils
+from eksconfigauthutils.protoutils import STRING, MESSAGE
+
+POD = {
+    "metadata": {
+        "name": "web",
+        "namespace": "default",
+        "labels": {"app": "web"},
+        "ownerReferences": [{"kind": "ReplicaSet", "name": "web-5d8f", "controller": True}],
+    },
+    "spec": {
+        "containers": [
+            {
+                "name": "app",
+                "image": "busybox",
+                "securityContext": {"allowPrivilegeEscalation": True, "runAsUser": 0},
+            }
+        ]
+    },
+    "status": {"phase": "Running"},
+}
+
+"""a pod schema with a field the decoder doesn't know about, like the fields of a real response"""
+CONTAINER_WITH_ENV = {
+    **protoutils.CONTAINER,
+    7: ("env", MESSAGE, True, {1: ("name", STRING, False, None)}),
+}
+POD_WITH_ENV = {
+    **protoutils.POD,
+    2: ("spec", MESSAGE, False, {2: ("containers", MESSAGE, True, CONTAINER_WITH_ENV)}),
+}
+
+
+def pod_list(*pods):
+    return {"metadata": {"resourceVersion": "42", "continue": "token"}, "items": list(pods)}
+
+
+def test_pod_list_round_trip():
+    encoded = protoutils.encode_list(pod_list(POD), protoutils.POD_LIST)
+    assert protoutils.decode_list(encoded, protoutils.POD_LIST) == pod_list(POD)
+
+
+def test_unknown_fields_are_skipped():
+    pod = json.loads(json.dumps(POD))
+    pod["spec"]["containers"][0]["env"] = [{"name": "VAR"}]
+    encoded = protoutils.encode_list(pod_list(pod), protoutils.list_schema(POD_WITH_ENV))
+    decoded = protoutils.decode_list(encoded, protoutils.POD_LIST)
+    assert "env" not in decoded["items"][0]["spec"]["containers"][0]
+    assert decoded["items"][0]["spec"]["containers"][0]["name"] == "app"
+
+
+def test_malformed_messages_raise_decode_error():
+    encoded = protoutils.encode_list(pod_list(POD), protoutils.POD_LIST)
+    with pytest.raises(protoutils.DecodeError):
+        protoutils.decode_list(encoded[:-5], protoutils.POD_LIST)
+    with pytest.raises(protoutils.DecodeError):
+        protoutils.decode_list(b'{"items": []}', protoutils.POD_LIST)
+
+
+class FakeApiClient:
+    """Answers protobuf requests with the given body and content type, JSON requests with JSON"""
+
+    def __init__(self, protobuf_body, content_type=listutils.PROTOBUF_CONTENT_TYPE):
+        self.protobuf_body = protobuf_body
+        self.content_type = content_type
+        self.accepts = []
+
+    def call_api(self, path, method, header_params, **kwargs):
+        self.accepts.append(header_params["Accept"])
+        if header_params["Accept"] == listutils.PROTOBUF_ACCEPT:
+            return SimpleNamespace(
+                data=self.protobuf_body, headers={"Content-Type": self.content_type}
+            )
+        return SimpleNamespace(
+            data=json.dumps(pod_list(POD)).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+
+
+"""Checks pods are listed as protobuf when enabled and JSON is used when protobuf can't be"""
+
+
+def test_protobuf_lists(monkeypatch):
+    monkeypatch.setenv("LIST_ENCODING", "protobuf")
+    api_client = FakeApiClient(protoutils.encode_list(pod_list(POD), protoutils.POD_LIST))
+    list_fn = listutils.raw_list_fn(api_client, "/api/v1/pods", protobuf_schema=protoutils.POD_LIST)
+    assert list_fn(limit=10) == pod_list(POD)
+    assert api_client.accepts == [listutils.PROTOBUF_ACCEPT]
+
+
+def test_json_answers_and_decode_errors_fall_back_to_json(monkeypatch):
+    monkeypatch.setenv("LIST_ENCODING", "protobuf")
+    api_client = FakeApiClient(json.dumps(pod_list(POD)).encode(), "application/json")
+    list_fn = listutils.raw_list_fn(api_client, "/apis/example.com/v1/widgets", protobuf_schema=protoutils.POD_LIST)
+    assert list_fn(limit=10) == pod_list(POD)
+    assert api_client.accepts == [listutils.PROTOBUF_ACCEPT]
+    api_client = FakeApiClient(protoutils.MAGIC + b"\x12\x05ab")
+    list_fn = listutils.raw_list_fn(api_client, "/api/v1/pods", protobuf_schema=protoutils.POD_LIST)
+    assert list_fn(limit=10) == pod_list(POD)
+    assert api_client.accepts == [listutils.PROTOBUF_ACCEPT, listutils.JSON_ACCEPT]
+
+
+def test_json_is_the_default_encoding():
+    api_client = FakeApiClient(b"")
+    list_fn = listutils.raw_list_fn(api_client, "/api/v1/pods", protobuf_schema=protoutils.POD_LIST)
+    list_fn(limit=10)
+    assert api_client.accepts == [listutils.JSON_ACCEPT]
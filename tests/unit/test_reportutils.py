@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+import eksconfigauthutils.checkengine as checkengine
+import eksconfigauthutils.clientutils as clientutils
+import eksconfigauthutils.reportutils as reportutils
+import eksconfigauthutils.stateutils as stateutils
+
+EVENT = {
+    "configRuleArn": "arn:aws:config:us-east-1:111111111111:config-rule/config-rule-1",
+    "configRuleName": "eks-privEscalation-rule",
+    "accountId": "111111111111",
+    "resultToken": "token",
+}
+INVOKING_EVENT = {"notificationCreationTime": "2026-10-18T00:00:00.000Z"}
+
+
+class FakeAWS:
+    """SQS rejecting the findings of rejected resources, and Config recording the evaluations put"""
+
+    def __init__(self):
+        self.rejected = set()
+        self.sent = []
+        self.evaluations = []
+
+    def send_message_batch(self, QueueUrl, Entries):
+        response = {"Successful": [], "Failed": []}
+        for entry in Entries:
+            message = json.loads(entry["MessageBody"])
+            if message["resourceId"] in self.rejected:
+                response["Failed"].append({"Id": entry["Id"], "Code": "InternalError"})
+            else:
+                self.sent.append(message)
+                response["Successful"].append({"Id": entry["Id"]})
+        return response
+
+    def put_evaluations(self, Evaluations, ResultToken, TestMode):
+        self.evaluations.extend(Evaluations)
+        return {"FailedEvaluations": []}
+
+    def describe_config_rule_evaluation_status(self, ConfigRuleNames):
+        return {"ConfigRulesEvaluationStatus": [{}]}
+
+
+@pytest.fixture
+def aws(monkeypatch):
+    aws = FakeAWS()
+    monkeypatch.setattr(clientutils, "_clients", {"sqs": aws, "config": aws})
+    monkeypatch.setattr(stateutils, "_store", stateutils.MemoryStateStore())
+    monkeypatch.delenv("EVALUATION_RUNTIME", raising=False)
+    return aws
+
+
+def evaluation(cluster, compliance_type):
+    return (
+        cluster,
+        {
+            "compliance_type": compliance_type,
+            "annotation": f"{cluster} is {compliance_type}",
+            "clusterarn": f"arn:aws:eks:us-east-1:111111111111:cluster/{cluster}",
+        },
+    )
+
+
+"""Checks every cluster is put to Config and a finding not accepted by SQS is sent again on the next run"""
+
+
+def test_unsent_findings_are_sent_again(aws):
+    evaluations = [evaluation("a", "NON_COMPLIANT"), evaluation("b", "COMPLIANT")]
+    aws.rejected.add(evaluations[1][1]["clusterarn"])
+    reportutils.report_evaluations(EVENT, INVOKING_EVENT, evaluations, "queue")
+    assert [message["resourceId"] for message in aws.sent] == [evaluations[0][1]["clusterarn"]]
+    assert aws.sent[0]["first_recorded_time"] == INVOKING_EVENT["notificationCreationTime"]
+    assert [e["Annotation"] for e in aws.evaluations] == [reportutils.SECURITY_HUB_ANNOTATION] * 2
+    aws.rejected.clear()
+    aws.sent.clear()
+    reportutils.report_evaluations(
+        EVENT, INVOKING_EVENT, evaluations, "queue", config_annotation=lambda e: e["annotation"]
+    )
+    assert [message["resourceId"] for message in aws.sent] == [evaluations[1][1]["clusterarn"]]
+    assert aws.evaluations[-1]["Annotation"] == "b is COMPLIANT"
+
+
+def test_rules_without_a_queue_only_put_evaluations(aws):
+    reportutils.report_evaluations(
+        EVENT, INVOKING_EVENT, [evaluation("a", "NON_COMPLIANT")], None
+    )
+    assert aws.sent == []
+    assert [e["Annotation"] for e in aws.evaluations] == ["a is NON_COMPLIANT"]
+
+
+"""Checks the verdict of a report is only recorded once its finding was sent"""
+
+
+def test_verdicts_are_recorded_once_sent(aws):
+    evaluations = [evaluation("a", "NON_COMPLIANT")]
+    evaluations[0][1][checkengine.CHANGED_VERDICT] = "privEscalation"
+    clusterarn = evaluations[0][1]["clusterarn"]
+    store = stateutils.get_state_store()
+    aws.rejected.add(clusterarn)
+    reportutils.report_evaluations(EVENT, INVOKING_EVENT, evaluations, "queue")
+    assert stateutils.get_verdict(store, "privEscalation", clusterarn) is None
+    aws.rejected.clear()
+    reportutils.report_evaluations(EVENT, INVOKING_EVENT, evaluations, "queue")
+    assert stateutils.get_verdict(store, "privEscalation", clusterarn) == "NON_COMPLIANT"
@@ -0,0 +1,106 @@
+import importlib.util
+import json
+import os
+
+import pytest
+
+SECHUB_LAMBDA = os.path.join(
+    os.path.dirname(__file__), "..", "..", "resources", "sechub-lambda", "index.py"
+)
+
+
+class FakeSecurityHub:
+    def __init__(self, failing_resources=()):
+        self.failing_resources = failing_resources
+        self.imports = []
+
+    def batch_import_findings(self, Findings):
+        self.imports.append(Findings)
+        failed = [
+            {"Id": finding["Id"], "ErrorCode": "InvalidInput"}
+            for finding in Findings
+            if finding["Resources"][0]["Id"] in self.failing_resources
+        ]
+        return {"FailedCount": len(failed), "FailedFindings": failed}
+
+
+@pytest.fixture
+def sechub_lambda(monkeypatch):
+    spec = importlib.util.spec_from_file_location("sechub_index", SECHUB_LAMBDA)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    monkeypatch.setattr(module, "get_description_of_rule", lambda configrule: configrule)
+    return module
+
+
+def record(message_id, resource_id):
+    body = {
+        "configRuleArn": "arn:aws:config:us-east-1:111111111111:config-rule/eks",
+        "configRule": "eks-logCheck-rule",
+        "accountid": "111111111111",
+        "event_details": "details",
+        "compliance_status": "NON_COMPLIANT",
+        "first_recorded_time": "2022-01-01T00:00:00Z",
+        "event_time": "2022-01-01T00:00:00Z",
+        "resourceId": resource_id,
+    }
+    return {"messageId": message_id, "body": json.dumps(body), "awsRegion": "us-east-1"}
+
+
+"""Checks that every record is imported and only failed records are returned for retry"""
+
+
+def test_every_record_is_imported_and_failures_reported(sechub_lambda, monkeypatch):
+    sechub = FakeSecurityHub(failing_resources=["cluster-2"])
+    monkeypatch.setattr(sechub_lambda.boto3, "client", lambda service: sechub)
+    event = {
+        "Records": [record(f"m{i}", f"cluster-{i}") for i in range(150)]
+        + [{"messageId": "bad", "body": "not json", "awsRegion": "us-east-1"}]
+    }
+    response = sechub_lambda.lambda_handler(event, None)
+    assert [len(findings) for findings in sechub.imports] == [100, 50]
+    assert sorted(
+        failure["itemIdentifier"] for failure in response["batchItemFailures"]
+    ) == ["bad", "m2"]
+
+
+"""Checks long annotations are cut to the lengths Security Hub accepts"""
+
+
+def test_long_annotations_are_truncated(sechub_lambda):
+    details = json.loads(record("m", "cluster")["body"])
+    details["event_details"] = "pod-name " * 1000
+    finding = sechub_lambda.map_config_findings_to_sh(details, "us-east-1")
+    text = finding["Remediation"]["Recommendation"]["Text"]
+    assert len(text) == sechub_lambda.MAX_RECOMMENDATION_TEXT
+    assert text.endswith("...")
+    assert len(finding["UserDefinedFields"]["eventdata"]) == sechub_lambda.MAX_USER_DEFINED_FIELD
+
+
+class FakeConfig:
+    def __init__(self):
+        self.calls = 0
+
+    def get_paginator(self, operation_name):
+        def paginate():
+            self.calls += 1
+            return [
+                {"ConfigRules": [{"ConfigRuleName": "eks-a-rule", "Description": "a"}]},
+                {"ConfigRules": [{"ConfigRuleName": "eks-b-rule"}]},
+            ]
+
+        return type("Paginator", (), {"paginate": staticmethod(paginate)})
+
+
+"""Checks that descriptions of all eks rules are loaded once and reused"""
+
+
+def test_rule_descriptions_are_cached(monkeypatch):
+    spec = importlib.util.spec_from_file_location("sechub_index", SECHUB_LAMBDA)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    config = FakeConfig()
+    monkeypatch.setattr(module.boto3, "client", lambda service: config)
+    assert module.get_description_of_rule("eks-a-rule") == "a"
+    assert module.get_description_of_rule("eks-b-rule") == "eks-b-rule"
+    assert config.calls == 1
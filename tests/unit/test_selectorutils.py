@@ -0,0 +1,73 @@
+import pytest
+
+import eksconfigauthutils.selectorutils as selectorutils
+
+
+def pod(namespace, phase="Running", labels=None):
+    return {
+        "metadata": {"name": "pod", "namespace": namespace, "labels": labels or {}},
+        "status": {"phase": phase},
+    }
+
+
+@pytest.mark.parametrize(
+    "selector,labels,expected",
+    [
+        ("app=web", {"app": "web"}, True),
+        ("app==web", {"app": "api"}, False),
+        ("app!=web", {}, True),
+        ("tier in (web, api)", {"tier": "api"}, True),
+        ("tier notin (web,api)", {"tier": "api"}, False),
+        ("exempt", {"exempt": "true"}, True),
+        ("!exempt", {"exempt": "true"}, False),
+        ("app=web,!exempt", {"app": "web"}, True),
+    ],
+)
+def test_label_selectors(selector, labels, expected):
+    requirements = selectorutils.parse_label_selector(selector)
+    assert selectorutils.labels_match(requirements, labels) == expected
+
+
+def test_label_selector_round_trip():
+    text = "app=web,tier in (web,api),!exempt"
+    assert selectorutils.format_label_selector(selectorutils.parse_label_selector(text)) == text
+
+
+def test_exemptions_compile_to_selectors():
+    selector = selectorutils.compile_exemptions(
+        {
+            "namespaces": ["kube-system", "kube-*"],
+            "labelSelector": "compliance/exempt!=true",
+            "phases": ["Running", "Pending"],
+        },
+        "pods",
+    )
+    assert selector.field_selector == (
+        "metadata.namespace!=kube-system,status.phase!=Succeeded,status.phase!=Failed,status.phase!=Unknown"
+    )
+    assert selector.label_selector == "compliance/exempt!=true"
+    assert selector.matches(pod("apps"))
+    assert not selector.matches(pod("kube-public"))
+    assert not selector.matches(pod("apps", phase="Succeeded"))
+    assert not selector.matches(pod("apps", labels={"compliance/exempt": "true"}))
+
+
+def test_namespace_exemptions_of_namespaces():
+    selector = selectorutils.compile_exemptions({"namespaces": ["kube-system"]}, "namespaces")
+    assert selector.field_selector == "metadata.name!=kube-system"
+    assert not selector.matches({"metadata": {"name": "kube-system"}})
+
+
+"""Checks fields missing from metadata only objects are left to the API server"""
+
+
+def test_metadata_only_objects_skip_status_requirements():
+    selector = selectorutils.compile_exemptions({"phases": ["Running"]}, "pods")
+    assert selector.matches({"metadata": {"name": "pod", "namespace": "apps"}})
+
+
+def test_invalid_exemptions(monkeypatch):
+    monkeypatch.setenv("EXEMPTIONS", "{not json")
+    assert selectorutils.get_exemptions() == {}
+    monkeypatch.delenv("EXEMPTIONS")
+    assert selectorutils.get_exemptions() == {}
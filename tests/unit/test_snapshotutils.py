@@ -0,0 +1,122 @@
+import json
+import time
+
+import pytest
+
+import eksconfigauthutils.snapshotutils as snapshotutils
+from eksconfigauthutils.localclients import LocalS3Client
+
+
+def pods(*names):
+    return [
+        {
+            "metadata": {"name": name, "namespace": "default"},
+            "spec": {"containers": [{"name": name, "image": "busybox"}]},
+        }
+        for name in names
+    ]
+
+
+@pytest.fixture
+def store(tmp_path):
+    return snapshotutils.SnapshotStore(
+        "snapshots", s3=LocalS3Client(str(tmp_path)), ttl=300, wait_seconds=2
+    )
+
+
+def lister(calls, *pages):
+    """Returns a list_fn serving pages at resourceVersion 100, counting the pages listed"""
+
+    def list_fn():
+        for page in pages:
+            calls.append(page)
+            yield "100", page
+
+    return list_fn
+
+
+def names(pages):
+    return [[pod["metadata"]["name"] for pod in page] for page in pages]
+
+
+"""Checks the first lambda lists and saves the snapshot and the next one only reads it"""
+
+
+def test_snapshot_is_shared(store):
+    calls = []
+    list_fn = lister(calls, pods("web"), pods("api"))
+    first = list(store.pages("test", "pods", list_fn))
+    second = list(store.pages("test", "pods", list_fn))
+    assert len(calls) == 2
+    assert names(first) == names(second) == [["web"], ["api"]]
+    assert second[0][0]["spec"]["containers"][0]["image"] == "busybox"
+    manifest = store.load("test", "pods")
+    assert (manifest["resource_version"], manifest["pages"], manifest["items"]) == ("100", 2, 2)
+
+
+"""Checks each page is written as it is listed and the snapshot only published after the last"""
+
+
+def test_pages_are_written_as_they_are_listed(store):
+    calls = []
+    pages = store.pages("test", "pods", lister(calls, pods("web"), pods("api")))
+    assert names([next(pages)]) == [["web"]]
+    assert len(calls) == 1
+    assert store.load("test", "pods") is None
+    assert store.leased("test", "pods")
+    assert names(pages) == [["api"]]
+    assert store.load("test", "pods")["pages"] == 2
+    assert not store.leased("test", "pods")
+
+
+def test_stopped_listing_saves_no_snapshot(store):
+    calls = []
+    pages = store.pages("test", "pods", lister(calls, pods("web"), pods("api")))
+    next(pages)
+    pages.close()
+    assert len(calls) == 1
+    assert store.load("test", "pods") is None
+    assert not store.leased("test", "pods")
+
+
+def test_stale_snapshot_is_listed_again(store):
+    list(store.pages("test", "pods", lister([], pods("web"))))
+    store.ttl = -1
+    assert store.load("test", "pods") is None
+    calls = []
+    assert names(store.pages("test", "pods", lister(calls, pods("api")))) == [["api"]]
+    assert len(calls) == 1
+    store.ttl = 300
+    assert names(store.pages("test", "pods", lambda: pytest.fail("listed"))) == [["api"]]
+
+
+def test_lease_holder_is_waited_for(store, monkeypatch):
+    assert store.acquire("test", "pods")
+    assert not store.acquire("test", "pods")
+
+    def sleep(seconds):
+        list(store.write_pages("test", "pods", iter([("100", pods("web"))])))
+
+    monkeypatch.setattr(snapshotutils.time, "sleep", sleep)
+    pages = store.pages("test", "pods", lambda: pytest.fail("listed"))
+    assert names(pages) == [["web"]]
+
+
+def test_released_lease_without_snapshot_is_listed(store, monkeypatch):
+    assert store.acquire("test", "pods")
+    monkeypatch.setattr(
+        snapshotutils.time, "sleep", lambda seconds: store.release("test", "pods")
+    )
+    calls = []
+    assert names(store.pages("test", "pods", lister(calls, pods("web")))) == [["web"]]
+    assert len(calls) == 1
+    assert store.load("test", "pods") is None
+
+
+def test_expired_lease_is_taken_over(store):
+    store.client().put_object(
+        Bucket="snapshots",
+        Key=store.lease_key("test", "pods"),
+        Body=json.dumps({"expires_at": time.time() - 1}),
+    )
+    assert store.acquire("test", "pods")
@@ -0,0 +1,81 @@
+import os
+import json
+
+import eksconfigauthutils.sqsutils as sqsutils
+from eksconfigauthutils.localclients import LocalS3Client, LocalSQSClient
+
+QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/123456789012/sec-hub-findings-sqs"
+
+
+def finding(resource_id, details="pods"):
+    return {
+        "configRule": "eks-privEscalation-rule",
+        "resourceId": resource_id,
+        "event_details": details,
+    }
+
+
+"""Checks findings are sent in batches of 10 and every key is reported as sent"""
+
+
+def test_flush_sends_batches_of_10():
+    sqs = LocalSQSClient()
+    producer = sqsutils.FindingsProducer(QUEUE_URL, bucket="", sqs=sqs)
+    for i in range(25):
+        producer.add(finding(f"arn-{i}"), f"arn-{i}")
+    sent = producer.flush()
+    assert sent == {f"arn-{i}" for i in range(25)}
+    assert len(sqs.messages) == 25
+    assert producer.pending == []
+
+
+def test_batches_respect_size_limit():
+    producer = sqsutils.FindingsProducer(QUEUE_URL, bucket="")
+    entries = [(str(i), "x" * 100000) for i in range(5)]
+    batches = list(producer.batches(entries))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+def test_large_findings_are_compressed():
+    sqs = LocalSQSClient()
+    producer = sqsutils.FindingsProducer(QUEUE_URL, bucket="", sqs=sqs)
+    message = finding("arn", "pod-name " * 1000)
+    producer.add(message, "arn")
+    producer.flush()
+    body = sqs.messages[0]["Body"]
+    assert json.loads(body)["encoding"] == "gzip"
+    assert len(body) < len(json.dumps(message))
+    assert sqsutils.decode_message(body) == message
+
+
+def test_findings_over_claim_check_size_go_to_s3(tmp_path):
+    sqs = LocalSQSClient()
+    s3 = LocalS3Client(str(tmp_path))
+    producer = sqsutils.FindingsProducer(
+        QUEUE_URL, bucket="findings", sqs=sqs, s3=s3, claim_check_bytes=100
+    )
+    message = finding("arn", "pod-name " * 1000)
+    producer.add(message, "arn")
+    assert producer.flush() == {"arn"}
+    pointer = json.loads(sqs.messages[0]["Body"])
+    assert pointer["encoding"] == "s3"
+    assert pointer["bucket"] == "findings"
+    assert sqsutils.decode_message(sqs.messages[0]["Body"], s3=s3) == message
+
+
+"""Checks a finding too large for SQS is dropped when there is no bucket for a claim check"""
+
+
+def test_findings_over_sqs_limit_without_bucket_are_dropped():
+    sqs = LocalSQSClient()
+    producer = sqsutils.FindingsProducer(QUEUE_URL, bucket="", sqs=sqs, claim_check_bytes=100)
+    producer.add(finding("small"), "small")
+    producer.add(finding("large", "pod-name " * 1000), "large")
+    producer.add(finding("huge", os.urandom(200000).hex()), "huge")
+    assert producer.flush() == {"small", "large"}
+    assert len(sqs.messages) == 2
+
+
+def test_plain_messages_are_decoded():
+    message = finding("arn")
+    assert sqsutils.decode_message(json.dumps(message)) == message
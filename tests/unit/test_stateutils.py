@@ -0,0 +1,36 @@
+import pytest
+
+import eksconfigauthutils.stateutils as stateutils
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return stateutils.MemoryStateStore()
+    return stateutils.SQLiteStateStore(str(tmp_path / "state.db"))
+
+
+"""Checks findings are only reported again when they change for the same cluster"""
+
+
+def test_compliance_change_per_resource(store):
+    rule = "eks-privEscalation-rule"
+    assert stateutils.check_compliancechange(store, rule, "arn-a", "COMPLIANT", "ok")
+    stateutils.record_compliance(store, rule, "arn-a", "COMPLIANT", "ok")
+    assert not stateutils.check_compliancechange(store, rule, "arn-a", "COMPLIANT", "ok")
+    assert stateutils.check_compliancechange(store, rule, "arn-b", "COMPLIANT", "ok")
+    assert stateutils.check_compliancechange(
+        store, rule, "arn-a", "NON_COMPLIANT", "pods: [a]"
+    )
+    stateutils.record_compliance(store, rule, "arn-a", "NON_COMPLIANT", "pods: [a]")
+    assert stateutils.check_compliancechange(
+        store, rule, "arn-a", "NON_COMPLIANT", "pods: [a, b]"
+    )
+    assert store.get(rule, "arn-a")["compliance_type"] == "NON_COMPLIANT"
+
+
+def test_verdict_compares_compliance_type(store):
+    rule = "eks-privEscalation-rule"
+    stateutils.record_compliance(store, rule, "arn-a", "NON_COMPLIANT", "pods: [a, b]")
+    assert not stateutils.check_compliancechange(store, rule, "arn-a", "NON_COMPLIANT", None)
+    assert stateutils.check_compliancechange(store, rule, "arn-a", "COMPLIANT", None)